@@ -1,9 +1,85 @@
-import { marshalMaskRgb, unmarshalMaskRgb } from "./marshalling";
+import { Node } from "../src/mung/Node";
+import {
+  marshalLightnessPlane,
+  unmarshalMaskAlpha,
+  unmarshalMungNodeBatch,
+} from "./marshalling";
 import { PyodideWorkerConnection } from "./PyodideWorkerConnection";
 
+/**
+ * Names of operations that can be run in a batch,
+ * see OPERATIONS in mstudio.background_image_tools.batch
+ */
+export type BackgroundToolOperation = "otsu" | "sauvola" | "stafflines";
+
+/**
+ * An image that can be registered in python, such as the background image
+ * store. It is identified by the object itself, its pixels are read only
+ * when it gets (re)registered.
+ */
+export interface RegistrableImage {
+  getFullImageData(): ImageData;
+}
+
+/**
+ * How to find the connected components in a background image region
+ */
+export interface ComponentExtractionOptions {
+  /** The binarization to use, "otsu" by default */
+  readonly operation?: "otsu" | "sauvola";
+
+  /** Smaller components are dropped as noise (4 pixels by default) */
+  readonly minArea?: number;
+
+  /** Larger components are dropped (no limit by default) */
+  readonly maxArea?: number;
+}
+
+/**
+ * Nodes created by the staff pipeline
+ */
+export interface StaffPipelineResult {
+  /** The staffLine, staff and staffSpace nodes, with temporary IDs */
+  readonly nodes: Node[];
+
+  /** Syntax links between the nodes, as [from, to] temporary IDs */
+  readonly links: [number, number][];
+
+  /** How many milliseconds each stage took */
+  readonly timings: Record<string, number>;
+}
+
+/**
+ * Parameter values to try when sweeping the staffline detection
+ */
+export interface StafflineParameterSweep {
+  /** Widths of the horizontal structuring element (default 50) */
+  readonly morphologyWidths: number[];
+
+  /** Odd adaptive threshold block sizes (default 101) */
+  readonly blockSizes: number[];
+
+  /** Values subtracted from the local mean (default 10) */
+  readonly cs: number[];
+}
+
+/**
+ * One combination of parameters from the sweep with its staffline mask
+ */
+export interface StafflineSweepResult {
+  readonly morphologyWidth: number;
+  readonly blockSize: number;
+  readonly c: number;
+  readonly mask: ImageData;
+}
+
 /**
  * Exposes python operations for tools that take the background image
  * as input to perform some smart binarization.
+ *
+ * Only single-channel planes cross the worker boundary: the lightness
+ * of the image goes in and the alpha of the mask comes out. The mask is
+ * expanded into RGBA only when unmarshalled for display.
  */
 export class BackgroundImageToolsApi {
   private connection: PyodideWorkerConnection;
@@ -18,21 +94,21 @@ export class BackgroundImageToolsApi {
   public async otsuBinarizeRegion(region: ImageData): Promise<ImageData> {
     const result = await this.connection.executePython(
       `
-        from mstudio.marshalling import marshal_mask_rgba, unmarshal_mask_rgba
+        from mstudio.marshalling import marshal_mask_alpha, unmarshal_plane
         from mstudio.background_image_tools.otsu_binarize_region \\
-          import otsu_binarize_region
+          import otsu_binarize_lightness
         
-        region = unmarshal_mask_rgba(marshalled_region)
-        mask = otsu_binarize_region(region)
-        marshalled_mask = marshal_mask_rgba(mask)
+        lightness = unmarshal_plane(marshalled_lightness)
+        mask = otsu_binarize_lightness(lightness)
+        marshalled_mask = marshal_mask_alpha(mask)
 
         marshalled_mask  # return
       `,
       {
-        marshalled_region: marshalMaskRgb(region),
+        marshalled_lightness: marshalLightnessPlane(region),
       },
     );
-    return unmarshalMaskRgb(result);
+    return unmarshalMaskAlpha(result);
   }
 
   /**
@@ -41,20 +117,556 @@ export class BackgroundImageToolsApi {
   public async detectStafflines(region: ImageData): Promise<ImageData> {
     const result = await this.connection.executePython(
       `
-        from mstudio.marshalling import marshal_mask_rgba, unmarshal_mask_rgba
+        from mstudio.marshalling import marshal_mask_alpha, unmarshal_plane
         from mstudio.background_image_tools.detect_stafflines \\
-          import detect_stafflines
+          import detect_stafflines_in_lightness
         
-        region = unmarshal_mask_rgba(marshalled_region)
-        mask = detect_stafflines(region)
-        marshalled_mask = marshal_mask_rgba(mask)
+        lightness = unmarshal_plane(marshalled_lightness)
+        mask = detect_stafflines_in_lightness(lightness)
+        marshalled_mask = marshal_mask_alpha(mask)
+
+        marshalled_mask  # return
+      `,
+      {
+        marshalled_lightness: marshalLightnessPlane(region),
+      },
+    );
+    return unmarshalMaskAlpha(result);
+  }
+
+  /////////////////////////////////
+  // Registered background image //
+  /////////////////////////////////
+
+  /**
+   * Python handles of images that were registered in the worker,
+   * as promises so that concurrent calls share one registration
+   */
+  private imageHandles = new WeakMap<RegistrableImage, Promise<number>>();
+
+  /**
+   * Sends the whole image to python to be kept there, so that region
+   * operations can refer to it by a rectangle without another transfer.
+   * Only the lightness plane is sent, since that is all the tools need.
+   * Does nothing if the image is already registered (or being registered).
+   */
+  public async registerImage(image: RegistrableImage): Promise<number> {
+    let handle = this.imageHandles.get(image);
+    if (handle === undefined) {
+      handle = this.connection.executePython(
+        `
+          from mstudio.marshalling import unmarshal_plane
+          from mstudio.background_image_tools.image_registry \\
+            import image_registry
+
+          lightness = unmarshal_plane(marshalled_lightness)
+          handle = image_registry.register_image(lightness)
+
+          handle  # return
+        `,
+        {
+          marshalled_lightness: marshalLightnessPlane(
+            image.getFullImageData(),
+          ),
+        },
+      );
+      this.imageHandles.set(image, handle);
+    }
+    try {
+      return await handle;
+    } catch (e) {
+      // let the next call try again
+      if (this.imageHandles.get(image) === handle) {
+        this.imageHandles.delete(image);
+      }
+      throw e;
+    }
+  }
+
+  /**
+   * Releases the image from python memory
+   */
+  public async releaseImage(image: RegistrableImage): Promise<void> {
+    const handle = this.imageHandles.get(image);
+    if (handle === undefined) {
+      return;
+    }
+    this.imageHandles.delete(image);
+
+    await this.connection.executePython(
+      `
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+
+        image_registry.release_image(handle)
+      `,
+      {
+        handle: await handle,
+      },
+    );
+  }
+
+  /**
+   * Runs a python operation on a registered image. The python code receives
+   * the image "handle" together with the given context and returns None
+   * if the image is no longer registered. In that case, the image gets
+   * registered again (it may have been evicted from python memory
+   * in the meantime).
+   */
+  private async executeOnImage(
+    image: RegistrableImage,
+    pythonCode: string,
+    context: object,
+  ): Promise<any> {
+    for (let attempt = 0; attempt < 2; attempt++) {
+      const handle = await this.registerImage(image);
+      const result = await this.connection.executePython(pythonCode, {
+        handle: handle,
+        ...context,
+      });
+      if (result !== undefined) {
+        return result;
+      }
+
+      // the image was evicted, forget the handle and try again
+      await this.forgetHandle(image, handle);
+    }
+    throw new Error("The image could not be registered in python.");
+  }
+
+  /**
+   * Forgets the handle of an image, unless it has been re-registered
+   * (by a concurrent call) under a different handle in the meantime
+   */
+  private async forgetHandle(
+    image: RegistrableImage,
+    handle: number,
+  ): Promise<void> {
+    const current = this.imageHandles.get(image);
+    if (current === undefined) {
+      return;
+    }
+    const currentHandle = await current.catch(() => undefined);
+    if (currentHandle === handle && this.imageHandles.get(image) === current) {
+      this.imageHandles.delete(image);
+    }
+  }
+
+  /**
+   * Runs a python operation on a rectangle of a registered image.
+   * The python code receives the image "handle" and the rectangle
+   * ("left", "top", "width", "height") with any additional context
+   * and returns None if the image is no longer registered.
+   */
+  private async executeOnImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+    pythonCode: string,
+    context: object = {},
+  ): Promise<any> {
+    return await this.executeOnImage(image, pythonCode, {
+      left: rect.x,
+      top: rect.y,
+      width: rect.width,
+      height: rect.height,
+      ...context,
+    });
+  }
+
+  /**
+   * Runs otsu binarization on a rectangle of a registered background image.
+   * The rectangle must have integer coordinates.
+   */
+  public async otsuBinarizeImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+  ): Promise<ImageData> {
+    const result = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mask_alpha
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.background_image_tools.otsu_binarize_region \\
+          import otsu_binarize_lightness
+
+        marshalled_mask = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          mask = otsu_binarize_lightness(lightness, cache_key=cache_key)
+          marshalled_mask = marshal_mask_alpha(mask)
+
+        marshalled_mask  # return
+      `,
+    );
+    return unmarshalMaskAlpha(result);
+  }
+
+  /**
+   * Runs sauvola (local threshold) binarization on a rectangle
+   * of a registered background image. Unlike otsu binarization, it copes
+   * with unevenly lit scans. The rectangle must have integer coordinates.
+   */
+  public async sauvolaBinarizeImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+  ): Promise<ImageData> {
+    const result = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mask_alpha
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.background_image_tools.sauvola_binarize_region \\
+          import sauvola_binarize_lightness
+
+        marshalled_mask = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          mask = sauvola_binarize_lightness(lightness, cache_key=cache_key)
+          marshalled_mask = marshal_mask_alpha(mask)
+
+        marshalled_mask  # return
+      `,
+    );
+    return unmarshalMaskAlpha(result);
+  }
+
+  /**
+   * Runs staffline binarization on a rectangle of a registered
+   * background image. The rectangle must have integer coordinates.
+   */
+  public async detectStafflinesInImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+  ): Promise<ImageData> {
+    const result = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mask_alpha
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.background_image_tools.detect_stafflines \\
+          import detect_stafflines_in_lightness
+
+        marshalled_mask = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          mask = detect_stafflines_in_lightness(lightness, cache_key=cache_key)
+          marshalled_mask = marshal_mask_alpha(mask)
 
         marshalled_mask  # return
       `,
+    );
+    return unmarshalMaskAlpha(result);
+  }
+
+  /**
+   * Runs staffline binarization on a rectangle of a registered background
+   * image progressively. First, a quick preview computed on a downscaled
+   * image is passed to the callback (it is smaller than the rectangle and
+   * has to be stretched over it). Then the full-resolution mask,
+   * refined only around the previewed lines, is returned.
+   * The rectangle must have integer coordinates.
+   */
+  public async detectStafflinesProgressivelyInImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+    onPreview: (preview: ImageData) => void | Promise<void>,
+  ): Promise<ImageData> {
+    const previewResult = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mask_alpha
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.background_image_tools.detect_stafflines \\
+          import detect_stafflines_preview
+
+        marshalled_mask = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          mask = detect_stafflines_preview(lightness, cache_key=cache_key)
+          marshalled_mask = marshal_mask_alpha(mask)
+
+        marshalled_mask  # return
+      `,
+    );
+    await onPreview(unmarshalMaskAlpha(previewResult));
+
+    // the preview is cached in python under the same rectangle
+    const result = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mask_alpha
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.background_image_tools.detect_stafflines \\
+          import detect_stafflines_refined
+
+        marshalled_mask = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          mask = detect_stafflines_refined(lightness, cache_key=cache_key)
+          marshalled_mask = marshal_mask_alpha(mask)
+
+        marshalled_mask  # return
+      `,
+    );
+    return unmarshalMaskAlpha(result);
+  }
+
+  /**
+   * Runs staffline detection on a rectangle of a registered background
+   * image with every combination of the given parameters, for tuning them
+   * on difficult scans. Intermediate planes are shared between the
+   * combinations, so this is much faster than detecting one by one.
+   * The rectangle must have integer coordinates.
+   */
+  public async sweepStafflineParametersInImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+    sweep: StafflineParameterSweep,
+  ): Promise<StafflineSweepResult[]> {
+    const result = await this.executeOnImage(
+      image,
+      `
+        from mstudio.marshalling import unwrap_proxy, marshal_mask_alpha
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.background_image_tools.detect_stafflines \\
+          import sweep_staffline_parameters
+
+        marshalled_results = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          results = sweep_staffline_parameters(
+            lightness,
+            morphology_widths=unwrap_proxy(morphology_widths),
+            block_sizes=unwrap_proxy(block_sizes),
+            cs=unwrap_proxy(cs),
+            cache_key=cache_key,
+          )
+          marshalled_results = [
+            [list(params), marshal_mask_alpha(mask)]
+            for params, mask in results
+          ]
+
+        marshalled_results  # return
+      `,
+      {
+        left: rect.x,
+        top: rect.y,
+        width: rect.width,
+        height: rect.height,
+        morphology_widths: sweep.morphologyWidths,
+        block_sizes: sweep.blockSizes,
+        cs: sweep.cs,
+      },
+    );
+    return result.map(([params, mask]) => ({
+      morphologyWidth: params[0],
+      blockSize: params[1],
+      c: params[2],
+      mask: unmarshalMaskAlpha(mask),
+    }));
+  }
+
+  /**
+   * Runs the whole staff setup chain on a rectangle of a registered
+   * background image in one python call: staffline detection, cutting
+   * into individual stafflines, staff and staffspace generation.
+   * The returned nodes have temporary IDs, which are used by the links.
+   * The rectangle must have integer coordinates. Throws an error with
+   * a readable message when the staves cannot be built.
+   */
+  public async runStaffPipelineInImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+  ): Promise<StaffPipelineResult> {
+    const result = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mung_node_batch
+        from mstudio.background_image_tools.image_registry \\
+          import image_registry
+        from mstudio.staff_pipeline import run_staff_pipeline
+
+        marshalled_result = None
+        if image_registry.has_image(handle):
+          lightness = image_registry.get_lightness_region(
+            handle, left, top, width, height
+          )
+          cache_key = image_registry.get_region_key(
+            handle, left, top, width, height
+          )
+          try:
+            result = run_staff_pipeline(lightness, left, top, cache_key)
+            marshalled_result = {
+              "nodes": marshal_mung_node_batch(result.nodes),
+              "links": [list(link) for link in result.links],
+              "timings": result.timings,
+            }
+          except ValueError as e:
+            # e.g. the stafflines cannot be grouped into staves
+            marshalled_result = {"error": str(e)}
+
+        marshalled_result  # return
+      `,
+    );
+    if (result.error !== undefined) {
+      throw new Error(result.error);
+    }
+    return {
+      nodes: unmarshalMungNodeBatch(result.nodes),
+      links: result.links,
+      timings: result.timings,
+    };
+  }
+
+  /////////////
+  // Batches //
+  /////////////
+
+  /**
+   * Runs one background tool operation on many regions in a single python
+   * call and returns the masks in the same order
+   */
+  public async runBatchOnRegions(
+    operation: BackgroundToolOperation,
+    regions: ImageData[],
+  ): Promise<ImageData[]> {
+    const result = await this.connection.executePython(
+      `
+        from mstudio.marshalling import unwrap_proxy, marshal_mask_alpha, \\
+          unmarshal_plane
+        from mstudio.background_image_tools.batch import run_batch
+
+        lightness_regions = [
+          unmarshal_plane(p) for p in unwrap_proxy(marshalled_regions)
+        ]
+        masks = run_batch(operation, lightness_regions)
+        marshalled_masks = [marshal_mask_alpha(m) for m in masks]
+
+        marshalled_masks  # return
+      `,
+      {
+        operation: operation,
+        marshalled_regions: regions.map(marshalLightnessPlane),
+      },
+    );
+    return result.map(unmarshalMaskAlpha);
+  }
+
+  /**
+   * Runs one background tool operation on many rectangles of a registered
+   * background image in a single python call and returns the masks in the
+   * same order. The rectangles must have integer coordinates.
+   */
+  public async runBatchOnImageRects(
+    operation: BackgroundToolOperation,
+    image: RegistrableImage,
+    rects: DOMRect[],
+  ): Promise<ImageData[]> {
+    const result = await this.executeOnImage(
+      image,
+      `
+        from mstudio.marshalling import unwrap_proxy, marshal_mask_alpha
+        from mstudio.background_image_tools.batch import run_batch_on_image
+
+        marshalled_masks = None
+        masks = run_batch_on_image(operation, handle, unwrap_proxy(rects))
+        if masks is not None:
+          marshalled_masks = [marshal_mask_alpha(m) for m in masks]
+
+        marshalled_masks  # return
+      `,
+      {
+        operation: operation,
+        rects: rects.map((r) => [r.x, r.y, r.width, r.height]),
+      },
+    );
+    return result.map(unmarshalMaskAlpha);
+  }
+
+  /**
+   * Binarizes a rectangle of a registered background image and returns
+   * each connected component (that passes the size filter) as a node
+   * of the given class, with temporary IDs and a mask cropped to its bbox.
+   * The rectangle must have integer coordinates.
+   */
+  public async extractComponentsInImageRect(
+    image: RegistrableImage,
+    rect: DOMRect,
+    className: string,
+    options: ComponentExtractionOptions = {},
+  ): Promise<Node[]> {
+    const result = await this.executeOnImageRect(
+      image,
+      rect,
+      `
+        from mstudio.marshalling import marshal_mung_node_batch
+        from mstudio.background_image_tools.extract_components \\
+          import extract_components_in_image, DEFAULT_MIN_AREA
+
+        marshalled_nodes = None
+        components = extract_components_in_image(
+          handle, left, top, width, height,
+          operation=operation,
+          min_area=DEFAULT_MIN_AREA if min_area is None else min_area,
+          max_area=max_area,
+        )
+        if components is not None:
+          marshalled_nodes = marshal_mung_node_batch([
+            c.to_node(id_=i, class_name=class_name)
+            for i, c in enumerate(components)
+          ])
+
+        marshalled_nodes  # return
+      `,
       {
-        marshalled_region: marshalMaskRgb(region),
+        class_name: className,
+        operation: options.operation ?? "otsu",
+        min_area: options.minArea, // undefined becomes None
+        max_area: options.maxArea, // undefined becomes None
       },
     );
-    return unmarshalMaskRgb(result);
+    return unmarshalMungNodeBatch(result);
   }
 }
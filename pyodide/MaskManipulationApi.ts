@@ -1,12 +1,48 @@
 import { Node } from "../src/mung/Node";
 import {
-  marshalMungNodes,
+  GraphDiff,
+  MarshalledMaskAlpha,
   marshalMaskRgb,
+  marshalMungNodeBatch,
+  unmarshalGraphDiff,
+  unmarshalMaskAlpha,
   unmarshalMungNode,
-  unmarshalMungNodes,
+  unmarshalMungNodeBatch,
 } from "./marshalling";
 import { PyodideWorkerConnection } from "./PyodideWorkerConnection";
 
+/**
+ * How cut lines between stafflines should be computed
+ */
+export interface CutLinesOptions {
+  /** Compute cuts every N columns (10 by default, 1 is full resolution) */
+  readonly stride?: number;
+
+  /** Compute all columns, but emit points only where the cuts move */
+  readonly adaptive?: boolean;
+
+  /** Do not truncate the cut positions to whole pixels */
+  readonly subpixel?: boolean;
+}
+
+/**
+ * One step of a morphology pipeline applied to node masks,
+ * see MORPHOLOGY_OPERATIONS in mstudio.mask_manipulation.morphology
+ */
+export type MorphologyOperation =
+  | { readonly name: "fillHoles" }
+  | { readonly name: "dilate"; readonly size: number }
+  | { readonly name: "erode"; readonly size: number }
+  | { readonly name: "removeSpecks"; readonly size: number };
+
+/**
+ * A staff generated from a group of stafflines
+ */
+export interface ProposedStaff {
+  readonly staff: Node;
+  readonly stafflineIds: number[];
+}
+
 /**
  * Exposes python operations for manipulating MuNG node masks
  */
@@ -20,20 +56,31 @@ export class MaskManipulationApi {
   /**
    * Computes cut lines for slicing stafflines into separate objects
    */
-  public async computeCutLines(mask: ImageData): Promise<DOMPoint[][]> {
+  public async computeCutLines(
+    mask: ImageData,
+    options: CutLinesOptions = {},
+  ): Promise<DOMPoint[][]> {
     const result = await this.connection.executePython(
       `
-        from mstudio.marshalling import unmarshal_mask_rgba
+        from mstudio.mask import Mask
         from mstudio.mask_manipulation.compute_cut_lines \\
-          import compute_cut_lines
+          import compute_cut_lines, DEFAULT_STRIDE
 
-        mask = unmarshal_mask_rgba(marshalled_mask)
-        cut_lines = compute_cut_lines(mask)
+        mask = Mask.unmarshal_rgba(0, 0, marshalled_mask)
+        cut_lines = compute_cut_lines(
+          mask,
+          stride=DEFAULT_STRIDE if stride is None else stride,
+          adaptive=adaptive,
+          subpixel=subpixel,
+        )
 
         cut_lines  # return statement
       `,
       {
         marshalled_mask: marshalMaskRgb(mask),
+        stride: options.stride, // undefined becomes None
+        adaptive: options.adaptive ?? false,
+        subpixel: options.subpixel ?? false,
       },
     );
 
@@ -55,45 +102,102 @@ export class MaskManipulationApi {
   ): Promise<[number, number, number, number, ImageData][]> {
     const result = await this.connection.executePython(
       `
-        import numpy as np
+        from mstudio.mask import Mask
         from mstudio.mask_manipulation.separate_lines \\
           import separate_lines
 
-        original_mask = np.asarray(data.to_py(), dtype=np.uint8) \\
-          .reshape((height, width, 4))
+        original_mask = Mask.unmarshal_rgba(left, top, marshalled_mask)
         
         sub_masks = separate_lines(
-          left,
-          top,
-          width,
-          height,
           original_mask,
           [
-            [(int(point[0]), int(point[1])) for point in line]
+            [(point[0], point[1]) for point in line]
             for line in cut_lines
           ],
         )
-        sub_masks = [(t, l, w, h, m.flatten()) for t, l, w, h, m in sub_masks]
+        sub_masks = [
+          (m.left, m.top, m.width, m.height, m.marshal_alpha())
+          for m in sub_masks
+        ]
 
         sub_masks  # return statement
       `,
       {
         left: left,
         top: top,
-        width: originalMask.width,
-        height: originalMask.height,
-        data: originalMask.data,
+        marshalled_mask: marshalMaskRgb(originalMask),
         cut_lines: cutLines.map((l) => l.map((p) => [p.x, p.y])),
       },
     );
 
-    const subMasks = result as [number, number, number, number, Uint8Array][];
-    return subMasks.map(([l, t, w, h, data]) => [
+    const subMasks = result as [
+      number,
+      number,
+      number,
+      number,
+      MarshalledMaskAlpha,
+    ][];
+    return subMasks.map(([l, t, w, h, mask]) => [
       l,
       t,
       w,
       h,
-      new ImageData(new Uint8ClampedArray(data.buffer), w, h),
+      unmarshalMaskAlpha(mask),
+    ]);
+  }
+
+  /**
+   * Rasterizes many polygons in one call, each into a mask over its own
+   * tight bbox. A polygon is its outer ring followed by rings of its holes,
+   * in scene coordinates. Returns [left, top, width, height, mask] for each
+   * polygon, in the same order. Throws if any polygon has no vertices.
+   */
+  public async rasterizePolygons(
+    polygons: DOMPoint[][][],
+  ): Promise<[number, number, number, number, ImageData][]> {
+    const result = await this.connection.executePython(
+      `
+        from mstudio.marshalling import unwrap_proxy
+        from mstudio.mask_manipulation.rasterize_polygons \\
+          import rasterize_polygons
+
+        try:
+          masks = rasterize_polygons([
+            [[(point[0], point[1]) for point in ring] for ring in polygon]
+            for polygon in unwrap_proxy(marshalled_polygons)
+          ])
+          result = {"masks": [
+            (m.left, m.top, m.width, m.height, m.marshal_alpha())
+            for m in masks
+          ]}
+        except ValueError as e:
+          result = {"error": str(e)}
+
+        result  # return statement
+      `,
+      {
+        marshalled_polygons: polygons.map((polygon) =>
+          polygon.map((ring) => ring.map((p) => [p.x, p.y])),
+        ),
+      },
+    );
+
+    if (result.error !== undefined) {
+      throw new Error(result.error);
+    }
+    const masks = result.masks as [
+      number,
+      number,
+      number,
+      number,
+      MarshalledMaskAlpha,
+    ][];
+    return masks.map(([l, t, w, h, mask]) => [
+      l,
+      t,
+      w,
+      h,
+      unmarshalMaskAlpha(mask),
     ]);
   }
 
@@ -105,63 +209,219 @@ export class MaskManipulationApi {
   ): Promise<Node> {
     const result = await this.connection.executePython(
       `
-        from mstudio.marshalling import marshal_mung_node, unmarshal_mung_nodes
+        from mstudio.marshalling import marshal_mung_node, \\
+          unmarshal_mung_node_batch
         from mstudio.mask_manipulation.generate_staff_from_stafflines \\
           import generate_staff_from_stafflines
 
-        stafflines = unmarshal_mung_nodes(marshalled_stafflines)
+        stafflines = unmarshal_mung_node_batch(marshalled_stafflines)
         staff_node = generate_staff_from_stafflines(stafflines)
 
         marshal_mung_node(staff_node)  # return statement
       `,
       {
-        marshalled_stafflines: marshalMungNodes(stafflines),
+        marshalled_stafflines: marshalMungNodeBatch(stafflines),
       },
     );
     return unmarshalMungNode(result);
   }
 
   /**
-   * Generates staffspaces from 5 staffline nodes and the staff node
+   * Groups all the given staffline nodes (e.g. of a whole page) into staves
+   * by their vertical position and generates a staff node for each group.
+   * The returned staves are ordered from the top down and each comes with
+   * the IDs of its stafflines.
    */
-  public async generateStaffspaces(nodes: readonly Node[]): Promise<Node[]> {
+  public async generateStavesFromStafflines(
+    stafflines: readonly Node[],
+  ): Promise<ProposedStaff[]> {
     const result = await this.connection.executePython(
       `
-        from mstudio.marshalling import marshal_mung_nodes, unmarshal_mung_nodes
+        from mstudio.marshalling import marshal_mung_node_batch, \\
+          unmarshal_mung_node_batch
+        from mstudio.mask_manipulation.generate_staff_from_stafflines \\
+          import generate_staves_from_stafflines
+
+        stafflines = unmarshal_mung_node_batch(marshalled_stafflines)
+        staves = generate_staves_from_stafflines(stafflines)
+
+        {
+          "staves": marshal_mung_node_batch([s for s, _ in staves]),
+          "stafflineIds": [[l.id for l in lines] for _, lines in staves],
+        }  # return statement
+      `,
+      {
+        marshalled_stafflines: marshalMungNodeBatch(stafflines),
+      },
+    );
+    const staves = unmarshalMungNodeBatch(result.staves);
+    return staves.map((staff, i) => ({
+      staff: staff,
+      stafflineIds: result.stafflineIds[i],
+    }));
+  }
+
+  /**
+   * Generates staffspaces from 5 staffline nodes and the staff node,
+   * returns only the changes made to the given nodes
+   * (the staffspaces are among the added nodes)
+   */
+  public async generateStaffspaces(nodes: readonly Node[]): Promise<GraphDiff> {
+    const result = await this.connection.executePython(
+      `
+        from mstudio.marshalling import marshal_graph_diff, \\
+          unmarshal_mung_node_batch
         from mstudio.mask_manipulation.generate_staffspaces \\
           import generate_staffspaces
 
-        nodes = unmarshal_mung_nodes(marshalled_nodes)
-        staffspaces = generate_staffspaces(nodes)
+        nodes = unmarshal_mung_node_batch(marshalled_nodes)
+        diff = generate_staffspaces(nodes)
 
-        marshal_mung_nodes(staffspaces)  # return statement
+        marshal_graph_diff(diff)  # return statement
       `,
       {
-        marshalled_nodes: marshalMungNodes(nodes),
+        marshalled_nodes: marshalMungNodeBatch(nodes),
       },
     );
-    return unmarshalMungNodes(result);
+    return unmarshalGraphDiff(result);
   }
 
   /**
-   * Snaps noteheads and other nodes to staves, stafflines and staff spaces
+   * Generates staffspaces only for the staves with the given IDs.
+   * The nodes must contain these staves with their stafflines and
+   * staffspaces. The existing staffspaces of the staves are among the
+   * removed nodes, the new ones among the added nodes (with temporary IDs).
+   * Throws an error with a readable message when a staff is unknown
+   * or has too few stafflines.
    */
-  public async snapNodesToStaves(nodes: readonly Node[]): Promise<Node[]> {
+  public async regenerateStaffspaces(
+    nodes: readonly Node[],
+    staffIds: readonly number[],
+  ): Promise<GraphDiff> {
     const result = await this.connection.executePython(
       `
-        from mstudio.marshalling import marshal_mung_nodes, unmarshal_mung_nodes
+        from mstudio.marshalling import marshal_graph_diff, \\
+          unmarshal_mung_node_batch, unwrap_proxy
+        from mstudio.mask_manipulation.generate_staffspaces \\
+          import regenerate_staffspaces
+
+        nodes = unmarshal_mung_node_batch(marshalled_nodes)
+        try:
+          diff = regenerate_staffspaces(nodes, unwrap_proxy(staff_ids))
+          result = {"diff": marshal_graph_diff(diff)}
+        except ValueError as e:
+          # e.g. an unknown staff or one without enough stafflines
+          result = {"error": str(e)}
+
+        result  # return statement
+      `,
+      {
+        marshalled_nodes: marshalMungNodeBatch(nodes),
+        staff_ids: staffIds,
+      },
+    );
+    if (result.error !== undefined) {
+      throw new Error(result.error);
+    }
+    return unmarshalGraphDiff(result.diff);
+  }
+
+  /**
+   * Snaps noteheads and other nodes to staves, stafflines and staff spaces,
+   * returns only the changes made to the given nodes
+   */
+  public async snapNodesToStaves(nodes: readonly Node[]): Promise<GraphDiff> {
+    const result = await this.connection.executePython(
+      `
+        from mstudio.marshalling import marshal_graph_diff, \\
+          unmarshal_mung_node_batch
         from mstudio.mask_manipulation.snap_nodes_to_staves \\
           import snap_nodes_to_staves
 
-        nodes = unmarshal_mung_nodes(marshalled_nodes)
-        snapped_nodes = snap_nodes_to_staves(nodes)
+        nodes = unmarshal_mung_node_batch(marshalled_nodes)
+        diff = snap_nodes_to_staves(nodes)
+
+        marshal_graph_diff(diff)  # return statement
+      `,
+      {
+        marshalled_nodes: marshalMungNodeBatch(nodes),
+      },
+    );
+    return unmarshalGraphDiff(result);
+  }
+
+  /**
+   * Snaps nodes to staves incrementally. The python side keeps an index
+   * of the document nodes between calls, which is here updated with the
+   * nodes that changed since the last call (or reset to all the nodes).
+   * Then only the nodes with the given IDs are snapped, looking just at
+   * their surroundings. Returns only the links towards staves, stafflines
+   * and staffspaces that snapping added or removed, the index keeps
+   * exactly these changes, so they must all be applied to the document.
+   */
+  public async snapChangedNodesToStaves(
+    updatedNodes: readonly Node[],
+    removedNodeIds: readonly number[],
+    changedNodeIds: readonly number[],
+    reset: boolean,
+  ): Promise<GraphDiff> {
+    const result = await this.connection.executePython(
+      `
+        from mstudio.marshalling import marshal_graph_diff, \\
+          unmarshal_mung_node_batch, unwrap_proxy
+        from mstudio.mask_manipulation.staff_index import staff_index
+        from mstudio.mask_manipulation.snap_nodes_to_staves \\
+          import snap_all_nodes_to_staves, snap_changed_nodes_to_staves
+
+        nodes = unmarshal_mung_node_batch(marshalled_nodes)
+        if reset:
+          diff = snap_all_nodes_to_staves(nodes)
+        else:
+          staff_index.update(nodes, unwrap_proxy(removed_node_ids))
+          diff = snap_changed_nodes_to_staves(
+            unwrap_proxy(changed_node_ids)
+          )
+
+        marshal_graph_diff(diff)  # return statement
+      `,
+      {
+        marshalled_nodes: marshalMungNodeBatch(updatedNodes),
+        removed_node_ids: removedNodeIds,
+        changed_node_ids: changedNodeIds,
+        reset: reset,
+      },
+    );
+    return unmarshalGraphDiff(result);
+  }
+
+  /**
+   * Applies a pipeline of morphology operations to the masks of all
+   * the given nodes in one call, returns only the nodes whose masks
+   * changed (their bbox may grow or shrink with the mask)
+   */
+  public async applyMorphology(
+    nodes: readonly Node[],
+    operations: readonly MorphologyOperation[],
+  ): Promise<GraphDiff> {
+    const result = await this.connection.executePython(
+      `
+        from mstudio.marshalling import marshal_graph_diff, \\
+          unmarshal_mung_node_batch, unwrap_proxy
+        from mstudio.mask_manipulation.morphology import apply_morphology
+
+        nodes = unmarshal_mung_node_batch(marshalled_nodes)
+        diff = apply_morphology(nodes, unwrap_proxy(operations))
 
-        marshal_mung_nodes(snapped_nodes)  # return statement
+        marshal_graph_diff(diff)  # return statement
       `,
       {
-        marshalled_nodes: marshalMungNodes(nodes),
+        marshalled_nodes: marshalMungNodeBatch(nodes),
+        operations: operations.map((o) => [
+          o.name,
+          "size" in o ? o.size : 0,
+        ]),
       },
     );
-    return unmarshalMungNodes(result);
+    return unmarshalGraphDiff(result);
   }
 }
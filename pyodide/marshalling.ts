@@ -18,7 +18,219 @@ export function marshalMaskRgb(mask: ImageData): MarshalledMaskRgb {
  */
 export function unmarshalMaskRgb(marshalledMask: MarshalledMaskRgb): ImageData {
   const [width, height, data] = marshalledMask;
-  return new ImageData(new Uint8ClampedArray(data.buffer), width, height);
+  // view the received buffer without copying it
+  return new ImageData(
+    new Uint8ClampedArray(data.buffer, data.byteOffset, data.byteLength),
+    width,
+    height,
+  );
+}
+
+////////////////
+// Mask Alpha //
+////////////////
+
+export type MarshalledMaskAlpha = [number, number, Uint8Array];
+
+/**
+ * Prepare a single-channel (alpha-only) mask to be sent to python
+ */
+export function marshalMaskAlpha(mask: ImageData): MarshalledMaskAlpha {
+  const pixelCount = mask.width * mask.height;
+  const rgba = mask.data;
+  const alpha = new Uint8Array(pixelCount);
+  for (let i = 0; i < pixelCount; i++) {
+    alpha[i] = rgba[i * 4 + 3];
+  }
+  return [mask.width, mask.height, alpha];
+}
+
+/**
+ * Receive a single-channel (alpha-only) mask sent back from python,
+ * expanded into a red mask for display
+ */
+export function unmarshalMaskAlpha(
+  marshalledMask: MarshalledMaskAlpha,
+): ImageData {
+  const [width, height, alpha] = marshalledMask;
+  const pixelCount = width * height;
+  const rgba = new Uint8ClampedArray(pixelCount * 4);
+  for (let i = 0; i < pixelCount; i++) {
+    rgba[i * 4 + 0] = alpha[i]; // red
+    rgba[i * 4 + 3] = alpha[i]; // alpha
+  }
+  return new ImageData(rgba, width, height);
+}
+
+/////////////////////
+// Lightness Plane //
+/////////////////////
+
+export type MarshalledPlane = [number, number, Uint8Array];
+
+let lightnessLookupTable: Uint8Array | null = null;
+
+/**
+ * Rounds half-way values to the nearest even number (like C's rint)
+ */
+function roundHalfToEven(x: number): number {
+  const r = Math.round(x);
+  return Math.abs(x % 1) === 0.5 && r % 2 !== 0 ? r - 1 : r;
+}
+
+/**
+ * Lightness for each (max, min) pair of RGB components, indexed as
+ * max * 256 + min. Replicates the float32 arithmetic of OpenCV's
+ * RGB2HLS conversion, so that the python tools produce the same results
+ * as when they convert RGBA regions themselves.
+ */
+function getLightnessLookupTable(): Uint8Array {
+  if (lightnessLookupTable !== null) {
+    return lightnessLookupTable;
+  }
+  const f = Math.fround;
+  const scale = f(1 / 255);
+  const table = new Uint8Array(256 * 256);
+  for (let max = 0; max < 256; max++) {
+    for (let min = 0; min <= max; min++) {
+      const l = f(f(f(f(max * scale) + f(min * scale)) * 0.5) * 255);
+      table[max * 256 + min] = roundHalfToEven(l);
+    }
+  }
+  lightnessLookupTable = table;
+  return table;
+}
+
+/**
+ * Prepare the HLS lightness plane of an image to be sent to python.
+ * This is 4x less data than sending the RGBA pixels.
+ */
+export function marshalLightnessPlane(image: ImageData): MarshalledPlane {
+  const table = getLightnessLookupTable();
+  const pixelCount = image.width * image.height;
+  const rgba = image.data;
+  const lightness = new Uint8Array(pixelCount);
+  for (let i = 0; i < pixelCount; i++) {
+    const r = rgba[i * 4 + 0];
+    const g = rgba[i * 4 + 1];
+    const b = rgba[i * 4 + 2];
+    const max = Math.max(r, g, b);
+    const min = Math.min(r, g, b);
+    lightness[i] = table[max * 256 + min];
+  }
+  return [image.width, image.height, lightness];
+}
+
+/////////////////////
+// Mask Compressed //
+/////////////////////
+
+/**
+ * raw - alpha plane, one byte per pixel
+ * bits - one bit per pixel, MSB first (numpy's packbits)
+ * rle - uint32 run lengths, alternating unset/set, starting with unset
+ */
+export type MaskEncoding = "raw" | "bits" | "rle";
+
+export type MarshalledMaskCompressed = [
+  number,
+  number,
+  MaskEncoding,
+  Uint8Array | Uint32Array,
+];
+
+/**
+ * Masks with fewer pixels are always sent raw, compression is not worth it
+ */
+const MASK_COMPRESSION_MIN_PIXELS = 4096;
+
+/**
+ * Prepare a mask to be sent to python, encoded in whichever format
+ * (raw, bit-packed, run-length) produces the smallest payload
+ */
+export function marshalMaskCompressed(
+  mask: ImageData,
+): MarshalledMaskCompressed {
+  const pixelCount = mask.width * mask.height;
+  const rgba = mask.data;
+
+  if (pixelCount < MASK_COMPRESSION_MIN_PIXELS) {
+    return [mask.width, mask.height, "raw", marshalMaskAlpha(mask)[2]];
+  }
+
+  // count runs to decide on the encoding
+  let changeCount = 0;
+  for (let i = 1; i < pixelCount; i++) {
+    if ((rgba[i * 4 + 3] === 255) !== (rgba[(i - 1) * 4 + 3] === 255)) {
+      changeCount += 1;
+    }
+  }
+  const rleSize = 4 * (changeCount + 2);
+  const bitsSize = Math.ceil(pixelCount / 8);
+
+  if (rleSize < bitsSize) {
+    const runs = new Uint32Array(changeCount + 2);
+    let runIndex = 0;
+    let isSet = false;
+    for (let i = 0; i < pixelCount; i++) {
+      if ((rgba[i * 4 + 3] === 255) !== isSet) {
+        isSet = !isSet;
+        runIndex += 1;
+      }
+      runs[runIndex] += 1;
+    }
+    return [mask.width, mask.height, "rle", runs.slice(0, runIndex + 1)];
+  }
+
+  const bits = new Uint8Array(bitsSize);
+  for (let i = 0; i < pixelCount; i++) {
+    if (rgba[i * 4 + 3] === 255) {
+      bits[i >> 3] |= 0x80 >> (i & 7);
+    }
+  }
+  return [mask.width, mask.height, "bits", bits];
+}
+
+/**
+ * Receive a mask sent back from python in any of the encodings,
+ * expanded into a red mask for display
+ */
+export function unmarshalMaskCompressed(
+  marshalledMask: MarshalledMaskCompressed,
+): ImageData {
+  const [width, height, encoding, data] = marshalledMask;
+  const pixelCount = width * height;
+
+  if (encoding === "raw") {
+    return unmarshalMaskAlpha([width, height, data as Uint8Array]);
+  }
+
+  const rgba = new Uint8ClampedArray(pixelCount * 4);
+
+  if (encoding === "bits") {
+    for (let i = 0; i < pixelCount; i++) {
+      if (data[i >> 3] & (0x80 >> (i & 7))) {
+        rgba[i * 4 + 0] = 255; // red
+        rgba[i * 4 + 3] = 255; // alpha
+      }
+    }
+  } else if (encoding === "rle") {
+    let i = 0;
+    for (let runIndex = 0; runIndex < data.length; runIndex++) {
+      const runEnd = i + data[runIndex];
+      if (runIndex % 2 === 1) {
+        for (; i < runEnd; i++) {
+          rgba[i * 4 + 0] = 255; // red
+          rgba[i * 4 + 3] = 255; // alpha
+        }
+      }
+      i = runEnd;
+    }
+  } else {
+    throw new Error(`Unknown mask encoding: ${encoding}`);
+  }
+
+  return new ImageData(rgba, width, height);
 }
 
 ///////////////
@@ -34,7 +246,7 @@ export interface MarshalledNode {
   readonly height: number;
   readonly outlinks: number[];
   readonly inlinks: number[];
-  readonly mask: MarshalledMaskRgb | undefined;
+  readonly mask: MarshalledMaskCompressed | undefined;
   readonly data: {
     [key: string]: any;
   };
@@ -56,7 +268,9 @@ export function marshalMungNode(node: Node): MarshalledNode {
     height: node.height,
     outlinks: node.syntaxOutlinks,
     inlinks: node.syntaxInlinks,
-    mask: node.decodedMask ? marshalMaskRgb(node.decodedMask) : undefined,
+    mask: node.decodedMask
+      ? marshalMaskCompressed(node.decodedMask)
+      : undefined,
     data: {
       precedence_outlinks: node.precedenceOutlinks,
       precedence_inlinks: node.precedenceInlinks,
@@ -82,7 +296,7 @@ export function unmarshalMungNode(mnode: MarshalledNode): Node {
     syntaxInlinks: mnode.inlinks,
     precedenceOutlinks: md["precedence_outlinks"] || [],
     precedenceInlinks: md["precedence_inlinks"] || [],
-    decodedMask: mnode.mask ? unmarshalMaskRgb(mnode.mask) : null,
+    decodedMask: mnode.mask ? unmarshalMaskCompressed(mnode.mask) : null,
     textTranscription: md["text_transcription"] || null,
     data: {
       // yes, discard additional data - this is a temporary solution for now
@@ -104,3 +318,241 @@ export function marshalMungNodes(nodes: readonly Node[]): MarshalledNode[] {
 export function unmarshalMungNodes(mnodes: readonly MarshalledNode[]): Node[] {
   return mnodes.map(unmarshalMungNode);
 }
+
+/////////////////////
+// MuNG Node Batch //
+/////////////////////
+
+/**
+ * Columnar (struct-of-arrays) representation of a list of MuNG nodes.
+ * Links are stored as offset+value arrays (node i owns the values
+ * in the range offsets[i] to offsets[i + 1]) and all masks are bit-packed
+ * into one shared blob, addressed by bit offsets.
+ */
+export interface MarshalledNodeBatch {
+  readonly ids: Int32Array;
+  readonly classNameTable: string[];
+  readonly classNameIndices: Int32Array;
+  readonly tops: Int32Array;
+  readonly lefts: Int32Array;
+  readonly widths: Int32Array;
+  readonly heights: Int32Array;
+  readonly outlinkOffsets: Int32Array;
+  readonly outlinks: Int32Array;
+  readonly inlinkOffsets: Int32Array;
+  readonly inlinks: Int32Array;
+  readonly precedenceOutlinkOffsets: Int32Array;
+  readonly precedenceOutlinks: Int32Array;
+  readonly precedenceInlinkOffsets: Int32Array;
+  readonly precedenceInlinks: Int32Array;
+  readonly textTranscriptions: (string | null | undefined)[];
+  readonly hasMask: Uint8Array;
+  readonly maskOffsets: Float64Array;
+  readonly masks: Uint8Array;
+}
+
+function packRagged(lists: readonly number[][]): [Int32Array, Int32Array] {
+  const offsets = new Int32Array(lists.length + 1);
+  for (let i = 0; i < lists.length; i++) {
+    offsets[i + 1] = offsets[i] + lists[i].length;
+  }
+  const values = new Int32Array(offsets[lists.length]);
+  for (let i = 0; i < lists.length; i++) {
+    values.set(lists[i], offsets[i]);
+  }
+  return [offsets, values];
+}
+
+function unpackRagged(offsets: Int32Array, values: Int32Array): number[][] {
+  const lists: number[][] = [];
+  for (let i = 0; i < offsets.length - 1; i++) {
+    lists.push(Array.from(values.subarray(offsets[i], offsets[i + 1])));
+  }
+  return lists;
+}
+
+/**
+ * Prepare a list of MuNG nodes to be sent to python in the columnar format
+ */
+export function marshalMungNodeBatch(
+  nodes: readonly Node[],
+): MarshalledNodeBatch {
+  const n = nodes.length;
+
+  const classNameTable = [...new Set(nodes.map((node) => node.className))];
+  const classNameLookup = new Map(classNameTable.map((c, i) => [c, i]));
+
+  const [outlinkOffsets, outlinks] = packRagged(
+    nodes.map((node) => node.syntaxOutlinks),
+  );
+  const [inlinkOffsets, inlinks] = packRagged(
+    nodes.map((node) => node.syntaxInlinks),
+  );
+  const [precedenceOutlinkOffsets, precedenceOutlinks] = packRagged(
+    nodes.map((node) => node.precedenceOutlinks),
+  );
+  const [precedenceInlinkOffsets, precedenceInlinks] = packRagged(
+    nodes.map((node) => node.precedenceInlinks),
+  );
+
+  // all masks are concatenated and bit-packed into one blob
+  const hasMask = new Uint8Array(n);
+  const maskOffsets = new Float64Array(n + 1);
+  for (let i = 0; i < n; i++) {
+    const mask = nodes[i].decodedMask;
+    hasMask[i] = mask ? 1 : 0;
+    const pixelCount = mask ? mask.width * mask.height : 0;
+    maskOffsets[i + 1] = maskOffsets[i] + pixelCount;
+  }
+  const masks = new Uint8Array(Math.ceil(maskOffsets[n] / 8));
+  for (let i = 0; i < n; i++) {
+    const mask = nodes[i].decodedMask;
+    if (!mask) continue;
+    const rgba = mask.data;
+    const pixelCount = mask.width * mask.height;
+    const offset = maskOffsets[i];
+    for (let p = 0; p < pixelCount; p++) {
+      if (rgba[p * 4 + 3] === 255) {
+        // (offsets may exceed 32 bits, so no bitwise shifts here)
+        const bit = offset + p;
+        masks[Math.floor(bit / 8)] |= 0x80 >> bit % 8;
+      }
+    }
+  }
+
+  return {
+    ids: Int32Array.from(nodes, (node) => node.id),
+    classNameTable,
+    classNameIndices: Int32Array.from(
+      nodes,
+      (node) => classNameLookup.get(node.className)!,
+    ),
+    tops: Int32Array.from(nodes, (node) => node.top),
+    lefts: Int32Array.from(nodes, (node) => node.left),
+    widths: Int32Array.from(nodes, (node) => node.width),
+    heights: Int32Array.from(nodes, (node) => node.height),
+    outlinkOffsets,
+    outlinks,
+    inlinkOffsets,
+    inlinks,
+    precedenceOutlinkOffsets,
+    precedenceOutlinks,
+    precedenceInlinkOffsets,
+    precedenceInlinks,
+    textTranscriptions: nodes.map((node) => node.textTranscription),
+    hasMask,
+    maskOffsets,
+    masks,
+  };
+}
+
+/**
+ * Receive a list of MuNG nodes sent back from python in the columnar format
+ */
+export function unmarshalMungNodeBatch(batch: MarshalledNodeBatch): Node[] {
+  const outlinks = unpackRagged(batch.outlinkOffsets, batch.outlinks);
+  const inlinks = unpackRagged(batch.inlinkOffsets, batch.inlinks);
+  const precedenceOutlinks = unpackRagged(
+    batch.precedenceOutlinkOffsets,
+    batch.precedenceOutlinks,
+  );
+  const precedenceInlinks = unpackRagged(
+    batch.precedenceInlinkOffsets,
+    batch.precedenceInlinks,
+  );
+
+  const nodes: Node[] = [];
+  for (let i = 0; i < batch.ids.length; i++) {
+    const width = batch.widths[i];
+    const height = batch.heights[i];
+
+    let decodedMask: ImageData | null = null;
+    if (batch.hasMask[i]) {
+      const pixelCount = width * height;
+      const offset = batch.maskOffsets[i];
+      const rgba = new Uint8ClampedArray(pixelCount * 4);
+      for (let p = 0; p < pixelCount; p++) {
+        const bit = offset + p;
+        if (batch.masks[Math.floor(bit / 8)] & (0x80 >> bit % 8)) {
+          rgba[p * 4 + 0] = 255; // red
+          rgba[p * 4 + 3] = 255; // alpha
+        }
+      }
+      decodedMask = new ImageData(rgba, width, height);
+    }
+
+    nodes.push({
+      id: batch.ids[i],
+      className: batch.classNameTable[batch.classNameIndices[i]],
+      top: batch.tops[i],
+      left: batch.lefts[i],
+      width: width,
+      height: height,
+      syntaxOutlinks: outlinks[i],
+      syntaxInlinks: inlinks[i],
+      precedenceOutlinks: precedenceOutlinks[i],
+      precedenceInlinks: precedenceInlinks[i],
+      decodedMask: decodedMask,
+      textTranscription: batch.textTranscriptions[i] || null,
+      data: {
+        // yes, discard additional data - this is a temporary solution for now
+      },
+      polygon: null, // deprecated field
+    });
+  }
+  return nodes;
+}
+
+////////////////
+// Graph Diff //
+////////////////
+
+export interface MarshalledNodeChange {
+  readonly id: number;
+  readonly className?: string;
+  readonly top?: number;
+  readonly left?: number;
+  readonly width?: number;
+  readonly height?: number;
+  readonly mask?: MarshalledMaskCompressed | null;
+}
+
+export interface MarshalledGraphDiff {
+  readonly changedNodes: MarshalledNodeChange[];
+  readonly addedNodes: MarshalledNodeBatch;
+  readonly removedNodeIds: number[];
+  readonly addedLinks: [number, number][];
+  readonly removedLinks: [number, number][];
+}
+
+/**
+ * Changes made by a python operation to the nodes it received.
+ * Changed nodes contain only the fields that were modified.
+ */
+export interface GraphDiff {
+  readonly changedNodes: (Partial<Node> & { readonly id: number })[];
+  readonly addedNodes: Node[];
+  readonly removedNodeIds: number[];
+  readonly addedLinks: [number, number][];
+  readonly removedLinks: [number, number][];
+}
+
+/**
+ * Receive a graph diff sent back from python
+ */
+export function unmarshalGraphDiff(mdiff: MarshalledGraphDiff): GraphDiff {
+  return {
+    changedNodes: mdiff.changedNodes.map((mchange) => {
+      const { mask, ...fields } = mchange;
+      if (mask === undefined) return fields;
+      return {
+        ...fields,
+        decodedMask: mask === null ? null : unmarshalMaskCompressed(mask),
+      };
+    }),
+    addedNodes: unmarshalMungNodeBatch(mdiff.addedNodes),
+    removedNodeIds: mdiff.removedNodeIds,
+    addedLinks: mdiff.addedLinks,
+    removedLinks: mdiff.removedLinks,
+  };
+}
@@ -0,0 +1,70 @@
+"""
+Compares the speed of the binarization modes of the background image tools
+on full pages. Run it from the pyodide/mstudio folder:
+
+    python -m benchmarks.benchmark_binarization page1.png page2.jpg ...
+
+Pages are decoded once into the page image store cache. Each mode is run
+without the plane cache, so that every repetition does the full work.
+"""
+
+import argparse
+import tempfile
+import time
+import numpy as np
+from typing import Callable
+from mstudio.background_image_tools.page_image_store import PageImageStore
+from mstudio.background_image_tools.otsu_binarize_region \
+    import otsu_binarize_lightness
+from mstudio.background_image_tools.sauvola_binarize_region \
+    import sauvola_binarize_lightness
+
+
+MODES: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "bilateral+otsu": otsu_binarize_lightness,
+    "sauvola": sauvola_binarize_lightness,
+}
+
+
+def measure(
+        binarize: Callable[[np.ndarray], np.ndarray],
+        lightness: np.ndarray,
+        repeats: int,
+) -> tuple[float, np.ndarray]:
+    """Returns the best time in seconds and the binarized plane"""
+    best_time = float("inf")
+    binarized = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        binarized = binarize(lightness)
+        best_time = min(best_time, time.perf_counter() - start)
+    return best_time, binarized
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pages", nargs="+", help="Page scan image files")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cache-folder", default=None)
+    args = parser.parse_args()
+
+    cache_folder = args.cache_folder or tempfile.mkdtemp()
+    store = PageImageStore(cache_folder, lightness_only=True)
+
+    print(f"{'page':<40} {'mode':<16} {'megapixels':>10} "
+          f"{'seconds':>8} {'MPx/s':>8} {'ink':>6}")
+    for page_path in args.pages:
+        # read the memory map into memory, so that disk is not measured
+        lightness = np.array(store.get_page(page_path))
+        megapixels = lightness.size / 1e6
+
+        for mode_name, binarize in MODES.items():
+            seconds, binarized = measure(binarize, lightness, args.repeats)
+            ink = np.count_nonzero(binarized) / binarized.size
+            print(f"{page_path[-40:]:<40} {mode_name:<16} "
+                  f"{megapixels:>10.1f} {seconds:>8.3f} "
+                  f"{megapixels / seconds:>8.1f} {ink:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import sys
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable
+from .image_registry import image_registry
+from .otsu_binarize_region import otsu_binarize_lightness
+from .sauvola_binarize_region import sauvola_binarize_lightness
+from .detect_stafflines import detect_stafflines_in_lightness
+
+
+# Annotators often run a background tool on many small regions in a row.
+# A batch runs one operation over all of them in a single call from
+# javascript. In CPython, the regions are processed on a thread pool,
+# since OpenCV releases the GIL. Pyodide has no threads, there the regions
+# are processed one after another.
+
+OPERATIONS: dict[str, Callable[..., np.ndarray]] = {
+    "otsu": otsu_binarize_lightness,
+    "sauvola": sauvola_binarize_lightness,
+    "stafflines": detect_stafflines_in_lightness,
+}
+
+CAN_USE_THREADS = sys.platform != "emscripten"
+
+
+def run_batch(
+        operation: str,
+        lightness_regions: list[np.ndarray],
+        cache_keys: list[Hashable | None] | None = None,
+        max_workers: int | None = None,
+) -> list[np.ndarray]:
+    """
+    Runs the named operation on each of the lightness regions,
+    returns the white-on-black masks in the same order
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown background tool operation: {operation}")
+    function = OPERATIONS[operation]
+
+    if cache_keys is None:
+        cache_keys = [None] * len(lightness_regions)
+    assert len(cache_keys) == len(lightness_regions)
+
+    def run(lightness: np.ndarray, cache_key: Hashable | None) -> np.ndarray:
+        return function(lightness, cache_key=cache_key)
+
+    if not CAN_USE_THREADS or len(lightness_regions) <= 1:
+        return list(map(run, lightness_regions, cache_keys))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, lightness_regions, cache_keys))
+
+
+def run_batch_on_image(
+        operation: str,
+        handle: int,
+        rects: list[tuple[int, int, int, int]],
+        max_workers: int | None = None,
+) -> list[np.ndarray] | None:
+    """
+    Runs the named operation on rectangles (left, top, width, height)
+    of a registered image. Returns None if the image is not registered.
+    """
+    if not image_registry.has_image(handle):
+        return None
+
+    # the registry is not thread-safe, slice all regions up front
+    lightness_regions = [
+        image_registry.get_lightness_region(handle, *rect) for rect in rects
+    ]
+    cache_keys: list[Hashable | None] = [
+        image_registry.get_region_key(handle, *rect) for rect in rects
+    ]
+
+    return run_batch(operation, lightness_regions, cache_keys, max_workers)
@@ -1,40 +1,304 @@
 import numpy as np
 import cv2
+from typing import Hashable
+from .tiling import DEFAULT_TILE_SIZE, iterate_tiles
+from .plane_cache import plane_cache, get_content_key, get_lightness
 
 
-def detect_stafflines(region: np.ndarray) -> np.ndarray:
+# width of the horizontal structuring element that removes non-line ink
+MORPHOLOGY_WIDTH = 50
+
+# threshold estimation region size (block size)
+THRESHOLD_BLOCK_SIZE = 101
+
+# how much is subtracted from the mean to get the threshold
+THRESHOLD_C = 10
+
+# Progressive detection first computes a quick preview on a downscaled
+# pyramid level (with the kernel sizes scaled to match) and then refines
+# it at full resolution only in horizontal bands around the lines found
+# in the preview. Empty paper between staves is never processed at full
+# resolution. Inside the bands, the result is exactly the same as that
+# of the full-resolution detection.
+
+# downscaling factor of the preview pyramid level
+PREVIEW_SCALE = 4
+
+# full-resolution rows added above and below the preview lines
+BAND_MARGIN = 2 * PREVIEW_SCALE
+
+
+def detect_stafflines(
+        region: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
     """Detects stafflines in the given region of the background image"""
     assert len(region.shape) == 3 # WxHxC
     assert region.shape[2] == 4 # RGBA
 
+    if cache_key is None:
+        cache_key = get_content_key(region)
+
     # get lightness of the original image
-    image_hls = cv2.cvtColor(region, cv2.COLOR_RGB2HLS)
-    lightness = image_hls[:,:,1]
-    img = lightness
+    lightness = get_lightness(region, cache_key)
+
+    img = detect_stafflines_in_lightness(lightness, tile_size, cache_key)
+
+    # b/w to red+alpha mask
+    out_region = np.zeros_like(region)
+    out_region[:, :, 0] = img # red
+    out_region[:, :, 3] = img # alpha
+
+    return out_region
 
-    # https://docs.opencv.org/3.4/db/df6/tutorial_erosion_dilatation.html
 
-    # crunch away at black areas to get rid of them
-    img = cv2.dilate(img, cv2.getStructuringElement(cv2.MORPH_RECT, (50, 1)))
+def detect_stafflines_in_lightness(
+        lightness: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
+    """
+    Detects stafflines in a lightness plane, returns white-on-black mask.
+    When a cache key is given, the closed lightness plane is cached.
+    """
+    assert len(lightness.shape) == 2 # HxW
 
-    # grow black regions back to match line length to the original
-    img = cv2.erode(img, cv2.getStructuringElement(cv2.MORPH_RECT, (50, 1)))
+    if cache_key is None:
+        closed = close_lightness(lightness, tile_size)
+    else:
+        closed = plane_cache.get_or_compute(
+            ("closed", MORPHOLOGY_WIDTH, cache_key),
+            lambda: close_lightness(lightness, tile_size)
+        )
+
+    # the adaptive threshold reaches half of its block size away
+    height, width = lightness.shape
+    img = np.empty_like(lightness)
+    margin = THRESHOLD_BLOCK_SIZE // 2
+    for tile in iterate_tiles(width, height, tile_size, margin):
+        img[tile.inner] = threshold_closed_lightness(
+            closed[tile.outer]
+        )[tile.inner_in_outer]
+
+    return img
+
+
+def close_lightness(
+        lightness: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        morphology_width: int = MORPHOLOGY_WIDTH,
+) -> np.ndarray:
+    """Removes all ink that does not form long horizontal lines"""
+    element = cv2.getStructuringElement(
+        cv2.MORPH_RECT, (morphology_width, 1)
+    )
+
+    # dilate + erode each reach half of the element away
+    height, width = lightness.shape
+    closed = np.empty_like(lightness)
+    for tile in iterate_tiles(width, height, tile_size, morphology_width):
+        img = lightness[tile.outer]
+
+        # https://docs.opencv.org/3.4/db/df6/tutorial_erosion_dilatation.html
+
+        # crunch away at black areas to get rid of them
+        img = cv2.dilate(img, element)
+
+        # grow black regions back to match line length to the original
+        img = cv2.erode(img, element)
+
+        closed[tile.inner] = img[tile.inner_in_outer]
+
+    return closed
+
+
+def threshold_closed_lightness(
+        closed: np.ndarray,
+        block_size: int = THRESHOLD_BLOCK_SIZE,
+        c: float = THRESHOLD_C,
+) -> np.ndarray:
+    """Turns the closed lightness into a white-on-black staffline mask"""
 
     # https://docs.opencv.org/4.x/d7/d4d/tutorial_py_thresholding.html
     # https://docs.opencv.org/4.x/d7/d1b/group__imgproc__misc.html#ga72b913f352e4a1b1b397736707afcde3
     img = cv2.adaptiveThreshold(
-        img, 255,
+        closed, 255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
-        101, # threshold estimation region size (block size)
-        10 # C (how much is subtracted from the mean to get the threshold)
+        block_size, # threshold estimation region size (block size)
+        c # C (how much is subtracted from the mean to get the threshold)
     )
 
     # convert black regions (the ink) to white
     img = 255 - img
 
-    # b/w to red+alpha mask
-    out_region = np.zeros_like(region)
-    out_region[:, :, 0] = img # red
-    out_region[:, :, 3] = img # alpha
+    return img
 
-    return out_region
+
+def sweep_staffline_parameters(
+        lightness: np.ndarray,
+        morphology_widths: list[int],
+        block_sizes: list[int],
+        cs: list[float],
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> list[tuple[tuple[int, int, float], np.ndarray]]:
+    """
+    Detects stafflines with every combination of the given parameters,
+    returns ((morphology_width, block_size, c), mask) pairs. The closed
+    lightness is computed once per morphology width and the local mean
+    once per block size, each C is then just a comparison. The masks are
+    the same as if detect_stafflines_in_lightness was run for each.
+    """
+    assert len(lightness.shape) == 2 # HxW
+    for block_size in block_sizes:
+        assert block_size % 2 == 1 and block_size > 1
+
+    results: list[tuple[tuple[int, int, float], np.ndarray]] = []
+    for morphology_width in morphology_widths:
+        if cache_key is None:
+            closed = close_lightness(lightness, tile_size, morphology_width)
+        else:
+            closed = plane_cache.get_or_compute(
+                ("closed", morphology_width, cache_key),
+                lambda: close_lightness(lightness, tile_size, morphology_width)
+            )
+
+        for block_size in block_sizes:
+            mean = compute_local_mean(closed, block_size, tile_size)
+            difference = closed.astype(np.int16) - mean
+
+            for c in cs:
+                # adaptiveThreshold keeps src - mean > -ceil(C) as paper,
+                # the rest is the ink, which becomes white
+                ink = difference <= -int(np.ceil(c))
+                mask = ink.view(np.uint8) * np.uint8(255)
+                results.append(((morphology_width, block_size, c), mask))
+
+    return results
+
+
+def compute_local_mean(
+        closed: np.ndarray,
+        block_size: int,
+        tile_size: int = DEFAULT_TILE_SIZE,
+) -> np.ndarray:
+    """
+    Computes the gaussian-weighted local mean the same way
+    cv2.adaptiveThreshold(..., cv2.ADAPTIVE_THRESH_GAUSSIAN_C, ...) does
+    """
+    height, width = closed.shape
+    mean = np.empty_like(closed)
+    for tile in iterate_tiles(width, height, tile_size, block_size // 2):
+        # OpenCV blurs in float32 and rounds back to bytes
+        blurred = cv2.GaussianBlur(
+            closed[tile.outer].astype(np.float32),
+            (block_size, block_size), 0,
+            borderType=cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED
+        )[tile.inner_in_outer]
+        mean[tile.inner] = np.clip(np.rint(blurred), 0, 255)
+    return mean
+
+
+def detect_stafflines_preview(
+        lightness: np.ndarray,
+        scale: int = PREVIEW_SCALE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
+    """
+    Detects stafflines in a downscaled lightness plane, returns
+    a white-on-black mask of size ceil(H / scale) x ceil(W / scale).
+    When a cache key is given, the preview is cached, so that
+    the refinement can reuse it.
+    """
+    assert len(lightness.shape) == 2 # HxW
+
+    if cache_key is None:
+        return compute_preview(lightness, scale)
+    return plane_cache.get_or_compute(
+        ("staffline_preview", scale, cache_key),
+        lambda: compute_preview(lightness, scale)
+    )
+
+
+def compute_preview(lightness: np.ndarray, scale: int) -> np.ndarray:
+    """Runs the staffline detection on a downscaled pyramid level"""
+    height, width = lightness.shape
+    small = cv2.resize(
+        lightness,
+        (-(-width // scale), -(-height // scale)), # ceil
+        interpolation=cv2.INTER_AREA
+    )
+
+    # the block size must stay odd and at least 3
+    block_size = max(THRESHOLD_BLOCK_SIZE // scale | 1, 3)
+
+    closed = close_lightness(
+        small, morphology_width=max(MORPHOLOGY_WIDTH // scale, 1)
+    )
+    return threshold_closed_lightness(closed, block_size, THRESHOLD_C)
+
+
+def detect_stafflines_refined(
+        lightness: np.ndarray,
+        scale: int = PREVIEW_SCALE,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
+    """
+    Detects stafflines at full resolution, but only in row bands
+    around the lines found in the preview, returns white-on-black mask.
+    """
+    assert len(lightness.shape) == 2 # HxW
+
+    preview = detect_stafflines_preview(lightness, scale, cache_key)
+
+    height = lightness.shape[0]
+    mask = np.zeros_like(lightness)
+
+    # the adaptive threshold reaches half of its block size vertically,
+    # the morphology is only horizontal
+    margin = THRESHOLD_BLOCK_SIZE // 2
+    for y1, y2 in find_staffline_bands(preview, height, 2 * margin):
+        outer_y1 = max(y1 - margin, 0)
+        outer_y2 = min(y2 + margin, height)
+        band = detect_stafflines_in_lightness(
+            lightness[outer_y1:outer_y2], tile_size
+        )
+        mask[y1:y2] = band[y1 - outer_y1:y2 - outer_y1]
+
+    return mask
+
+
+def find_staffline_bands(
+        preview: np.ndarray,
+        height: int,
+        merge_gap: int = 0,
+        band_margin: int = BAND_MARGIN,
+) -> list[tuple[int, int]]:
+    """
+    Converts rows of the preview mask that contain any line pixels
+    into full-resolution row ranges [y1, y2). Ranges closer than
+    the merge gap are joined into one.
+    """
+    rows = np.flatnonzero(preview.any(axis=1))
+    if len(rows) == 0:
+        return []
+
+    # runs of consecutive preview rows
+    breaks = np.flatnonzero(np.diff(rows) > 1)
+    starts = rows[np.concatenate([[0], breaks + 1])]
+    ends = rows[np.concatenate([breaks, [len(rows) - 1]])] + 1
+
+    # to full-resolution rows, grown by the margin
+    row_height = height / preview.shape[0]
+    y1s = np.maximum(np.floor(starts * row_height) - band_margin, 0)
+    y2s = np.minimum(np.ceil(ends * row_height) + band_margin, height)
+
+    bands: list[tuple[int, int]] = []
+    for y1, y2 in zip(y1s.astype(int).tolist(), y2s.astype(int).tolist()):
+        if len(bands) > 0 and y1 <= bands[-1][1] + merge_gap:
+            bands[-1] = (bands[-1][0], max(bands[-1][1], y2))
+        else:
+            bands.append((y1, y2))
+    return bands
@@ -0,0 +1,82 @@
+import numpy as np
+import cv2
+from mstudio.mask import Mask
+from .image_registry import image_registry
+from .batch import OPERATIONS
+
+
+# Dense passages (beamed runs, dots, accidentals) used to be annotated
+# by drawing a polygon around every single symbol. Instead, the connected
+# components of a binarized region are labeled all at once and each one
+# that passes the size filter becomes a candidate mask, cropped to
+# the bbox of the component.
+
+DEFAULT_MIN_AREA = 4
+"""Components with fewer pixels are considered noise"""
+
+
+def extract_components(
+        mask: Mask,
+        min_area: int = DEFAULT_MIN_AREA,
+        max_area: int | None = None,
+        connectivity: int = 8,
+) -> list[Mask]:
+    """
+    Splits a mask into its connected components, keeps those with
+    an area in the given range and returns them, from the top down
+    """
+    label_count, labels, stats, _ = cv2.connectedComponentsWithStats(
+        mask.plane, connectivity=connectivity, ltype=cv2.CV_32S
+    )
+
+    # label 0 is the background
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = areas >= min_area
+    if max_area is not None:
+        keep &= areas <= max_area
+    kept_labels = np.flatnonzero(keep) + 1
+    kept_labels = kept_labels[
+        np.lexsort((stats[kept_labels, 0], stats[kept_labels, 1]))
+    ]
+
+    components: list[Mask] = []
+    for label in kept_labels.tolist():
+        x, y, w, h = stats[label, :4].tolist()
+        plane = (labels[y:y + h, x:x + w] == label).view(np.uint8)
+        components.append(Mask(mask.left + x, mask.top + y, plane))
+    return components
+
+
+def extract_components_in_image(
+        handle: int,
+        left: int,
+        top: int,
+        width: int,
+        height: int,
+        operation: str = "otsu",
+        min_area: int = DEFAULT_MIN_AREA,
+        max_area: int | None = None,
+) -> list[Mask] | None:
+    """
+    Binarizes a rectangle of a registered image with the named operation
+    and splits the result into components. Returns None if the image
+    is not registered.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown background tool operation: {operation}")
+    if not image_registry.has_image(handle):
+        return None
+
+    lightness = image_registry.get_lightness_region(
+        handle, left, top, width, height
+    )
+    cache_key = image_registry.get_region_key(
+        handle, left, top, width, height
+    )
+    binarized = OPERATIONS[operation](lightness, cache_key=cache_key)
+
+    return extract_components(
+        Mask.from_alpha(left, top, binarized),
+        min_area=min_area,
+        max_area=max_area,
+    )
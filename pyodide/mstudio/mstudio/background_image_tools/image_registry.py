@@ -0,0 +1,143 @@
+import numpy as np
+from collections import OrderedDict
+from .plane_cache import get_content_key, get_lightness
+
+
+# The background image is sent to the python worker only once and kept
+# resident here. Background image tools then receive just a handle and
+# a rectangle and slice the region out of the registered image without
+# another transfer. Registered images are kept in LRU order and the least
+# recently used ones are evicted when the byte budget is exceeded.
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ImageRegistry:
+    """Keeps background images resident in python, addressed by handles"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._content_keys: dict[int, bytes] = {}
+        self._next_handle = 1
+
+    def register_image(self, image: np.ndarray) -> int:
+        """
+        Stores the image and returns its handle. The image is either RGBA
+        pixels (HxWx4), or just the lightness plane (HxW).
+        """
+        assert len(image.shape) == 2 or image.shape[2] == 4
+        handle = self._next_handle
+        self._next_handle += 1
+
+        self._images[handle] = image
+        self._content_keys[handle] = get_content_key(image)
+        self._evict()
+
+        return handle
+
+    def release_image(self, handle: int) -> None:
+        """Forgets the image, does nothing for unknown handles"""
+        self._images.pop(handle, None)
+        self._content_keys.pop(handle, None)
+
+    def has_image(self, handle: int) -> bool:
+        """False if the handle was released, evicted or never existed"""
+        return handle in self._images
+
+    def get_image(self, handle: int) -> np.ndarray:
+        """Returns the whole registered image"""
+        if handle not in self._images:
+            raise KeyError(f"The image handle {handle} is not registered.")
+        self._images.move_to_end(handle)
+        return self._images[handle]
+
+    def get_image_region(
+            self,
+            handle: int,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+    ) -> np.ndarray:
+        """
+        Returns a region of a registered image. If the region lies inside
+        the image, it is a zero-copy view. Otherwise the outside pixels
+        are zero (transparent), the same as browser's getImageData does.
+        """
+        return _slice_padded(self.get_image(handle), left, top, width, height)
+
+    def get_lightness_region(
+            self,
+            handle: int,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+    ) -> np.ndarray:
+        """
+        Returns a region of the lightness plane of a registered image.
+        The lightness is computed once for the whole image and cached,
+        so that overlapping regions reuse it.
+        """
+        image = self.get_image(handle)
+        if len(image.shape) == 2:
+            lightness = image
+        else:
+            lightness = get_lightness(
+                image, ("image", self._content_keys[handle])
+            )
+        return _slice_padded(lightness, left, top, width, height)
+
+    def get_region_key(
+            self,
+            handle: int,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+    ) -> tuple:
+        """Cache key for planes derived from a region of a registered image"""
+        if handle not in self._content_keys:
+            raise KeyError(f"The image handle {handle} is not registered.")
+        return (self._content_keys[handle], left, top, width, height)
+
+    def _evict(self) -> None:
+        # always keep at least the most recently used image
+        total_bytes = sum(image.nbytes for image in self._images.values())
+        while total_bytes > self.max_bytes and len(self._images) > 1:
+            handle, evicted = self._images.popitem(last=False)
+            self._content_keys.pop(handle, None)
+            total_bytes -= evicted.nbytes
+
+
+def _slice_padded(
+        array: np.ndarray,
+        left: int,
+        top: int,
+        width: int,
+        height: int,
+) -> np.ndarray:
+    """
+    Slices a rectangle out of an array. If it lies inside the array,
+    it is a zero-copy view. Otherwise the outside pixels are zero
+    (transparent), the same as browser's getImageData does.
+    """
+    array_height, array_width = array.shape[:2]
+
+    if left >= 0 and top >= 0 \
+            and left + width <= array_width \
+            and top + height <= array_height:
+        return array[top:top + height, left:left + width]
+
+    region = np.zeros((height, width) + array.shape[2:], dtype=array.dtype)
+    x1, y1 = max(left, 0), max(top, 0)
+    x2 = min(left + width, array_width)
+    y2 = min(top + height, array_height)
+    if x1 < x2 and y1 < y2:
+        region[y1 - top:y2 - top, x1 - left:x2 - left] = array[y1:y2, x1:x2]
+    return region
+
+
+# the registry instance used by MuNG Studio
+image_registry = ImageRegistry()
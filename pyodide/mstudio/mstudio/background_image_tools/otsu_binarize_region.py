@@ -1,27 +1,35 @@
 import numpy as np
 import cv2
+from typing import Hashable
+from .tiling import DEFAULT_TILE_SIZE, iterate_tiles, \
+    otsu_threshold_from_histogram
+from .plane_cache import plane_cache, get_content_key, get_lightness
 
 
-def otsu_binarize_region(region: np.ndarray) -> np.ndarray:
+# bilateral filter parameters (diameter, sigma color, sigma space)
+BILATERAL_DIAMETER = 5
+BILATERAL_SIGMA = 25
+
+# the bilateral filter reaches half of its diameter away
+TILE_MARGIN = BILATERAL_DIAMETER // 2 + 1
+
+
+def otsu_binarize_region(
+        region: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
     """Applies otsu binarization to the given region of background image"""
     assert len(region.shape) == 3 # WxHxC
     assert region.shape[2] == 4 # RGBA
 
+    if cache_key is None:
+        cache_key = get_content_key(region)
+
     # get lightness of the original image
-    image_hls = cv2.cvtColor(region, cv2.COLOR_RGB2HLS)
-    lightness = image_hls[:,:,1]
-
-    # apply Otsu binarization (blur creates two distinc modalities - ink&paper
-    # and Otsu finds the midpoint between the two to use as the threshold)
-    # also, use bilateral filter blur to preserve edges instead of gaussian
-    blurred_lightness = cv2.bilateralFilter(lightness, 5, 25, 25)
-    found_threshold, binarized = cv2.threshold(
-        blurred_lightness, 0, 255,
-        cv2.THRESH_BINARY + cv2.THRESH_OTSU
-    )
+    lightness = get_lightness(region, cache_key)
 
-    # convert black regions (the ink) to white
-    binarized = 255 - binarized
+    binarized = otsu_binarize_lightness(lightness, tile_size, cache_key)
 
     # b/w to red+alpha mask
     out_region = np.zeros_like(region)
@@ -29,3 +37,63 @@ def otsu_binarize_region(region: np.ndarray) -> np.ndarray:
     out_region[:, :, 3] = binarized # alpha
 
     return out_region
+
+
+def otsu_binarize_lightness(
+        lightness: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
+    """
+    Applies otsu binarization to a lightness plane, returns white-on-black
+    mask. When a cache key is given, the blurred plane and its histogram
+    are cached.
+    """
+    assert len(lightness.shape) == 2 # HxW
+
+    if cache_key is None:
+        blurred, histogram = blur_lightness(lightness, tile_size)
+    else:
+        blurred, histogram = plane_cache.get_or_compute(
+            ("bilateral", BILATERAL_DIAMETER, BILATERAL_SIGMA, cache_key),
+            lambda: blur_lightness(lightness, tile_size)
+        )
+
+    found_threshold = otsu_threshold_from_histogram(histogram)
+
+    # binarize and convert black regions (the ink) to white
+    _, binarized = cv2.threshold(
+        blurred, found_threshold, 255,
+        cv2.THRESH_BINARY_INV
+    )
+
+    return binarized
+
+
+def blur_lightness(
+        lightness: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the bilateral-blurred lightness and its histogram.
+
+    Otsu threshold is global, so the blurred lightness is computed
+    tile-by-tile while accumulating the histogram and only then
+    the threshold can be found and applied to the whole plane.
+    """
+    height, width = lightness.shape
+    blurred_lightness = np.empty_like(lightness)
+    histogram = np.zeros(256, dtype=np.int64)
+    for tile in iterate_tiles(width, height, tile_size, TILE_MARGIN):
+        # apply Otsu binarization (blur creates two distinc modalities -
+        # ink&paper and Otsu finds the midpoint between the two to use
+        # as the threshold) also, use bilateral filter blur to preserve
+        # edges instead of gaussian
+        blurred = cv2.bilateralFilter(
+            lightness[tile.outer],
+            BILATERAL_DIAMETER, BILATERAL_SIGMA, BILATERAL_SIGMA
+        )[tile.inner_in_outer]
+        blurred_lightness[tile.inner] = blurred
+        histogram += np.bincount(blurred.ravel(), minlength=256)
+
+    return blurred_lightness, histogram
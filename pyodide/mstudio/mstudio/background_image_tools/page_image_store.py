@@ -0,0 +1,101 @@
+import hashlib
+import os
+import numpy as np
+import cv2
+
+
+class PageImageStore:
+    """
+    Caches decoded page scans as memory-mapped .npy files, so that offline
+    corpus-wide processing decodes each PNG/JPG only once. Regions are
+    returned as zero-copy views into the memory map, which means many
+    processes can share the same page data through the OS page cache.
+
+    This is meant for running the background image tools in CPython over
+    a whole corpus (the same images that the simple-php-backend serves),
+    it is not used inside pyodide.
+    """
+
+    def __init__(self, cache_folder: str, lightness_only: bool = False):
+        """
+        :param cache_folder: Where to put the decoded .npy files.
+        :param lightness_only: Store only the HLS lightness plane (HxW)
+            instead of the full RGBA pixels (HxWx4). That is 4x smaller,
+            but only usable by tools that accept a lightness plane.
+        """
+        self.cache_folder = cache_folder
+        self.lightness_only = lightness_only
+        self._pages: dict[str, np.ndarray] = {}
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def get_page(self, image_path: str) -> np.ndarray:
+        """Returns the whole page as a read-only memory-mapped array"""
+        cache_path = self._get_cache_path(image_path)
+
+        page = self._pages.get(cache_path)
+        if page is not None:
+            return page
+
+        if not os.path.exists(cache_path):
+            self._convert_page(image_path, cache_path)
+
+        page = np.load(cache_path, mmap_mode="r")
+        self._pages[cache_path] = page
+        return page
+
+    def get_region(
+            self,
+            image_path: str,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+    ) -> np.ndarray:
+        """Returns a zero-copy view of a rectangular region of a page"""
+        page = self.get_page(image_path)
+        assert left >= 0 and top >= 0
+        assert left + width <= page.shape[1]
+        assert top + height <= page.shape[0]
+        return page[top:top + height, left:left + width]
+
+    def convert_pages(self, image_paths: list[str]) -> None:
+        """Makes sure all the given pages are decoded into the cache"""
+        for image_path in image_paths:
+            cache_path = self._get_cache_path(image_path)
+            if not os.path.exists(cache_path):
+                self._convert_page(image_path, cache_path)
+
+    def _get_cache_path(self, image_path: str) -> str:
+        # the key changes whenever the source image file changes
+        stat = os.stat(image_path)
+        key = "|".join([
+            os.path.abspath(image_path),
+            str(stat.st_mtime_ns),
+            str(stat.st_size),
+            "L" if self.lightness_only else "RGBA",
+        ])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_folder, digest + ".npy")
+
+    def _convert_page(self, image_path: str, cache_path: str) -> None:
+        image_bgr = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image_bgr is None:
+            raise IOError(f"Cannot decode the image {image_path}")
+
+        if self.lightness_only:
+            image_hls = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HLS)
+            pixels = image_hls[:, :, 1]
+        else:
+            # the same pixel layout as ImageData in the browser
+            pixels = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGBA)
+
+        # write into a temporary file first, so that concurrent processes
+        # never memory-map a half-written page
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        page = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.uint8, shape=pixels.shape
+        )
+        page[...] = pixels
+        page.flush()
+        del page
+        os.replace(tmp_path, cache_path)
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import numpy as np
+import cv2
+from collections import OrderedDict
+from typing import Callable, Hashable, TypeVar
+from .tiling import DEFAULT_TILE_SIZE, iterate_tiles
+
+
+# Background tools are often run repeatedly on the same (or overlapping)
+# area of a page. Planes derived from the image (lightness, morphologically
+# closed lightness, blurred planes with their histograms) are therefore cached, keyed by the image content hash plus the rectangle.
+# The cache is bounded by the total byte size of the cached arrays
+# and evicts in LRU order. It may be used from multiple threads (batches
+# run on a thread pool), the values are computed outside of the lock.
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+T = TypeVar("T")
+
+
+class PlaneCache:
+    """Byte-size-bounded LRU cache of numpy arrays (or tuples of them)"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[object, int]] = \
+            OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """Returns the cached value, or computes and caches it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0] # type: ignore
+
+        value = _freeze(compute())
+        size = _get_nbytes(value)
+        if size <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = (value, size)
+                    self._total_bytes += size
+                    self._evict()
+        return value
+
+    def clear(self) -> None:
+        """Forgets all cached values"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+
+
+def _freeze(value):
+    # cached arrays are shared, nobody is allowed to modify them
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    if isinstance(value, tuple):
+        for v in value:
+            _freeze(v)
+    return value
+
+
+def _get_nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_get_nbytes(v) for v in value)
+    return 0
+
+
+# the cache instance used by MuNG Studio
+plane_cache = PlaneCache()
+
+
+def get_content_key(pixels: np.ndarray) -> bytes:
+    """Hash of array contents, usable as a cache key"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((pixels.shape, pixels.dtype.str)).encode("ascii"))
+    digest.update(np.ascontiguousarray(pixels))
+    return digest.digest()
+
+
+def compute_lightness(
+        region: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+) -> np.ndarray:
+    """Extracts the HLS lightness plane from an RGBA region, tile by tile"""
+    assert len(region.shape) == 3 # WxHxC
+    assert region.shape[2] == 4 # RGBA
+
+    height, width = region.shape[:2]
+    lightness = np.empty((height, width), dtype=np.uint8)
+    for tile in iterate_tiles(width, height, tile_size, 0):
+        image_hls = cv2.cvtColor(region[tile.outer], cv2.COLOR_RGB2HLS)
+        lightness[tile.inner] = image_hls[:,:,1]
+    return lightness
+
+
+def get_lightness(
+        region: np.ndarray,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
+    """
+    Returns the (cached) lightness plane of an RGBA region. The returned
+    array must not be modified. When no cache key is given, the region
+    contents are hashed to get one.
+    """
+    if cache_key is None:
+        cache_key = get_content_key(region)
+    return plane_cache.get_or_compute(
+        ("lightness", cache_key),
+        lambda: compute_lightness(region)
+    )
+
@@ -0,0 +1,142 @@
+import numpy as np
+import cv2
+from typing import Hashable
+from .tiling import DEFAULT_TILE_SIZE, iterate_tiles
+from .plane_cache import get_content_key, get_lightness
+
+
+# Sauvola binarization computes a threshold for each pixel from the mean
+# and the standard deviation of the lightness in a window around it:
+#
+#   T = mean * (1 + k * (std / R - 1))
+#
+# Unlike the global Otsu threshold, this copes with unevenly lit scans.
+# Window sums are read from integral images, so the cost per pixel does
+# not depend on the window size. The integral images are float64 of two
+# planes (16 bytes per pixel) and cheap to compute, so they are computed
+# per tile and not cached, only the lightness plane is.
+
+# side of the square window the local statistics are computed over
+SAUVOLA_WINDOW = 51
+
+# sensitivity, how much the standard deviation lowers the threshold
+SAUVOLA_K = 0.2
+
+# dynamic range of the standard deviation
+SAUVOLA_R = 128
+
+
+def sauvola_binarize_region(
+        region: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+) -> np.ndarray:
+    """Applies sauvola binarization to the given region of background image"""
+    assert len(region.shape) == 3 # WxHxC
+    assert region.shape[2] == 4 # RGBA
+
+    if cache_key is None:
+        cache_key = get_content_key(region)
+
+    # get lightness of the original image
+    lightness = get_lightness(region, cache_key)
+
+    binarized = sauvola_binarize_lightness(lightness, tile_size, cache_key)
+
+    # b/w to red+alpha mask
+    out_region = np.zeros_like(region)
+    out_region[:, :, 0] = binarized # red
+    out_region[:, :, 3] = binarized # alpha
+
+    return out_region
+
+
+def sauvola_binarize_lightness(
+        lightness: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        cache_key: Hashable | None = None,
+        window: int = SAUVOLA_WINDOW,
+        k: float = SAUVOLA_K,
+) -> np.ndarray:
+    """
+    Applies sauvola binarization to a lightness plane, returns white-on-black
+    mask. The cache key is unused, nothing derived from the lightness
+    is worth caching.
+    """
+    assert len(lightness.shape) == 2 # HxW
+    assert window % 2 == 1 # the window is centered on the pixel
+
+    # the window reaches half of its size away
+    radius = window // 2
+
+    height, width = lightness.shape
+    binarized = np.empty_like(lightness)
+    for tile in iterate_tiles(width, height, tile_size, radius):
+        outer = lightness[tile.outer]
+        integrals = cv2.integral2(
+            outer, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F
+        )
+        threshold = compute_sauvola_threshold(
+            integrals, tile.inner_in_outer, radius, k
+        )
+        # ink is darker than the threshold, make it white
+        ink = outer[tile.inner_in_outer] < threshold
+        binarized[tile.inner] = ink.view(np.uint8) * np.uint8(255)
+
+    return binarized
+
+
+def compute_sauvola_threshold(
+        integrals: tuple[np.ndarray, np.ndarray],
+        rows_and_columns: tuple[slice, slice],
+        radius: int,
+        k: float,
+) -> np.ndarray:
+    """
+    Computes the sauvola threshold for the given rows and columns of a plane
+    from its integral images. Windows are clipped at the plane borders.
+    """
+    sums, square_sums = integrals
+    height = sums.shape[0] - 1
+    width = sums.shape[1] - 1
+    rows, columns = rows_and_columns
+
+    # window bounds for each row and each column
+    ys = np.arange(rows.start, rows.stop)
+    xs = np.arange(columns.start, columns.stop)
+    y1 = np.maximum(ys - radius, 0)
+    y2 = np.minimum(ys + radius + 1, height)
+    x1 = np.maximum(xs - radius, 0)
+    x2 = np.minimum(xs + radius + 1, width)
+    inverse_rows = 1 / (y2 - y1)[:, None]
+    inverse_columns = 1 / (x2 - x1)[None, :]
+
+    # sum = I[y2, x2] - I[y1, x2] - I[y2, x1] + I[y1, x1], where clipping
+    # the bounds at the borders is the same as replicating the edges
+    # of the integral image, after which all four corners are just slices
+    window = 2 * radius + 1
+    def window_sum(integral: np.ndarray) -> np.ndarray:
+        padded = np.pad(integral, radius, mode="edge")[
+            rows.start:rows.stop + window,
+            columns.start:columns.stop + window,
+        ]
+        row_sums = padded[window:] - padded[:-window]
+        return row_sums[:, window:] - row_sums[:, :-window]
+
+    # divided by the number of pixels in the window
+    mean = window_sum(sums)
+    mean *= inverse_rows
+    mean *= inverse_columns
+    std = window_sum(square_sums)
+    std *= inverse_rows
+    std *= inverse_columns
+    std -= mean * mean # variance
+    np.maximum(std, 0, out=std)
+    np.sqrt(std, out=std)
+
+    # mean * (1 + k * (std / R - 1))
+    threshold = std
+    threshold *= k / SAUVOLA_R
+    threshold += 1 - k
+    threshold *= mean
+    return threshold
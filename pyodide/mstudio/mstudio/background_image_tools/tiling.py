@@ -0,0 +1,81 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Iterator
+
+
+# Background image tools may be given a region spanning a whole 600-dpi page.
+# Processing it in one shot allocates several full-size intermediates, which
+# can exhaust the pyodide heap. Instead, the region is processed in tiles.
+# Each tile is enlarged by a margin large enough to cover the neighbourhood
+# of all the filters applied, so that the inner part of each tile is exactly
+# the same as if the whole region was processed at once.
+
+DEFAULT_TILE_SIZE = 2048
+
+
+@dataclass
+class Tile:
+    """One tile of a region, with its margin-enlarged surroundings"""
+
+    outer: tuple[slice, slice]
+    """Rows and columns of the region to be processed (tile + margins)"""
+
+    inner: tuple[slice, slice]
+    """Rows and columns of the region this tile is responsible for"""
+
+    inner_in_outer: tuple[slice, slice]
+    """The inner part, relative to the processed outer part"""
+
+
+def iterate_tiles(
+        width: int,
+        height: int,
+        tile_size: int,
+        margin: int,
+) -> Iterator[Tile]:
+    """
+    Splits a region into tiles of at most tile_size x tile_size pixels.
+    Regions that fit into one tile are yielded as a single tile.
+    """
+    assert tile_size > 0
+    assert margin >= 0
+
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            inner_y2 = min(y + tile_size, height)
+            inner_x2 = min(x + tile_size, width)
+            outer_y1 = max(y - margin, 0)
+            outer_x1 = max(x - margin, 0)
+            outer_y2 = min(inner_y2 + margin, height)
+            outer_x2 = min(inner_x2 + margin, width)
+            yield Tile(
+                outer=(slice(outer_y1, outer_y2), slice(outer_x1, outer_x2)),
+                inner=(slice(y, inner_y2), slice(x, inner_x2)),
+                inner_in_outer=(
+                    slice(y - outer_y1, inner_y2 - outer_y1),
+                    slice(x - outer_x1, inner_x2 - outer_x1),
+                ),
+            )
+
+
+def otsu_threshold_from_histogram(histogram: np.ndarray) -> int:
+    """
+    Computes the Otsu threshold from a 256-bin histogram, the same way
+    cv2.threshold(..., cv2.THRESH_OTSU) does, but the histogram can be
+    accumulated over many tiles
+    """
+    assert histogram.shape == (256,)
+
+    p = histogram.astype(np.float64) / max(histogram.sum(), 1)
+    q1 = np.cumsum(p) # probability of the lower class
+    q2 = 1.0 - q1 # probability of the upper class
+    m1 = np.cumsum(p * np.arange(256)) # first moment of the lower class
+    mt = m1[-1] # total mean
+
+    # between-class variance, skipping empty classes just like OpenCV
+    eps = np.finfo(np.float32).eps
+    valid = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1.0 - eps)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.where(valid, (mt * q1 - m1) ** 2 / (q1 * q2), 0.0)
+
+    return int(np.argmax(sigma))
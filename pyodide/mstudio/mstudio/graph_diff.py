@@ -0,0 +1,121 @@
+import hashlib
+import numpy as np
+from dataclasses import dataclass
+from mung.node import Node
+
+
+# A graph diff describes the effect of a python operation on the nodes
+# it received from javascript. Sending back just the diff instead of all
+# the nodes keeps the marshalling payload and the store-update work
+# proportional to what the operation actually did.
+
+@dataclass
+class NodeSnapshot:
+    """Values of a node before an operation, used to detect changes"""
+    class_name: str
+    bbox: tuple[int, int, int, int]
+    outlinks: tuple[int, ...]
+    mask_digest: bytes | None
+
+    @staticmethod
+    def of(node: Node) -> "NodeSnapshot":
+        return NodeSnapshot(
+            class_name=node.class_name,
+            bbox=(node.top, node.left, node.width, node.height),
+            outlinks=tuple(node.outlinks),
+            mask_digest=get_mask_digest(node.mask),
+        )
+
+
+@dataclass
+class NodeChange:
+    """A node that existed before the operation and was modified by it"""
+
+    node: Node
+    """The node in its modified state"""
+
+    changed_fields: set[str]
+    """Which fields changed, any of 'className', 'bbox', 'mask'"""
+
+
+@dataclass
+class GraphDiff:
+    """Changes made to a list of nodes by some operation"""
+
+    changed_nodes: list[NodeChange]
+    """Nodes whose class name, bounding box or mask was modified"""
+
+    added_nodes: list[Node]
+    """Nodes that did not exist before the operation"""
+
+    removed_node_ids: list[int]
+    """IDs of nodes that no longer exist after the operation"""
+
+    added_links: list[tuple[int, int]]
+    """Syntax links (from, to) created by the operation"""
+
+    removed_links: list[tuple[int, int]]
+    """Syntax links (from, to) removed by the operation"""
+
+
+def snapshot_nodes(nodes: list[Node]) -> dict[int, NodeSnapshot]:
+    """Remembers the state of nodes before running an operation on them"""
+    return {node.id: NodeSnapshot.of(node) for node in nodes}
+
+
+def compute_graph_diff(
+        before: dict[int, NodeSnapshot],
+        after: list[Node],
+) -> GraphDiff:
+    """Compares the snapshot taken before an operation with the result"""
+    changed_nodes: list[NodeChange] = []
+    added_nodes: list[Node] = []
+    added_links: list[tuple[int, int]] = []
+    removed_links: list[tuple[int, int]] = []
+
+    after_ids: set[int] = set()
+    for node in after:
+        after_ids.add(node.id)
+        snapshot = before.get(node.id)
+
+        if snapshot is None:
+            added_nodes.append(node)
+            added_links += [(node.id, to) for to in node.outlinks]
+            continue
+
+        changed_fields: set[str] = set()
+        if node.class_name != snapshot.class_name:
+            changed_fields.add("className")
+        if (node.top, node.left, node.width, node.height) != snapshot.bbox:
+            changed_fields.add("bbox")
+        if get_mask_digest(node.mask) != snapshot.mask_digest:
+            changed_fields.add("mask")
+        if len(changed_fields) > 0:
+            changed_nodes.append(NodeChange(node, changed_fields))
+
+        old_outlinks = set(snapshot.outlinks)
+        new_outlinks = set(node.outlinks)
+        added_links += [(node.id, to) for to in new_outlinks - old_outlinks]
+        removed_links += [(node.id, to) for to in old_outlinks - new_outlinks]
+
+    removed_node_ids = [id for id in before.keys() if id not in after_ids]
+    for id in removed_node_ids:
+        removed_links += [(id, to) for to in before[id].outlinks]
+
+    return GraphDiff(
+        changed_nodes=changed_nodes,
+        added_nodes=added_nodes,
+        removed_node_ids=removed_node_ids,
+        added_links=added_links,
+        removed_links=removed_links,
+    )
+
+
+def get_mask_digest(mask: np.ndarray | None) -> bytes | None:
+    """Fingerprint of mask pixels, so that masks need not be kept around"""
+    if mask is None:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(mask.shape).encode("ascii"))
+    digest.update(np.ascontiguousarray(mask != 0))
+    return digest.digest()
@@ -1,6 +1,8 @@
+import itertools
 import numpy as np
 from typing import TypeVar
 from mung.node import Node
+from mstudio.graph_diff import GraphDiff
 
 T = TypeVar("T")
 
@@ -11,6 +13,16 @@ def unwrap_proxy(possible_proxy: T) -> T:
     return possible_proxy
 
 
+def unwrap_buffer(possible_proxy) -> memoryview:
+    """
+    If the given object is a JsProxy of a typed array, its contents are
+    copied into python memory (once), otherwise the buffer is used as-is
+    """
+    if hasattr(possible_proxy, "to_memoryview"):
+        return possible_proxy.to_memoryview()
+    return memoryview(possible_proxy)
+
+
 #############
 # Mask RGBA #
 #############
@@ -21,16 +33,17 @@ def marshal_mask_rgba(mask: np.ndarray) -> tuple[int, int, np.ndarray]:
     assert len(mask.shape) == 3 # HxWxC
     assert mask.shape[2] == 4 # RGBA
 
-    return (mask.shape[1], mask.shape[0], mask.flatten())
+    # ravel returns a view (not a copy) for contiguous arrays
+    return (mask.shape[1], mask.shape[0], mask.ravel())
 
 def unmarshal_mask_rgba(
         marshalled_mask: tuple[int, int, memoryview]
 ) -> np.ndarray:
     """Receive a mask sent from javascript"""
     width, height, data = marshalled_mask
-    data = unwrap_proxy(data)
+    data = unwrap_buffer(data)
 
-    mask = np.asarray(data, dtype=np.uint8).reshape((height, width, 4))
+    mask = np.frombuffer(data, dtype=np.uint8).reshape((height, width, 4))
     
     assert mask.dtype == np.uint8 # bytes
     assert len(mask.shape) == 3 # HxWxC
@@ -39,20 +52,126 @@ def unmarshal_mask_rgba(
     return mask
 
 
+##############
+# Mask Alpha #
+##############
+
+def marshal_mask_alpha(mask: np.ndarray) -> tuple[int, int, np.ndarray]:
+    """Prepare a single-channel (alpha-only) mask to be sent to javascript"""
+    assert mask.dtype == np.uint8 # bytes
+    assert len(mask.shape) == 2 # HxW
+
+    # ravel returns a view (not a copy) for contiguous arrays
+    return (mask.shape[1], mask.shape[0], mask.ravel())
+
+
+def unmarshal_mask_alpha(
+        marshalled_mask: tuple[int, int, memoryview]
+) -> np.ndarray:
+    """Receive a single-channel (alpha-only) mask sent from javascript"""
+    width, height, data = marshalled_mask
+    data = unwrap_buffer(data)
+
+    mask = np.frombuffer(data, dtype=np.uint8).reshape((height, width))
+
+    assert mask.dtype == np.uint8 # bytes
+    assert len(mask.shape) == 2 # HxW
+
+    return mask
+
+
+###################
+# Lightness Plane #
+###################
+
+def unmarshal_plane(
+        marshalled_plane: tuple[int, int, memoryview]
+) -> np.ndarray:
+    """Receive a single-channel uint8 plane (e.g. lightness) from javascript"""
+    width, height, data = marshalled_plane
+    data = unwrap_buffer(data)
+
+    plane = np.frombuffer(data, dtype=np.uint8).reshape((height, width))
+
+    assert plane.dtype == np.uint8 # bytes
+    assert len(plane.shape) == 2 # HxW
+
+    return plane
+
+
+###################
+# Mask Compressed #
+###################
+
+MASK_ENCODING_RAW = "raw" # alpha plane, one byte per pixel
+MASK_ENCODING_BITS = "bits" # np.packbits, one bit per pixel (MSB first)
+MASK_ENCODING_RLE = "rle" # uint32 run lengths, starting with an empty run
+
+# masks with fewer pixels are always sent raw, compression is not worth it
+MASK_COMPRESSION_MIN_PIXELS = 4096
+
+def marshal_mask_compressed(
+        mask: np.ndarray
+) -> tuple[int, int, str, np.ndarray]:
+    """
+    Prepare a 0/1 mask to be sent to javascript, encoded in whichever
+    format (raw, bit-packed, run-length) produces the smallest payload
+    """
+    assert len(mask.shape) == 2 # HxW
+
+    height, width = mask.shape
+    pixel_count = width * height
+    if pixel_count < MASK_COMPRESSION_MIN_PIXELS:
+        alpha = np.multiply(mask != 0, 255, dtype=np.uint8)
+        return (width, height, MASK_ENCODING_RAW, alpha.ravel())
+
+    flat = mask.ravel() != 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    
+    rle_size = 4 * (len(changes) + 2)
+    bits_size = (pixel_count + 7) // 8
+    
+    if rle_size < bits_size:
+        boundaries = np.concatenate(([0], changes, [pixel_count]))
+        runs = np.diff(boundaries).astype(np.uint32)
+        if flat[0]:
+            runs = np.concatenate(([0], runs)).astype(np.uint32)
+        return (width, height, MASK_ENCODING_RLE, runs)
+    
+    return (width, height, MASK_ENCODING_BITS, np.packbits(flat))
+
+def unmarshal_mask_compressed(
+        marshalled_mask: tuple[int, int, str, memoryview]
+) -> np.ndarray:
+    """Receive a 0/1 mask sent from javascript in any of the encodings"""
+    width, height, encoding, data = marshalled_mask
+    data = unwrap_buffer(data)
+    pixel_count = width * height
+
+    if encoding == MASK_ENCODING_RAW:
+        flat = np.frombuffer(data, dtype=np.uint8) // 255
+    elif encoding == MASK_ENCODING_BITS:
+        flat = np.unpackbits(
+            np.frombuffer(data, dtype=np.uint8), count=pixel_count
+        )
+    elif encoding == MASK_ENCODING_RLE:
+        runs = np.frombuffer(data, dtype=np.uint32)
+        values = np.arange(len(runs), dtype=np.uint8) % 2
+        flat = np.repeat(values, runs)
+    else:
+        raise ValueError(f"Unknown mask encoding: {encoding}")
+
+    assert flat.shape == (pixel_count,)
+    
+    return flat.reshape((height, width))
+
+
 #############
 # MuNG Node #
 #############
 
 def marshal_mung_node(node: Node) -> dict:
     """Prepare a MuNG node to be sent back to javascript"""
-    # convert mask format
-    mask = None
-    if node.mask is not None:
-        color = node.mask * 255 # from 0/1 to grayscale 0-255
-        mask = np.zeros(shape=(node.height, node.width, 4), dtype=np.uint8)
-        mask[:, :, 0] = color # red
-        mask[:, :, 3] = color # alpha
-
     return {
         "id": node.id,
         "className": node.class_name,
@@ -62,7 +181,10 @@ def marshal_mung_node(node: Node) -> dict:
         "height": node.height,
         "outlinks": node.outlinks,
         "inlinks": node.inlinks,
-        "mask": marshal_mask_rgba(mask) if mask is not None else None,
+        "mask": (
+            marshal_mask_compressed(node.mask)
+            if node.mask is not None else None
+        ),
         "data": node.data,
     }
 
@@ -72,8 +194,7 @@ def unmarshal_mung_node(marshalled_node: dict) -> Node:
     
     mask = None
     if marshalled_node.get("mask") is not None:
-        mask_rgba = unmarshal_mask_rgba(marshalled_node["mask"])
-        mask = mask_rgba[:, :, 3] // 255 # alpha downscaled to 0/1
+        mask = unmarshal_mask_compressed(marshalled_node["mask"])
     
     md: dict = marshalled_node["data"]
     data = {
@@ -103,3 +224,191 @@ def unmarshal_mung_nodes(marshalled_nodes: list[dict]) -> list[Node]:
     """Receive a list of MuNG nodes send from javascript"""
     marshalled_nodes = unwrap_proxy(marshalled_nodes)
     return [unmarshal_mung_node(n) for n in marshalled_nodes]
+
+
+###################
+# MuNG Node Batch #
+###################
+
+def marshal_mung_node_batch(nodes: list[Node]) -> dict:
+    """
+    Prepare a list of MuNG nodes to be sent back to javascript in the
+    columnar (struct-of-arrays) format. Scalar fields become typed arrays,
+    links become offset+value arrays and all masks are bit-packed
+    into one shared blob.
+    """
+    class_name_table = sorted(set(n.class_name for n in nodes))
+    class_name_lookup = {c: i for i, c in enumerate(class_name_table)}
+
+    def _ints(values) -> np.ndarray:
+        return np.fromiter(values, dtype=np.int32, count=len(nodes))
+
+    data = [n.data or {} for n in nodes]
+
+    outlink_offsets, outlinks = _pack_ragged([n.outlinks for n in nodes])
+    inlink_offsets, inlinks = _pack_ragged([n.inlinks for n in nodes])
+    precedence_outlink_offsets, precedence_outlinks = _pack_ragged(
+        [d.get("precedence_outlinks", []) for d in data]
+    )
+    precedence_inlink_offsets, precedence_inlinks = _pack_ragged(
+        [d.get("precedence_inlinks", []) for d in data]
+    )
+
+    # all masks are flattened, concatenated and bit-packed at once
+    has_mask = np.fromiter(
+        (n.mask is not None for n in nodes), dtype=np.uint8, count=len(nodes)
+    )
+    mask_sizes = np.array(
+        [n.mask.size if n.mask is not None else 0 for n in nodes],
+        dtype=np.float64
+    )
+    mask_offsets = np.zeros(len(nodes) + 1, dtype=np.float64)
+    np.cumsum(mask_sizes, out=mask_offsets[1:])
+    flat_masks = [n.mask.ravel() != 0 for n in nodes if n.mask is not None]
+    masks = np.packbits(
+        np.concatenate(flat_masks) if len(flat_masks) > 0
+        else np.zeros(0, dtype=np.bool_)
+    )
+
+    return {
+        "ids": _ints(n.id for n in nodes),
+        "classNameTable": class_name_table,
+        "classNameIndices": _ints(
+            class_name_lookup[n.class_name] for n in nodes
+        ),
+        "tops": _ints(n.top for n in nodes),
+        "lefts": _ints(n.left for n in nodes),
+        "widths": _ints(n.width for n in nodes),
+        "heights": _ints(n.height for n in nodes),
+        "outlinkOffsets": outlink_offsets,
+        "outlinks": outlinks,
+        "inlinkOffsets": inlink_offsets,
+        "inlinks": inlinks,
+        "precedenceOutlinkOffsets": precedence_outlink_offsets,
+        "precedenceOutlinks": precedence_outlinks,
+        "precedenceInlinkOffsets": precedence_inlink_offsets,
+        "precedenceInlinks": precedence_inlinks,
+        "textTranscriptions": [d.get("text_transcription") for d in data],
+        "hasMask": has_mask,
+        "maskOffsets": mask_offsets,
+        "masks": masks,
+    }
+
+def unmarshal_mung_node_batch(marshalled_batch: dict) -> list[Node]:
+    """Receive a list of MuNG nodes sent from javascript in columnar format"""
+    mb = unwrap_proxy(marshalled_batch)
+
+    def _array(key: str, dtype) -> np.ndarray:
+        return np.frombuffer(unwrap_buffer(mb[key]), dtype=dtype)
+
+    ids = _array("ids", np.int32).tolist()
+    class_name_table = [str(c) for c in mb["classNameTable"]]
+    class_names = [
+        class_name_table[i] for i in _array("classNameIndices", np.int32)
+    ]
+    tops = _array("tops", np.int32).tolist()
+    lefts = _array("lefts", np.int32).tolist()
+    widths = _array("widths", np.int32).tolist()
+    heights = _array("heights", np.int32).tolist()
+    
+    outlinks = _unpack_ragged(
+        _array("outlinkOffsets", np.int32), _array("outlinks", np.int32)
+    )
+    inlinks = _unpack_ragged(
+        _array("inlinkOffsets", np.int32), _array("inlinks", np.int32)
+    )
+    precedence_outlinks = _unpack_ragged(
+        _array("precedenceOutlinkOffsets", np.int32),
+        _array("precedenceOutlinks", np.int32)
+    )
+    precedence_inlinks = _unpack_ragged(
+        _array("precedenceInlinkOffsets", np.int32),
+        _array("precedenceInlinks", np.int32)
+    )
+    text_transcriptions = list(mb["textTranscriptions"])
+
+    # unpack all masks at once, nodes get views into the shared array
+    has_mask = _array("hasMask", np.uint8).tolist()
+    mask_offsets = _array("maskOffsets", np.float64).astype(np.int64)
+    all_mask_pixels = np.unpackbits(
+        _array("masks", np.uint8), count=int(mask_offsets[-1])
+    )
+
+    nodes: list[Node] = []
+    for i in range(len(ids)):
+        mask = None
+        if has_mask[i]:
+            mask = all_mask_pixels[mask_offsets[i]:mask_offsets[i + 1]] \
+                .reshape((heights[i], widths[i]))
+        nodes.append(Node(
+            id_=ids[i],
+            class_name=class_names[i],
+            top=tops[i],
+            left=lefts[i],
+            width=widths[i],
+            height=heights[i],
+            outlinks=outlinks[i],
+            inlinks=inlinks[i],
+            mask=mask,
+            data={
+                "precedence_outlinks": precedence_outlinks[i],
+                "precedence_inlinks": precedence_inlinks[i],
+                "text_transcription": text_transcriptions[i],
+            },
+        ))
+    return nodes
+
+def _pack_ragged(lists: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """Packs a list of int lists into (offsets, values) arrays"""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    np.cumsum(
+        np.fromiter((len(l) for l in lists), dtype=np.int32, count=len(lists)),
+        out=offsets[1:]
+    )
+    values = np.fromiter(
+        itertools.chain.from_iterable(lists),
+        dtype=np.int32,
+        count=int(offsets[-1])
+    )
+    return offsets, values
+
+def _unpack_ragged(offsets: np.ndarray, values: np.ndarray) -> list[list[int]]:
+    """Unpacks (offsets, values) arrays into a list of int lists"""
+    offsets_list = offsets.tolist()
+    values_list = values.tolist()
+    return [
+        values_list[a:b] for a, b in zip(offsets_list, offsets_list[1:])
+    ]
+
+
+##############
+# Graph Diff #
+##############
+
+def marshal_graph_diff(diff: GraphDiff) -> dict:
+    """Prepare a graph diff to be sent back to javascript"""
+    changed_nodes = []
+    for change in diff.changed_nodes:
+        node = change.node
+        marshalled_change: dict = {"id": node.id}
+        if "className" in change.changed_fields:
+            marshalled_change["className"] = node.class_name
+        if "bbox" in change.changed_fields:
+            marshalled_change["top"] = node.top
+            marshalled_change["left"] = node.left
+            marshalled_change["width"] = node.width
+            marshalled_change["height"] = node.height
+        if "mask" in change.changed_fields:
+            marshalled_change["mask"] = (
+                marshal_mask_compressed(node.mask)
+                if node.mask is not None else None
+            )
+        changed_nodes.append(marshalled_change)
+
+    return {
+        "changedNodes": changed_nodes,
+        "addedNodes": marshal_mung_node_batch(diff.added_nodes),
+        "removedNodeIds": diff.removed_node_ids,
+        "addedLinks": [list(link) for link in diff.added_links],
+        "removedLinks": [list(link) for link in diff.removed_links],
+    }
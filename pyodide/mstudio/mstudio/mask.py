@@ -0,0 +1,258 @@
+import numpy as np
+from mung.node import Node
+from mstudio.marshalling import marshal_mask_rgba, unmarshal_mask_rgba, \
+    marshal_mask_alpha, unmarshal_mask_alpha, \
+    marshal_mask_compressed, unmarshal_mask_compressed
+
+
+# Masks used to travel through mstudio as dense RGBA arrays, 0/1 planes,
+# boolean slices and flat buffers, converted back and forth with a fresh
+# allocation at every step. The Mask class is the one in-memory form:
+# a 0/1 uint8 plane (the same as Node.mask) positioned on the page.
+# Conversions to the wire formats happen only at the marshalling boundary
+# and geometric operations return views wherever possible.
+
+class Mask:
+    """Binary mask with the position of its top-left corner on the page"""
+
+    __slots__ = ("left", "top", "plane")
+
+    left: int
+    """Page x coordinate of the first plane column"""
+
+    top: int
+    """Page y coordinate of the first plane row"""
+
+    plane: np.ndarray
+    """HxW uint8 array of zeros and ones"""
+
+    def __init__(self, left: int, top: int, plane: np.ndarray):
+        assert plane.dtype == np.uint8 # bytes
+        assert len(plane.shape) == 2 # HxW
+        self.left = int(left)
+        self.top = int(top)
+        self.plane = plane
+
+    def __repr__(self) -> str:
+        return f"Mask(left={self.left}, top={self.top}, " \
+            f"width={self.width}, height={self.height})"
+
+    @property
+    def width(self) -> int:
+        return self.plane.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.plane.shape[0]
+
+    @property
+    def right(self) -> int:
+        return self.left + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.top + self.height
+
+    ################
+    # Construction #
+    ################
+
+    @staticmethod
+    def empty(left: int, top: int, width: int, height: int) -> "Mask":
+        """Mask with no pixels set"""
+        return Mask(left, top, np.zeros((height, width), dtype=np.uint8))
+
+    @staticmethod
+    def from_bool(left: int, top: int, binary: np.ndarray) -> "Mask":
+        """Wraps a boolean plane, without copying it"""
+        assert binary.dtype == np.bool_
+        return Mask(left, top, binary.view(np.uint8))
+
+    @staticmethod
+    def from_node(node: Node) -> "Mask":
+        """Wraps the mask of a node, a node without a mask is all set"""
+        if node.mask is None:
+            return Mask(
+                node.left, node.top,
+                np.ones((node.height, node.width), dtype=np.uint8)
+            )
+        plane = node.mask
+        if plane.dtype != np.uint8 or plane.max(initial=0) > 1:
+            plane = (plane != 0).view(np.uint8)
+        return Mask(node.left, node.top, plane)
+
+    @staticmethod
+    def from_rgba(left: int, top: int, rgba: np.ndarray) -> "Mask":
+        """Takes the pixels with non-zero alpha of an RGBA mask"""
+        assert len(rgba.shape) == 3 # HxWxC
+        assert rgba.shape[2] == 4 # RGBA
+        return Mask.from_bool(left, top, rgba[:, :, 3] > 0)
+
+    @staticmethod
+    def from_alpha(left: int, top: int, alpha: np.ndarray) -> "Mask":
+        """Takes the non-zero pixels of a 0/255 plane"""
+        return Mask.from_bool(left, top, alpha > 0)
+
+    ###############
+    # Wire format #
+    ###############
+
+    @staticmethod
+    def unmarshal_rgba(
+            left: int,
+            top: int,
+            marshalled_mask: tuple[int, int, memoryview],
+    ) -> "Mask":
+        """Receive an RGBA mask from javascript"""
+        return Mask.from_rgba(left, top, unmarshal_mask_rgba(marshalled_mask))
+
+    @staticmethod
+    def unmarshal_alpha(
+            left: int,
+            top: int,
+            marshalled_mask: tuple[int, int, memoryview],
+    ) -> "Mask":
+        """Receive an alpha-only mask from javascript"""
+        return Mask.from_alpha(
+            left, top, unmarshal_mask_alpha(marshalled_mask)
+        )
+
+    @staticmethod
+    def unmarshal_compressed(
+            left: int,
+            top: int,
+            marshalled_mask: tuple[int, int, str, memoryview],
+    ) -> "Mask":
+        """Receive a compressed mask from javascript"""
+        return Mask(left, top, unmarshal_mask_compressed(marshalled_mask))
+
+    def marshal_rgba(self) -> tuple[int, int, np.ndarray]:
+        """Prepare the mask to be sent as a red RGBA mask"""
+        return marshal_mask_rgba(self.to_rgba())
+
+    def marshal_alpha(self) -> tuple[int, int, np.ndarray]:
+        """Prepare the mask to be sent as an alpha-only mask"""
+        return marshal_mask_alpha(self.to_alpha())
+
+    def marshal_compressed(self) -> tuple[int, int, str, np.ndarray]:
+        """Prepare the mask to be sent in the compressed format"""
+        return marshal_mask_compressed(self.plane)
+
+    ###############
+    # Conversions #
+    ###############
+
+    def to_bool(self) -> np.ndarray:
+        """Boolean view of the plane, not a copy"""
+        return self.plane.view(np.bool_)
+
+    def to_alpha(self) -> np.ndarray:
+        """0/255 plane, as used by the alpha-only wire format"""
+        return self.plane * np.uint8(255)
+
+    def to_rgba(self) -> np.ndarray:
+        """Red RGBA mask, as displayed by MuNG Studio"""
+        rgba = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        alpha = self.to_alpha()
+        rgba[:, :, 0] = alpha # red
+        rgba[:, :, 3] = alpha # alpha
+        return rgba
+
+    def to_node(self, id_: int, class_name: str) -> Node:
+        """Creates a new node with this mask"""
+        return Node(
+            id_=id_,
+            class_name=class_name,
+            top=self.top,
+            left=self.left,
+            width=self.width,
+            height=self.height,
+            mask=self.plane,
+        )
+
+    ############
+    # Geometry #
+    ############
+
+    def crop(self, left: int, top: int, width: int, height: int) -> "Mask":
+        """
+        Returns the part of the mask inside the given page rectangle.
+        It is a view if the rectangle lies inside the mask, otherwise
+        the pixels outside the mask are unset.
+        """
+        x1, y1 = left - self.left, top - self.top
+        if x1 >= 0 and y1 >= 0 \
+                and x1 + width <= self.width \
+                and y1 + height <= self.height:
+            return Mask(left, top, self.plane[y1:y1 + height, x1:x1 + width])
+
+        cropped = Mask.empty(left, top, width, height)
+        cropped._paste(self, np.copyto)
+        return cropped
+
+    def clamp_to_content(self) -> "Mask":
+        """Tight view of the set pixels, an empty mask stays as it is"""
+        rows = np.flatnonzero(self.row_counts())
+        if len(rows) == 0:
+            return self
+        columns = np.flatnonzero(self.column_counts())
+        return Mask(
+            self.left + columns[0],
+            self.top + rows[0],
+            self.plane[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1],
+        )
+
+    def union(self, other: "Mask") -> "Mask":
+        """Pixels set in either mask, over the bbox covering both"""
+        left = min(self.left, other.left)
+        top = min(self.top, other.top)
+        result = Mask.empty(
+            left, top,
+            max(self.right, other.right) - left,
+            max(self.bottom, other.bottom) - top,
+        )
+        result._paste(self, np.copyto)
+        result._paste(other, np.bitwise_or)
+        return result
+
+    def intersect(self, other: "Mask") -> "Mask":
+        """Pixels set in both masks, over the intersection of the bboxes"""
+        left = max(self.left, other.left)
+        top = max(self.top, other.top)
+        width = max(min(self.right, other.right) - left, 0)
+        height = max(min(self.bottom, other.bottom) - top, 0)
+        a = self.crop(left, top, width, height)
+        b = other.crop(left, top, width, height)
+        return Mask(left, top, a.plane & b.plane)
+
+    def row_counts(self) -> np.ndarray:
+        """Number of set pixels in each row"""
+        return np.count_nonzero(self.plane, axis=1)
+
+    def column_counts(self) -> np.ndarray:
+        """Number of set pixels in each column"""
+        return np.count_nonzero(self.plane, axis=0)
+
+    def count(self) -> int:
+        """Number of set pixels"""
+        return int(np.count_nonzero(self.plane))
+
+    def is_empty(self) -> bool:
+        return not self.plane.any()
+
+    def _paste(self, other: "Mask", operation) -> None:
+        # applies the operation to the overlapping part of the planes
+        x1, y1 = max(self.left, other.left), max(self.top, other.top)
+        x2, y2 = min(self.right, other.right), min(self.bottom, other.bottom)
+        if x1 >= x2 or y1 >= y2:
+            return
+        target = self.plane[
+            y1 - self.top:y2 - self.top, x1 - self.left:x2 - self.left
+        ]
+        source = other.plane[
+            y1 - other.top:y2 - other.top, x1 - other.left:x2 - other.left
+        ]
+        if operation is np.copyto:
+            np.copyto(target, source)
+        else:
+            operation(target, source, out=target)
@@ -0,0 +1,66 @@
+import numpy as np
+from dataclasses import dataclass
+
+
+# Staffline masks are processed column by column: each column crosses
+# the stafflines in vertical runs of set pixels. The runs of all the
+# columns are found at once and stored as flat arrays, where the runs
+# of column x are at indices column_offsets[x] to column_offsets[x + 1].
+
+@dataclass
+class ColumnRuns:
+    """Vertical runs of set pixels in all columns of a mask"""
+
+    column_offsets: np.ndarray
+    """Where the runs of each column start in the flat arrays, (W+1,)"""
+
+    starts: np.ndarray
+    """The first row of each run"""
+
+    ends: np.ndarray
+    """The row just after the last row of each run"""
+
+    @property
+    def centers(self) -> np.ndarray:
+        """The middle row of each run, may end with .5"""
+        return (self.starts + self.ends) / 2
+
+    @property
+    def run_counts(self) -> np.ndarray:
+        """Number of runs in each column, (W,)"""
+        return np.diff(self.column_offsets)
+
+    def get_column_centers(self, x: int) -> np.ndarray:
+        """Centers of the runs in one column, from the top down"""
+        a, b = self.column_offsets[x], self.column_offsets[x + 1]
+        return (self.starts[a:b] + self.ends[a:b]) / 2
+
+
+def compute_column_runs(mask: np.ndarray) -> ColumnRuns:
+    """Finds vertical runs of non-zero pixels in each column of a HxW mask"""
+    assert len(mask.shape) == 2 # HxW
+    height, width = mask.shape
+
+    # columns as rows, padded with unset pixels on both ends,
+    # so that every run has a rising and a falling edge
+    padded = np.zeros(shape=(width, height + 2), dtype=np.int8)
+    padded[:, 1:-1] = (mask != 0).T
+    edges = np.diff(padded, axis=1)
+
+    # the flat indices go column by column from the top down
+    # and the edges of each run alternate: rising, falling
+    edge_indices = np.flatnonzero(edges)
+    start_columns, starts = np.divmod(edge_indices[0::2], height + 1)
+    ends = edge_indices[1::2] - start_columns * (height + 1)
+
+    column_offsets = np.zeros(width + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(start_columns, minlength=width),
+        out=column_offsets[1:]
+    )
+
+    return ColumnRuns(
+        column_offsets=column_offsets,
+        starts=starts,
+        ends=ends,
+    )
@@ -1,81 +1,85 @@
 import numpy as np
-from collections import Counter
+from mstudio.mask import Mask
+from .column_runs import compute_column_runs
 
 
-def compute_cut_lines(mask: np.ndarray) -> list[list[tuple[int, int]]]:
-    """Computes cut lines for slicing stafflines into separate objects"""
-    assert len(mask.shape) == 3 # WxHxC
-    assert mask.shape[2] == 4 # RGBA
+# columns are sampled every this many pixels by default
+DEFAULT_STRIDE = 10
 
-    STRIDE = 10
-    cut_size_counter: Counter[int] = Counter()
 
-    # get cuts every N pixels
-    column_cuts: list[tuple[int, list[float]]] = []
-    for i in range(0, mask.shape[1], STRIDE):
-        cuts = get_column_cuts(mask[:, i, 3] > 0)
-        if len(cuts) > 0:
-            column_cuts.append((i, cuts))
-            cut_size_counter.update({
-                len(cuts): 1
-            })
-    
-    target_cut_count = cut_size_counter.most_common(1)[0][0]
-    column_cuts = [c for c in column_cuts if len(c[1]) == target_cut_count]
+def compute_cut_lines(
+        mask: Mask,
+        stride: int = DEFAULT_STRIDE,
+        adaptive: bool = False,
+        subpixel: bool = False,
+) -> list[list[tuple[int, float]]]:
+    """
+    Computes cut lines for slicing stafflines into separate objects
 
-    if len(column_cuts) == 0:
-        return []
+    :param mask: The mask of the stafflines, cut lines are relative
+        to its top-left corner.
+    :param stride: Cuts are computed every N columns. Use 1 for full
+        resolution.
+    :param adaptive: Cuts are computed for every column, but a column is
+        emitted only when some cut moves to another pixel row, so that
+        straight parts of the lines produce few points and curved parts
+        produce many. The stride is ignored.
+    :param subpixel: Cut positions are not truncated to whole pixels.
+    """
+    assert stride > 0
 
-    # add leading cut
-    if column_cuts[0][0] != 0:
-        column_cuts.insert(
-            0,
-            (0, column_cuts[0][1])
-        )
-    
-    # add trailing cut
-    if column_cuts[-1][0] != mask.shape[1] - 1:
-        column_cuts.append(
-            (mask.shape[1] - 1, column_cuts[-1][1])
-        )
-    
-    # column cuts to cut lines
-    cut_lines: list[list[tuple[int, int]]] = [
-        [] for i in range(target_cut_count)
-    ]
-    for cut in column_cuts:
-        for i in range(target_cut_count):
-            cut_lines[i].append(
-                (cut[0], int(cut[1][i]))
-            )
+    if adaptive:
+        stride = 1
+
+    # get cuts every N pixels, cuts lie halfway between neighbouring runs
+    columns = np.arange(0, mask.width, stride)
+    runs = compute_column_runs(mask.plane[:, ::stride])
+    cut_counts = np.maximum(runs.run_counts - 1, 0)
 
-    return cut_lines
+    if not np.any(cut_counts > 0):
+        return []
+
+    # the most common number of cuts, ties go to the one seen first
+    frequencies = np.bincount(cut_counts)
+    frequencies[0] = 0 # columns without cuts do not count
+    is_most_common = frequencies[cut_counts] == frequencies.max()
+    target_cut_count = int(cut_counts[np.argmax(is_most_common)])
 
+    # cuts of the columns with the most common number of cuts,
+    # as a matrix of shape (columns, cuts)
+    selected = np.flatnonzero(cut_counts == target_cut_count)
+    first_runs = runs.column_offsets[selected][:, np.newaxis] \
+        + np.arange(target_cut_count)[np.newaxis, :]
+    centers = runs.centers
+    cuts = (centers[first_runs] + centers[first_runs + 1]) / 2
+    cut_columns = columns[selected]
 
-def get_column_cuts(column: np.ndarray) -> list[float]:
-    pegs = get_column_pegs(column)
-    cuts = [(a + b) / 2 for a, b in zip(pegs, pegs[1:])]
-    return cuts
+    if adaptive:
+        # keep the first column and those where any cut changes its row
+        rows = np.floor(cuts)
+        keep = np.concatenate([
+            [True], np.any(rows[1:] != rows[:-1], axis=1)
+        ])
+        keep[-1] = True
+        cuts = cuts[keep]
+        cut_columns = cut_columns[keep]
 
+    if not subpixel:
+        cuts = np.floor(cuts).astype(int)
 
-def get_column_pegs(column: np.ndarray) -> list[float]:
-    ups = []
-    downs = []
-    is_down = True
+    # add leading cut
+    if cut_columns[0] != 0:
+        cut_columns = np.concatenate([[0], cut_columns])
+        cuts = np.concatenate([cuts[:1], cuts])
 
-    for i, pixel in enumerate(column):
-        if pixel and is_down:
-            ups.append(i)
-            is_down = False
-        elif not pixel and not is_down:
-            downs.append(i)
-            is_down = True
-    
-    if not is_down:
-        downs.append(len(column))
-    
-    assert len(ups) == len(downs)
+    # add trailing cut
+    if cut_columns[-1] != mask.width - 1:
+        cut_columns = np.concatenate([cut_columns, [mask.width - 1]])
+        cuts = np.concatenate([cuts, cuts[-1:]])
 
-    pegs = [(u + d) / 2 for u, d in zip(ups, downs)]
-    
-    return pegs
+    # column cuts to cut lines
+    xs = cut_columns.tolist()
+    return [
+        list(zip(xs, cuts[:, i].tolist()))
+        for i in range(target_cut_count)
+    ]
@@ -1,71 +1,112 @@
 from mung.node import Node
 import numpy as np
-import cv2
+from mstudio.mask import Mask
+from .staff_geometry import get_line_centers
+from .rasterize_polygons import rasterize_polygon
+
+
+# number of stafflines that make up one staff
+LINES_PER_STAFF = 5
+
+# stafflines further apart than this many median gaps are in different
+# clusters (staves or groups of tightly packed staves)
+CLUSTER_GAP_FACTOR = 1.5
 
 
 def generate_staff_from_stafflines(stafflines: list[Node]) -> Node:
-    assert len(stafflines) == 5
+    assert len(stafflines) == LINES_PER_STAFF
     
     stafflines.sort(key=lambda line: line.top)
     top_line = stafflines[0]
     bottom_line = stafflines[-1]
-    
-    top_points = get_scene_points_for_line(top_line)
-    bottom_points = get_scene_points_for_line(bottom_line)
-    all_points = top_points + list(reversed(bottom_points))
-
-    top = min(y for x, y in all_points)
-    bottom = max(y for x, y in all_points)
-    left = min(x for x, y in all_points)
-    right = max(x for x, y in all_points)
-    width = right - left
-    height = bottom - top
-    assert width > 0
-    assert height > 0
-
-    mask = np.zeros(shape=(height, width), dtype=np.uint8)
-    all_local_points = [(x - left, y - top) for x, y in all_points]
-    cv2.fillPoly(mask, [np.array(all_local_points, dtype=np.int32)], 1)
-
-    return Node(
+
+    mask = build_staff_mask(
+        Mask.from_node(top_line),
+        Mask.from_node(bottom_line)
+    )
+
+    return mask.to_node(
         id_=0, # not used anyways
         class_name="staff",
-        top=top,
-        left=left,
-        width=width,
-        height=height,
-        mask=mask,
     )
 
 
-def get_scene_points_for_line(line: Node) -> list[tuple[int, int]]:
-    points: list[tuple[int, int]] = []
-    for i in range(0, line.mask.shape[1]):
-        pegs = get_column_pegs(line.mask[:, i] > 0)
-        if len(pegs) == 1:
-            points.append((int(line.left + i), int(line.top + pegs[0])))
-    return points
+def generate_staves_from_stafflines(
+        stafflines: list[Node],
+        first_id: int = 0,
+) -> list[tuple[Node, list[Node]]]:
+    """
+    Groups all the stafflines of a page into staves and builds the staff
+    for each group. Returns the staves (with IDs counting from first_id)
+    together with their stafflines, from the top of the page down.
+    """
+    staves: list[tuple[Node, list[Node]]] = []
+    for i, group in enumerate(group_stafflines_into_staves(stafflines)):
+        mask = build_staff_mask(
+            Mask.from_node(group[0]),
+            Mask.from_node(group[-1])
+        )
+        staff = mask.to_node(id_=first_id + i, class_name="staff")
+        staves.append((staff, group))
+    return staves
 
 
-def get_column_pegs(column: np.ndarray) -> list[float]:
-    ups = []
-    downs = []
-    is_down = True
+def group_stafflines_into_staves(
+        stafflines: list[Node],
+        lines_per_staff: int = LINES_PER_STAFF,
+) -> list[list[Node]]:
+    """
+    Clusters stafflines by the vertical gaps between their centers.
+    Gaps much larger than the typical (median) gap separate staves.
+    A cluster with more lines holds staves packed so tightly that the gap
+    between them is not distinguishable, it is split from the top down.
+    """
+    if len(stafflines) % lines_per_staff != 0:
+        raise ValueError(
+            f"The number of stafflines ({len(stafflines)}) is not "
+            f"a multiple of {lines_per_staff}."
+        )
+    if len(stafflines) == 0:
+        return []
 
-    for i, pixel in enumerate(column):
-        if pixel and is_down:
-            ups.append(i)
-            is_down = False
-        elif not pixel and not is_down:
-            downs.append(i)
-            is_down = True
-    
-    if not is_down:
-        downs.append(len(column))
-    
-    assert len(ups) == len(downs)
+    centers = np.array([line.top + line.height / 2 for line in stafflines])
+    order = np.argsort(centers, kind="stable")
+    gaps = np.diff(centers[order])
+
+    # split wherever the gap is much larger than the median gap
+    typical_gap = np.median(gaps) if len(gaps) > 0 else 0
+    splits = np.flatnonzero(gaps > typical_gap * CLUSTER_GAP_FACTOR) + 1
+
+    staves: list[list[Node]] = []
+    for cluster in np.split(order, splits):
+        if len(cluster) % lines_per_staff != 0:
+            top = stafflines[cluster[0]].top
+            raise ValueError(
+                f"The stafflines around y={top} form a group of "
+                f"{len(cluster)} lines, which cannot be split into staves."
+            )
+        for i in range(0, len(cluster), lines_per_staff):
+            staves.append([
+                stafflines[j] for j in cluster[i:i + lines_per_staff]
+            ])
+    return staves
+
+
+def build_staff_mask(top_line: Mask, bottom_line: Mask) -> Mask:
+    """Fills the area between the top and the bottom staffline"""
+    top_xs, top_ys = get_line_centers(top_line)
+    bottom_xs, bottom_ys = get_line_centers(bottom_line)
+
+    # along the top line and back along the bottom line
+    points = np.concatenate([
+        np.stack([top_xs, top_ys], axis=1),
+        np.stack([bottom_xs, bottom_ys], axis=1)[::-1],
+    ])
+
+    return rasterize_polygon([points.tolist()], shift=0)
 
-    pegs = [(u + d) / 2 for u, d in zip(ups, downs)]
-    
-    return pegs
 
+def get_scene_points_for_line(line: Mask) -> list[tuple[int, int]]:
+    """Center of the line in each column the line crosses exactly once"""
+    xs, ys = get_line_centers(line)
+    return list(zip(xs.tolist(), ys.tolist()))
@@ -2,11 +2,109 @@ from mung2musicxml.preprocessing.staffspace_generator.generator \
     import StaffspaceGenerator
 from mung.graph import NotationGraph
 from mung.node import Node
+from mstudio.graph_diff import GraphDiff, snapshot_nodes, compute_graph_diff
+from .staff_geometry import StaffLookup, get_staff_geometry
 
 
-def generate_staffspaces(nodes: list[Node]) -> list[Node]:
+def generate_staffspaces(nodes: list[Node]) -> GraphDiff:
+    """Generates staffspaces and returns only the changes it made"""
+    before = snapshot_nodes(nodes)
+
     graph = NotationGraph(nodes)
 
     new_graph = StaffspaceGenerator.run(graph)
 
-    return new_graph.filter_vertices("staffSpace")
+    return compute_graph_diff(before, new_graph.vertices)
+
+
+def regenerate_staffspaces(
+        nodes: list[Node],
+        staff_ids: list[int],
+) -> GraphDiff:
+    """
+    Generates staffspaces only for the staves with the given IDs. The nodes
+    must contain these staves with their stafflines and staffspaces.
+    The existing staffspaces of the staves are reported as removed,
+    the new ones as added (with IDs after the largest given ID)
+    together with the links from their staves.
+    Raises ValueError when a staff ID is not among the given staves.
+    """
+    nodes_by_id = {node.id: node for node in nodes}
+    for i in staff_ids:
+        if i not in nodes_by_id or nodes_by_id[i].class_name != "staff":
+            raise ValueError(f"unknown staff id {i}")
+    staves = [nodes_by_id[i] for i in staff_ids]
+    if len(staves) == 0:
+        return GraphDiff([], [], [], [], [])
+
+    # only the staves and their stafflines are given to the generator,
+    # as copies linked just among themselves
+    stafflines = {
+        i: nodes_by_id[i] for staff in staves for i in staff.outlinks
+        if i in nodes_by_id and nodes_by_id[i].class_name == "staffLine"
+    }
+    scope = {staff.id: staff for staff in staves} | stafflines
+    graph = NotationGraph([
+        Node(
+            id_=node.id,
+            class_name=node.class_name,
+            top=node.top,
+            left=node.left,
+            width=node.width,
+            height=node.height,
+            outlinks=[i for i in node.outlinks if i in scope],
+            inlinks=[i for i in node.inlinks if i in scope],
+            mask=node.mask,
+        )
+        for node in scope.values()
+    ])
+    new_graph = StaffspaceGenerator.run(graph)
+    staffspaces = [
+        v for v in new_graph.vertices
+        if v.class_name == "staffSpace" and v.id not in scope
+    ]
+
+    # each new staffspace belongs to the staff it lies on
+    lookup = StaffLookup([
+        get_staff_geometry([
+            stafflines[i] for i in staff.outlinks if i in stafflines
+        ])
+        for staff in staves
+    ])
+    next_id = max(nodes_by_id.keys()) + 1
+    added_nodes: list[Node] = []
+    added_links: list[tuple[int, int]] = []
+    for staffspace in staffspaces:
+        staff = staves[lookup.get_staff_index(
+            staffspace.top + staffspace.height / 2
+        )]
+        added_nodes.append(Node(
+            id_=next_id,
+            class_name="staffSpace",
+            top=staffspace.top,
+            left=staffspace.left,
+            width=staffspace.width,
+            height=staffspace.height,
+            inlinks=[staff.id],
+            mask=staffspace.mask,
+        ))
+        added_links.append((staff.id, next_id))
+        next_id += 1
+
+    # the staffspaces being replaced
+    removed_node_ids: list[int] = []
+    removed_links: list[tuple[int, int]] = []
+    for staff in staves:
+        for i in staff.outlinks:
+            if i in nodes_by_id \
+                    and nodes_by_id[i].class_name == "staffSpace":
+                removed_node_ids.append(i)
+                removed_links.append((staff.id, i))
+
+    return GraphDiff(
+        changed_nodes=[],
+        added_nodes=added_nodes,
+        removed_node_ids=removed_node_ids,
+        added_links=added_links,
+        removed_links=removed_links,
+    )
@@ -0,0 +1,108 @@
+import numpy as np
+import cv2
+from typing import Callable
+from mung.node import Node
+from mstudio.mask import Mask
+from mstudio.graph_diff import GraphDiff, snapshot_nodes, compute_graph_diff
+
+
+# Cleaning up node masks (filling holes, growing them a little, removing
+# specks) is applied to many nodes at once. Each mask is processed only
+# within its own bbox, padded by as much as the operations may grow it,
+# and cropped back to its content afterwards. Only nodes whose mask
+# actually changed are sent back.
+
+MorphologyOperation = tuple[str, int]
+"""Name of the operation and its size parameter"""
+
+
+def fill_holes(mask: Mask, size: int) -> Mask:
+    """Sets all unset pixels not connected to the border, size is unused"""
+    # the padding connects the whole border into one background region
+    padded = np.pad(mask.plane, 1)
+    background = padded.copy()
+    cv2.floodFill(background, None, (0, 0), 1)
+    padded |= 1 - background
+    return Mask(mask.left, mask.top, padded[1:-1, 1:-1])
+
+
+def dilate(mask: Mask, size: int) -> Mask:
+    """Grows the mask by size pixels in all directions"""
+    padded = Mask(
+        mask.left - size, mask.top - size, np.pad(mask.plane, size)
+    )
+    kernel = np.ones((2 * size + 1, 2 * size + 1), dtype=np.uint8)
+    return Mask(padded.left, padded.top, cv2.dilate(padded.plane, kernel))
+
+
+def erode(mask: Mask, size: int) -> Mask:
+    """Shrinks the mask by size pixels from all directions"""
+    kernel = np.ones((2 * size + 1, 2 * size + 1), dtype=np.uint8)
+    return Mask(
+        mask.left, mask.top,
+        cv2.erode(mask.plane, kernel, borderValue=0)
+    )
+
+
+def remove_specks(mask: Mask, size: int) -> Mask:
+    """Unsets connected components with fewer than size pixels"""
+    label_count, labels, stats, _ = cv2.connectedComponentsWithStats(
+        mask.plane, connectivity=8, ltype=cv2.CV_32S
+    )
+    keep = stats[:, cv2.CC_STAT_AREA] >= size
+    keep[0] = False # background
+    return Mask(mask.left, mask.top, keep[labels].view(np.uint8))
+
+
+MORPHOLOGY_OPERATIONS: dict[str, Callable[[Mask, int], Mask]] = {
+    "fillHoles": fill_holes,
+    "dilate": dilate,
+    "erode": erode,
+    "removeSpecks": remove_specks,
+}
+
+
+def apply_morphology(
+        nodes: list[Node],
+        operations: list[MorphologyOperation],
+) -> GraphDiff:
+    """
+    Runs the pipeline of operations on the mask of each node and returns
+    only the changes. Masks that would become empty are left as they are,
+    so are masks with the same pixels (even if their bbox could shrink).
+    """
+    for name, _ in operations:
+        if name not in MORPHOLOGY_OPERATIONS:
+            raise ValueError(f"Unknown morphology operation: {name}")
+
+    before = snapshot_nodes(nodes)
+
+    after: list[Node] = []
+    for node in nodes:
+        original = Mask.from_node(node)
+        mask = original
+        for name, size in operations:
+            mask = MORPHOLOGY_OPERATIONS[name](mask, int(size))
+        mask = mask.clamp_to_content()
+        if mask.is_empty() or _has_same_pixels(mask, original):
+            after.append(node)
+            continue
+        after.append(Node(
+            id_=node.id,
+            class_name=node.class_name,
+            top=mask.top,
+            left=mask.left,
+            width=mask.width,
+            height=mask.height,
+            outlinks=node.outlinks,
+            inlinks=node.inlinks,
+            mask=mask.plane,
+            data=node.data,
+        ))
+
+    return compute_graph_diff(before, after)
+
+
+def _has_same_pixels(a: Mask, b: Mask) -> bool:
+    count = a.count()
+    return count == b.count() and a.intersect(b).count() == count
@@ -0,0 +1,83 @@
+import numpy as np
+import cv2
+from mstudio.mask import Mask
+
+
+# Polygons used to be rasterized into canvases of the size of the whole
+# processed region, even when they covered only a small part of it.
+# Here each polygon is rasterized into its own canvas, just large enough
+# to hold it, so that the result is a compact mask ready to become a node.
+# Polygons that tile a region (such as the bands between cut lines) are
+# instead rasterized together into one label map, which is then sliced
+# by label, so that each pixel of the region is visited only once.
+
+# polygons may have subpixel coordinates, they are rasterized
+# with this many fractional bits
+SUBPIXEL_SHIFT = 2
+
+Polygon = list[list[tuple[float, float]]]
+"""The outer ring of a polygon followed by the rings of its holes"""
+
+
+def rasterize_polygon(
+        polygon: Polygon,
+        shift: int = SUBPIXEL_SHIFT,
+) -> Mask:
+    """
+    Rasterizes a polygon (with holes) into a mask over its tight bbox,
+    in page coordinates. Pixels on the rings are set, except for those
+    on the rings of holes, which stay unset only inside of the holes.
+    Raises ValueError for a polygon without any vertices.
+    """
+    scale = 1 << shift
+    rings = _to_fixed_point(polygon, shift)
+    if len(rings) == 0:
+        raise ValueError("A polygon needs at least one vertex")
+
+    # vertices are rounded to whole pixels when filling,
+    # so the canvas reaches one pixel further and is clamped afterwards
+    points = np.concatenate(rings)
+    left, top = (points.min(axis=0) >> shift).tolist()
+    right, bottom = ((points.max(axis=0) >> shift) + 2).tolist()
+
+    mask = Mask.empty(left, top, right - left, bottom - top)
+    offset = np.array([left, top], dtype=np.int32) * scale
+    cv2.fillPoly(mask.plane, [r - offset for r in rings], 1, shift=shift)
+    return mask.clamp_to_content()
+
+
+def rasterize_polygons(
+        polygons: list[Polygon],
+        shift: int = SUBPIXEL_SHIFT,
+) -> list[Mask]:
+    """Rasterizes each polygon into its own tight mask, in the same order"""
+    return [rasterize_polygon(polygon, shift) for polygon in polygons]
+
+
+def rasterize_label_map(
+        width: int,
+        height: int,
+        polygons: list[Polygon],
+        shift: int = SUBPIXEL_SHIFT,
+) -> np.ndarray:
+    """
+    Rasterizes polygons into an HxW int32 label map, where pixels of
+    the i-th polygon have the label i + 1 and pixels outside of all
+    polygons have the label 0. Where polygons overlap (such as on their
+    shared boundary), the later polygon wins.
+    """
+    labels = np.zeros((height, width), dtype=np.int32)
+    for i, polygon in enumerate(polygons):
+        cv2.fillPoly(
+            labels, _to_fixed_point(polygon, shift), i + 1, shift=shift
+        )
+    return labels
+
+
+def _to_fixed_point(polygon: Polygon, shift: int) -> list[np.ndarray]:
+    scale = 1 << shift
+    return [
+        np.round(np.asarray(ring, dtype=np.float64) * scale).astype(np.int32)
+        for ring in polygon
+        if len(ring) > 0
+    ]
@@ -1,86 +1,78 @@
 import numpy as np
-import cv2
+from mstudio.mask import Mask
+from .rasterize_polygons import rasterize_label_map
 
 
 def separate_lines(
-        left: int,
-        top: int,
-        width: int,
-        height: int,
-        mask: np.ndarray,
-        cut_lines: list[list[tuple[int, int]]]
-) -> list[tuple[int, int, int, int, np.ndarray]]:
-    """Slices a mask into sub-masks for individual stafflines using given cuts"""
-    assert len(mask.shape) == 3 # WxHxC
-    assert mask.shape[2] == 4 # RGBA
+        mask: Mask,
+        cut_lines: list[list[tuple[float, float]]]
+) -> list[Mask]:
+    """
+    Slices a mask into sub-masks for individual stafflines using given cuts.
+    Cut lines are relative to the top-left corner of the mask.
+    Bands between the cuts without any pixels of the mask are left out.
+    """
+    width, height = mask.width, mask.height
 
     # add the leading and trailing cut lines
     cut_lines.insert(0, [(0, 0), (width, 0)])
     cut_lines.append([(0, height), (width, height)])
 
-    # go in pairs of cut lines and slice out the mask
-    return [
-        slice_out_a_mask(
-            left=left,
-            top=top,
-            width=width,
-            height=height,
-            original_mask=mask,
-            cut_polygon=a + list(reversed(b))
-        )
+    # go in pairs of cut lines and rasterize the bands between them
+    # into one label map, label 0 is outside of all the bands,
+    # pixels on the cut between two bands belong to the lower band
+    cut_polygons = [
+        [a + list(reversed(b))]
         for a, b in zip(cut_lines, cut_lines[1:])
     ]
+    labels = rasterize_label_map(width, height, cut_polygons)
 
+    # slice out the masks by their tight bounding boxes
+    bboxes = get_label_bboxes(labels, mask, label_count=len(cut_polygons))
+    sub_masks: list[Mask] = []
+    for label, bbox in enumerate(bboxes, start=1):
+        if bbox is None:
+            continue
+        x1, y1, x2, y2 = bbox
+        stencil = labels[y1:y2, x1:x2] == label
+        sub_masks.append(Mask(
+            mask.left + x1,
+            mask.top + y1,
+            mask.plane[y1:y2, x1:x2] & stencil.view(np.uint8),
+        ))
 
-def slice_out_a_mask(
-        left: int,
-        top: int,
-        width: int,
-        height: int,
-        original_mask: np.ndarray,
-        cut_polygon: list[tuple[int, int]],
-) -> tuple[int, int, int, int, np.ndarray]:
-    cut_stencil = np.zeros(shape=(height, width), dtype=np.uint8)
-    cv2.fillPoly(cut_stencil, [np.array(cut_polygon, dtype=np.int32)], 1)
+    return sub_masks
 
-    cut_mask = original_mask * cut_stencil[:, :, np.newaxis]
-    
-    return clamp_mask_to_content(left, top, cut_mask)
 
+def get_label_bboxes(
+        labels: np.ndarray,
+        content: Mask,
+        label_count: int,
+) -> list[tuple[int, int, int, int] | None]:
+    """
+    Finds bounding boxes (x1, y1, x2, y2) of the content pixels under each
+    label from 1 to label_count, in one pass over the content.
+    None is returned for labels without any content.
+    """
+    ys, xs = np.nonzero(content.plane)
+    pixel_labels = labels[ys, xs]
 
-def clamp_mask_to_content(
-        left: int,
-        top: int,
-        mask: np.ndarray,
-) -> tuple[int, int, int, int, np.ndarray]:
-    def get_bounds(counts: np.ndarray) -> tuple[int, int]:
-        lower = 0
-        for i in range(0, len(counts)):
-            if counts[i] > 0:
-                lower = i
-                break
-        upper = len(counts)
-        for i in range(len(counts), 0, -1):
-            if counts[i - 1] > 0:
-                upper = i
-                break
-        
-        if lower >= upper:
-            print("WARNING: Clamping mask to content failed")
-            return 0, len(counts)
-        
-        return lower, upper
+    # which rows and columns each label occupies
+    height, width = labels.shape
+    has_row = np.zeros(shape=(label_count + 1, height), dtype=bool)
+    has_column = np.zeros(shape=(label_count + 1, width), dtype=bool)
+    has_row[pixel_labels, ys] = True
+    has_column[pixel_labels, xs] = True
 
-    binary_alpha = mask[:, :, 3] > 0
-    y1, y2 = get_bounds(binary_alpha.sum(axis=1))
-    x1, x2 = get_bounds(binary_alpha.sum(axis=0))
-    
-    m = mask[y1:y2, x1:x2, :]
-
-    return (
-        left + x1,
-        top + y1,
-        m.shape[1],
-        m.shape[0],
-        m,
-    )
+    bboxes: list[tuple[int, int, int, int] | None] = []
+    for label in range(1, label_count + 1):
+        rows = np.flatnonzero(has_row[label])
+        columns = np.flatnonzero(has_column[label])
+        if len(rows) == 0:
+            bboxes.append(None)
+            continue
+        bboxes.append((
+            int(columns[0]), int(rows[0]),
+            int(columns[-1]) + 1, int(rows[-1]) + 1,
+        ))
+    return bboxes
@@ -1,17 +1,183 @@
 from mung2musicxml.preprocessing.snap_engines import SnapEnginesWrapper
 from mung.graph import NotationGraph
 from mung.node import Node
+from mstudio.graph_diff import GraphDiff, snapshot_nodes, compute_graph_diff
+from .staff_index import StaffIndex, staff_index, STAFF_CLASS_NAMES
 
 
-def snap_nodes_to_staves(nodes: list[Node]) -> list[Node]:
+# How many pixels around a snapped node are searched for other nodes
+# that the snap engines may need to see (e.g. ledger lines, stems)
+SNAP_NEIGHBOURHOOD = 32
+
+
+def snap_nodes_to_staves(nodes: list[Node]) -> GraphDiff:
+    """Snaps nodes to staves and returns only the changes it made"""
+    before = snapshot_nodes(nodes)
+    run_snap_engines(nodes)
+    return compute_graph_diff(before, nodes)
+
+
+def snap_all_nodes_to_staves(
+        nodes: list[Node],
+        index: StaffIndex = staff_index,
+) -> GraphDiff:
+    """
+    Fills the staff index with the nodes and snaps all of them,
+    with the changes restricted as in snap_changed_nodes_to_staves
+    """
+    index.reset(nodes)
+    return _snap_within_index(index, index.nodes)
+
+
+def snap_changed_nodes_to_staves(
+        node_ids: list[int],
+        index: StaffIndex = staff_index,
+) -> GraphDiff:
+    """
+    Snaps only the given nodes of the staff index, looking just at their
+    surroundings. When a staff object is among them, all nodes in the
+    band of its staff are snapped again.
+
+    Only the links towards staff objects are kept from the changes,
+    because only those are applied by the editor. They are applied
+    to the index and returned, so that the two stay the same.
+    """
+    targets: dict[int, Node] = {
+        i: index.get_node(i) for i in node_ids if index.has_node(i)
+    }
+
+    # a moved staff object affects everything on its staff
+    for node in list(targets.values()):
+        for staff in _get_staves_of(index, node):
+            targets.update((n.id, n) for n in index.get_band_nodes(staff))
+
+    # the staves around the targets, the nodes right next to them
+    # and the nodes they are linked to (links may be removed)
+    context: dict[int, Node] = dict(targets)
+    for node in targets.values():
+        context.update(
+            (i, index.get_node(i)) for i in node.outlinks + node.inlinks
+            if index.has_node(i)
+        )
+        for staff in index.get_staves_in_rows(
+            node.top, node.top + node.height
+        ):
+            context.update(
+                (n.id, n) for n in index.get_staff_objects(staff)
+            )
+        context.update((n.id, n) for n in index.query_rect(
+            node.left - SNAP_NEIGHBOURHOOD,
+            node.top - SNAP_NEIGHBOURHOOD,
+            node.width + 2 * SNAP_NEIGHBOURHOOD,
+            node.height + 2 * SNAP_NEIGHBOURHOOD,
+        ))
+
+    return _snap_within_index(index, list(context.values()))
+
+
+def run_snap_engines(nodes: list[Node]) -> None:
+    """Runs the mung2musicxml snap engines over the nodes, in place"""
     graph = NotationGraph(nodes)
 
     # HACK: rename all noteheadBlack to noteheadFull
+    renamed_nodes: list[Node] = []
     for v in graph.vertices:
         if v.class_name == "noteheadBlack":
             v.set_class_name("noteheadFull")
+            renamed_nodes.append(v)
 
     snap_engine = SnapEnginesWrapper()
     snap_engine.run(graph)
 
-    return graph.vertices
+    # undo the HACK, so that it does not show up in the diff
+    for v in renamed_nodes:
+        if v.class_name == "noteheadFull":
+            v.set_class_name("noteheadBlack")
+
+
+def _get_staves_of(index: StaffIndex, node: Node) -> list[Node]:
+    if node.class_name == "staff":
+        return [node]
+    if node.class_name not in STAFF_CLASS_NAMES:
+        return []
+    return [
+        index.get_node(i) for i in node.inlinks
+        if index.has_node(i) and index.get_node(i).class_name == "staff"
+    ]
+
+
+def _add_linked_staves(index: StaffIndex, context: list[Node]) -> list[Node]:
+    # a staff link leading out of the context would be dropped from
+    # the copies, the engines would then see the node as unattached
+    # and could link it to a second staff, so the whole linked staves
+    # (with their stafflines and staffspaces) are added to the context
+    extended: dict[int, Node] = {node.id: node for node in context}
+    for node in context:
+        linked = [node] + [
+            index.get_node(i) for i in node.outlinks if index.has_node(i)
+        ]
+        for staff_object in linked:
+            for staff in _get_staves_of(index, staff_object):
+                extended.update(
+                    (n.id, n) for n in index.get_staff_objects(staff)
+                )
+    return list(extended.values())
+
+
+def _copy_node(node: Node, outlinks: list[int], inlinks: list[int]) -> Node:
+    return Node(
+        id_=node.id,
+        class_name=node.class_name,
+        top=node.top,
+        left=node.left,
+        width=node.width,
+        height=node.height,
+        outlinks=outlinks,
+        inlinks=inlinks,
+        mask=node.mask,
+        data=node.data,
+    )
+
+
+def _snap_within_index(
+        index: StaffIndex,
+        context: list[Node],
+) -> GraphDiff:
+    # the engines run on copies with links kept inside of the context,
+    # so that the graph is self-contained and the index stays untouched
+    context = _add_linked_staves(index, context)
+    context_ids = {node.id for node in context}
+    copies = [
+        _copy_node(
+            node,
+            outlinks=[i for i in node.outlinks if i in context_ids],
+            inlinks=[i for i in node.inlinks if i in context_ids],
+        )
+        for node in context
+    ]
+    before = snapshot_nodes(copies)
+    run_snap_engines(copies)
+    diff = compute_graph_diff(before, copies)
+
+    # keep just the links the editor applies
+    def is_staff_link(link: tuple[int, int]) -> bool:
+        from_id, to_id = link
+        return index.has_node(from_id) and index.has_node(to_id) \
+            and index.get_node(to_id).class_name in STAFF_CLASS_NAMES
+
+    staff_diff = GraphDiff(
+        changed_nodes=[],
+        added_nodes=[],
+        removed_node_ids=[],
+        added_links=list(filter(is_staff_link, diff.added_links)),
+        removed_links=list(filter(is_staff_link, diff.removed_links)),
+    )
+
+    for from_id, to_id in staff_diff.added_links:
+        index.get_node(from_id).outlinks.append(to_id)
+        index.get_node(to_id).inlinks.append(from_id)
+    for from_id, to_id in staff_diff.removed_links:
+        index.get_node(from_id).outlinks.remove(to_id)
+        index.get_node(to_id).inlinks.remove(from_id)
+
+    return staff_diff
@@ -0,0 +1,125 @@
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+from mung.node import Node
+from mstudio.mask import Mask
+from .column_runs import compute_column_runs
+
+
+# The vertical positions of stafflines used to be re-derived from their
+# masks by each operation that needed them. The staff geometry holds them
+# as per-column arrays over the whole width of a staff, which is what
+# the staff lookup needs to assign nodes to staves. It is cached by the
+# IDs and bboxes of the stafflines, so a cache hit does not read any mask
+# pixels. A mask edited within the same bbox keeps its cached geometry,
+# the lookup only cares for where the staff lies, not for its pixels.
+
+MAX_CACHED_STAVES = 256
+
+
+@dataclass
+class StaffGeometry:
+    """Per-column vertical positions of the stafflines of one staff"""
+
+    left: int
+    """Page x coordinate of the first column"""
+
+    line_ys: np.ndarray
+    """LxW page y coordinates of the line centers, from the top line down"""
+
+    @property
+    def tops(self) -> np.ndarray:
+        """The center of the top line in each column, (W,)"""
+        return self.line_ys[0]
+
+    @property
+    def bottoms(self) -> np.ndarray:
+        """The center of the bottom line in each column, (W,)"""
+        return self.line_ys[-1]
+
+
+class StaffLookup:
+    """Finds the staff for any row of a page, by a table of rows"""
+
+    def __init__(self, geometries: list[StaffGeometry]):
+        assert len(geometries) > 0
+        centers = [
+            (g.tops.mean() + g.bottoms.mean()) / 2 for g in geometries
+        ]
+        self._order = np.argsort(centers, kind="stable")
+        ordered = [geometries[i] for i in self._order]
+
+        # the row boundaries lie halfway between neighbouring staves
+        self.top = int(min(g.tops.min() for g in geometries))
+        boundaries = np.array([
+            (upper.bottoms.mean() + lower.tops.mean()) / 2
+            for upper, lower in zip(ordered, ordered[1:])
+        ])
+        bottom = int(max(g.bottoms.max() for g in geometries))
+        rows = np.arange(self.top, bottom + 1)
+        self._rows = np.searchsorted(boundaries, rows, side="right")
+
+    def get_staff_index(self, y: float) -> int:
+        """Index (into the given geometries) of the staff for a page row"""
+        row = min(max(int(y) - self.top, 0), len(self._rows) - 1)
+        return int(self._order[self._rows[row]])
+
+
+_staff_cache: OrderedDict[Hashable, StaffGeometry] = OrderedDict()
+
+
+def get_line_centers(line: Mask) -> tuple[np.ndarray, np.ndarray]:
+    """Page coordinates of the line center in the columns crossed once"""
+    runs = compute_column_runs(line.plane)
+    columns = np.flatnonzero(runs.run_counts == 1)
+    xs = line.left + columns
+    ys = (line.top + runs.centers[runs.column_offsets[columns]]) \
+        .astype(np.int64)
+    return xs, ys
+
+
+def get_staff_geometry(stafflines: list[Node]) -> StaffGeometry:
+    """Cached geometry of a staff given by its stafflines (in any order)"""
+    key = tuple(sorted(_get_line_key(line) for line in stafflines))
+    geometry = _staff_cache.get(key)
+    if geometry is not None:
+        _staff_cache.move_to_end(key)
+        return geometry
+
+    geometry = compute_staff_geometry(
+        [Mask.from_node(line) for line in stafflines]
+    )
+    _staff_cache[key] = geometry
+    if len(_staff_cache) > MAX_CACHED_STAVES:
+        _staff_cache.popitem(last=False)
+    return geometry
+
+
+def compute_staff_geometry(stafflines: list[Mask]) -> StaffGeometry:
+    """
+    Samples the line centers in every column of the staff. Where a line
+    does not cross a column exactly once (gaps, touching symbols, beyond
+    its ends) the position is interpolated from the nearest columns.
+    Raises ValueError when fewer than two lines cross any column.
+    """
+    centers = [get_line_centers(line) for line in stafflines]
+    centers = [(xs, ys) for xs, ys in centers if len(xs) > 0]
+    if len(centers) < 2:
+        raise ValueError(
+            f"A staff needs at least two stafflines to find its geometry, "
+            f"it has {len(centers)} out of {len(stafflines)} usable."
+        )
+    centers.sort(key=lambda c: np.median(c[1]))
+
+    left = min(int(xs[0]) for xs, _ in centers)
+    right = max(int(xs[-1]) + 1 for xs, _ in centers)
+    columns = np.arange(left, right)
+    line_ys = np.stack([np.interp(columns, xs, ys) for xs, ys in centers])
+    line_ys.flags.writeable = False
+
+    return StaffGeometry(left=left, line_ys=line_ys)
+
+
+def _get_line_key(line: Node) -> Hashable:
+    return (line.id, line.left, line.top, line.width, line.height)
@@ -0,0 +1,142 @@
+from collections import defaultdict
+from mung.node import Node
+
+
+# Snapping used to receive all the nodes of the document and run the snap
+# engines over all of them, even when the user moved only a few noteheads.
+# The staff index keeps the document nodes in python between the calls,
+# updated by javascript with just the nodes that changed. Nodes are found
+# by their bbox through a uniform grid, staves through their bands
+# (the staff bbox grown vertically, to cover ledger lines), so that
+# snapping can be run only on the changed nodes and their surroundings.
+
+GRID_CELL_SIZE = 256
+"""Size of the grid cells in pixels"""
+
+STAFF_BAND_EXTENT = 1.0
+"""How far do staff bands reach above and below the staff, in staff heights"""
+
+STAFF_CLASS_NAMES = {"staff", "staffLine", "staffSpace"}
+
+
+class StaffIndex:
+    """Document nodes kept in python, with a spatial index over them"""
+
+    def __init__(self, cell_size: int = GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self._nodes: dict[int, Node] = {}
+        self._cells: defaultdict[tuple[int, int], set[int]] = \
+            defaultdict(set)
+        self._node_cells: dict[int, list[tuple[int, int]]] = {}
+        self._bands: dict[int, tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def reset(self, nodes: list[Node]) -> None:
+        """Replaces the whole content of the index"""
+        self._nodes.clear()
+        self._cells.clear()
+        self._node_cells.clear()
+        self._bands.clear()
+        self.update(nodes, [])
+
+    def update(self, nodes: list[Node], removed_node_ids: list[int]) -> None:
+        """Inserts or replaces the given nodes (by ID) and removes others"""
+        for node_id in removed_node_ids:
+            self._remove(node_id)
+        for node in nodes:
+            self._remove(node.id)
+            self._insert(node)
+
+    def has_node(self, node_id: int) -> bool:
+        return node_id in self._nodes
+
+    def get_node(self, node_id: int) -> Node:
+        return self._nodes[node_id]
+
+    @property
+    def nodes(self) -> list[Node]:
+        return list(self._nodes.values())
+
+    def query_rect(
+            self,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+    ) -> list[Node]:
+        """Nodes whose bbox intersects the given rectangle"""
+        node_ids: set[int] = set()
+        for cell in self._get_cells(left, top, width, height):
+            node_ids.update(self._cells.get(cell, ()))
+        return [
+            node for node in map(self._nodes.__getitem__, node_ids)
+            if node.left < left + width and left < node.left + node.width
+            and node.top < top + height and top < node.top + node.height
+        ]
+
+    def get_staves_in_rows(self, top: int, bottom: int) -> list[Node]:
+        """Staves whose band intersects the given range of rows"""
+        return [
+            self._nodes[staff_id]
+            for staff_id, (band_top, band_bottom) in self._bands.items()
+            if band_top < bottom and top < band_bottom
+        ]
+
+    def get_staff_objects(self, staff: Node) -> list[Node]:
+        """The staff with its stafflines and staffspaces"""
+        return [staff] + [
+            self._nodes[i] for i in staff.outlinks
+            if i in self._nodes
+            and self._nodes[i].class_name in STAFF_CLASS_NAMES
+        ]
+
+    def get_band_nodes(self, staff: Node) -> list[Node]:
+        """All the nodes intersecting the band of the given staff"""
+        band_top, band_bottom = self._bands[staff.id]
+        return self.query_rect(
+            staff.left, band_top, staff.width, band_bottom - band_top
+        )
+
+    def _insert(self, node: Node) -> None:
+        self._nodes[node.id] = node
+        cells = self._get_cells(node.left, node.top, node.width, node.height)
+        for cell in cells:
+            self._cells[cell].add(node.id)
+        self._node_cells[node.id] = cells
+        if node.class_name == "staff":
+            extent = int(node.height * STAFF_BAND_EXTENT)
+            self._bands[node.id] = (
+                node.top - extent, node.top + node.height + extent
+            )
+
+    def _remove(self, node_id: int) -> None:
+        if node_id not in self._nodes:
+            return
+        for cell in self._node_cells.pop(node_id):
+            cell_ids = self._cells[cell]
+            cell_ids.discard(node_id)
+            if len(cell_ids) == 0:
+                del self._cells[cell]
+        self._bands.pop(node_id, None)
+        del self._nodes[node_id]
+
+    def _get_cells(
+            self,
+            left: int,
+            top: int,
+            width: int,
+            height: int,
+    ) -> list[tuple[int, int]]:
+        # grid cells covered by the rectangle, an empty one still gets a cell
+        x1, y1 = left // self.cell_size, top // self.cell_size
+        x2 = (left + max(width, 1) - 1) // self.cell_size
+        y2 = (top + max(height, 1) - 1) // self.cell_size
+        return [
+            (x, y) for y in range(y1, y2 + 1) for x in range(x1, x2 + 1)
+        ]
+
+
+# the index instance used by MuNG Studio
+staff_index = StaffIndex()
@@ -0,0 +1,107 @@
+import time
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Hashable
+from mung.node import Node
+from mstudio.mask import Mask
+from mstudio.background_image_tools.detect_stafflines \
+    import detect_stafflines_in_lightness
+from mstudio.mask_manipulation.compute_cut_lines import compute_cut_lines
+from mstudio.mask_manipulation.separate_lines import separate_lines
+from mstudio.mask_manipulation.generate_staff_from_stafflines \
+    import generate_staves_from_stafflines
+from mstudio.mask_manipulation.generate_staffspaces \
+    import generate_staffspaces
+from mstudio.mask_manipulation.staff_geometry \
+    import StaffLookup, get_staff_geometry
+
+
+# Setting up the staves of a page used to be a chain of worker calls
+# (detect stafflines, compute cut lines, separate lines, generate staves,
+# generate staffspaces), with masks marshalled back and forth between
+# each of them. The pipeline runs the whole chain inside the worker
+# and only the final nodes are sent back.
+
+@dataclass
+class StaffPipelineResult:
+    """Nodes created by the staff pipeline, with temporary IDs"""
+
+    stafflines: list[Node] = field(default_factory=list)
+    staves: list[Node] = field(default_factory=list)
+    staffspaces: list[Node] = field(default_factory=list)
+
+    links: list[tuple[int, int]] = field(default_factory=list)
+    """Syntax links (from, to) between the created nodes"""
+
+    timings: dict[str, float] = field(default_factory=dict)
+    """How many milliseconds each stage took"""
+
+    @property
+    def nodes(self) -> list[Node]:
+        return self.stafflines + self.staves + self.staffspaces
+
+
+def run_staff_pipeline(
+        lightness: np.ndarray,
+        left: int,
+        top: int,
+        cache_key: Hashable | None = None,
+) -> StaffPipelineResult:
+    """
+    Creates staffLine, staff and staffSpace nodes from a region
+    of the background image, given by its lightness plane and
+    the page position of its top-left corner
+    """
+    result = StaffPipelineResult()
+    stage_start = time.perf_counter()
+
+    def end_stage(name: str) -> None:
+        nonlocal stage_start
+        now = time.perf_counter()
+        result.timings[name] = (now - stage_start) * 1000
+        stage_start = now
+
+    # the mask of all the stafflines in the region
+    plane = detect_stafflines_in_lightness(lightness, cache_key=cache_key)
+    mask = Mask.from_alpha(left, top, plane).clamp_to_content()
+    end_stage("detectStafflines")
+    if mask.is_empty():
+        return result
+
+    cut_lines = compute_cut_lines(mask, adaptive=True, subpixel=True)
+    end_stage("computeCutLines")
+
+    line_masks = separate_lines(mask, cut_lines)
+    result.stafflines = [
+        m.to_node(id_=i, class_name="staffLine")
+        for i, m in enumerate(line_masks)
+    ]
+    end_stage("separateLines")
+
+    staves = generate_staves_from_stafflines(
+        result.stafflines, first_id=len(result.stafflines)
+    )
+    for staff, stafflines in staves:
+        for line in stafflines:
+            staff.outlinks.append(line.id)
+            line.inlinks.append(staff.id)
+            result.links.append((staff.id, line.id))
+        result.staves.append(staff)
+    end_stage("generateStaves")
+
+    diff = generate_staffspaces(result.stafflines + result.staves)
+    result.staffspaces = [
+        n for n in diff.added_nodes if n.class_name == "staffSpace"
+    ]
+    lookup = StaffLookup([
+        get_staff_geometry(stafflines) for _, stafflines in staves
+    ])
+    for staffspace in result.staffspaces:
+        staff, _ = staves[lookup.get_staff_index(
+            staffspace.top + staffspace.height / 2
+        )]
+        result.links.append((staff.id, staffspace.id))
+    end_stage("generateStaffspaces")
+
+    return result
+
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from mung.node import Node
+from mstudio.marshalling import marshal_mask_compressed, \
+    unmarshal_mask_compressed, marshal_mung_node_batch, \
+    unmarshal_mung_node_batch, MASK_ENCODING_RAW, MASK_ENCODING_BITS, \
+    MASK_ENCODING_RLE
+from mstudio.mask import Mask
+
+
+def make_nodes() -> list[Node]:
+    rng = np.random.default_rng(0)
+    return [
+        Node(
+            id_=3, class_name="noteheadFull",
+            top=10, left=20, width=7, height=5,
+            outlinks=[8], inlinks=[],
+            mask=(rng.random((5, 7)) < 0.5).view(np.uint8),
+            data={
+                "precedence_outlinks": [4],
+                "precedence_inlinks": [],
+                "text_transcription": None,
+            },
+        ),
+        Node(
+            id_=8, class_name="staff",
+            top=0, left=0, width=300, height=40,
+            outlinks=[], inlinks=[3],
+            mask=None,
+            data={
+                "precedence_outlinks": [],
+                "precedence_inlinks": [3],
+                "text_transcription": "treble",
+            },
+        ),
+        Node(
+            id_=4, class_name="noteheadFull",
+            top=12, left=40, width=1, height=1,
+            outlinks=[], inlinks=[],
+            mask=np.ones((1, 1), dtype=np.uint8),
+            data={
+                "precedence_outlinks": [],
+                "precedence_inlinks": [3],
+                "text_transcription": None,
+            },
+        ),
+    ]
+
+
+def node_fields(node: Node) -> tuple:
+    return (
+        node.id, node.class_name,
+        node.top, node.left, node.width, node.height,
+        list(node.outlinks), list(node.inlinks), node.data,
+    )
+
+
+def test_node_batch_round_trip():
+    nodes = make_nodes()
+    batch = marshal_mung_node_batch(nodes)
+
+    # the typed arrays arrive from javascript as buffers
+    batch = {
+        key: memoryview(value) if isinstance(value, np.ndarray) else value
+        for key, value in batch.items()
+    }
+    unmarshalled = unmarshal_mung_node_batch(batch)
+
+    assert [node_fields(n) for n in unmarshalled] == \
+        [node_fields(n) for n in nodes]
+    for original, received in zip(nodes, unmarshalled):
+        if original.mask is None:
+            assert received.mask is None
+        else:
+            assert np.array_equal(received.mask, original.mask)
+
+
+def test_empty_node_batch_round_trip():
+    assert unmarshal_mung_node_batch(marshal_mung_node_batch([])) == []
+
+
+@pytest.mark.parametrize("plane,encoding", [
+    (np.eye(10, dtype=np.uint8), MASK_ENCODING_RAW),
+    ((np.random.default_rng(0).random((100, 100)) < 0.5).view(np.uint8),
+        MASK_ENCODING_BITS),
+    (np.pad(np.ones((60, 60), dtype=np.uint8), 20), MASK_ENCODING_RLE),
+    (np.ones((100, 100), dtype=np.uint8), MASK_ENCODING_RLE),
+])
+def test_compressed_mask_round_trip(plane, encoding):
+    marshalled = marshal_mask_compressed(plane)
+    assert marshalled[2] == encoding
+    assert np.array_equal(unmarshal_mask_compressed(marshalled), plane)
+
+
+def test_mask_alpha_round_trip():
+    mask = Mask(5, 6, np.eye(4, dtype=np.uint8))
+    width, height, data = mask.marshal_alpha()
+    received = Mask.unmarshal_alpha(5, 6, (width, height, memoryview(data)))
+    assert np.array_equal(received.plane, mask.plane)
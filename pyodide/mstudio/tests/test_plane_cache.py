@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from mstudio.background_image_tools.plane_cache import PlaneCache, \
+    get_content_key
+
+
+def test_value_is_computed_once():
+    cache = PlaneCache(max_bytes=1000)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.zeros(10, dtype=np.uint8)
+
+    first = cache.get_or_compute("a", compute)
+    second = cache.get_or_compute("a", compute)
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_cached_arrays_are_read_only():
+    cache = PlaneCache(max_bytes=1000)
+    plane = cache.get_or_compute(
+        "plane", lambda: np.zeros(4, dtype=np.uint8)
+    )
+    blurred, histogram = cache.get_or_compute("tuple", lambda: (
+        np.zeros(4, dtype=np.uint8), np.zeros(4, dtype=np.int64)
+    ))
+    for array in (plane, blurred, histogram):
+        with pytest.raises(ValueError):
+            array[0] = 1
+
+
+def test_cache_stays_within_its_budget_in_lru_order():
+    cache = PlaneCache(max_bytes=300)
+    computed: list[str] = []
+
+    def get(key: str) -> np.ndarray:
+        def compute():
+            computed.append(key)
+            return np.zeros(100, dtype=np.uint8)
+        return cache.get_or_compute(key, compute)
+
+    for key in "abc":
+        get(key)
+    assert cache.total_bytes == 300
+
+    # "a" was used last, so "b" is the one evicted
+    get("a")
+    get("d")
+    assert cache.total_bytes == 300
+    assert computed == ["a", "b", "c", "d"]
+
+    get("a")
+    get("b")
+    assert computed == ["a", "b", "c", "d", "b"]
+
+
+def test_values_over_the_budget_are_not_cached():
+    cache = PlaneCache(max_bytes=100)
+    cache.get_or_compute("small", lambda: np.zeros(60, dtype=np.uint8))
+    large = cache.get_or_compute("large", lambda: np.zeros(
+        200, dtype=np.uint8
+    ))
+    assert large.shape == (200,)
+    assert cache.total_bytes == 60
+
+
+def test_content_key_depends_on_shape_and_dtype():
+    pixels = np.zeros(12, dtype=np.uint8)
+    keys = {
+        get_content_key(pixels),
+        get_content_key(pixels.reshape(3, 4)),
+        get_content_key(pixels.reshape(4, 3)),
+        get_content_key(pixels.view(np.int16)),
+    }
+    assert len(keys) == 4
+    assert get_content_key(pixels) == get_content_key(pixels.copy())
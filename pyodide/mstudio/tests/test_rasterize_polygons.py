@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from mstudio.mask_manipulation.rasterize_polygons import \
+    rasterize_polygon, rasterize_polygons, rasterize_label_map
+
+
+def test_rectangle_fills_its_tight_bbox():
+    mask = rasterize_polygon([[(10, 20), (14, 20), (14, 23), (10, 23)]])
+    assert (mask.left, mask.top, mask.width, mask.height) == (10, 20, 5, 4)
+    assert mask.plane.all()
+
+
+def test_holes_stay_unset_inside():
+    outer = [(0, 0), (10, 0), (10, 10), (0, 10)]
+    hole = [(3, 3), (7, 3), (7, 7), (3, 7)]
+    mask = rasterize_polygon([outer, hole])
+    assert (mask.width, mask.height) == (11, 11)
+    assert mask.plane[5, 5] == 0
+    assert mask.plane[4:7, 4:7].sum() == 0
+    assert mask.plane[1, 1] == 1
+    assert mask.plane[3, 3] == 1 # the ring of the hole is set
+
+
+def test_polygons_are_rasterized_in_order():
+    masks = rasterize_polygons([
+        [[(0, 0), (2, 0), (2, 2)]],
+        [[(50, 50), (60, 50), (60, 55), (50, 55)]],
+    ])
+    assert [(m.left, m.top) for m in masks] == [(0, 0), (50, 50)]
+
+
+def test_polygon_without_vertices_is_rejected():
+    with pytest.raises(ValueError):
+        rasterize_polygon([])
+    with pytest.raises(ValueError):
+        rasterize_polygons([[[(0, 0), (1, 1), (0, 1)]], [[]]])
+
+
+def test_subpixel_vertices_round_to_pixels():
+    mask = rasterize_polygon([[(0.25, 0.25), (3.75, 0.25), (3.75, 1.75)]])
+    assert (mask.left, mask.top) == (0, 0)
+    assert mask.right == 5 and mask.bottom <= 3
+
+
+def test_label_map_gives_shared_boundaries_to_later_polygons():
+    upper = [[(0, 0), (10, 0), (10, 5), (0, 5)]]
+    lower = [[(0, 5), (10, 5), (10, 9), (0, 9)]]
+    labels = rasterize_label_map(10, 10, [upper, lower])
+    assert labels.dtype == np.int32
+    assert (labels[:5] == 1).all()
+    assert (labels[5:] == 2).all()
+
+
+def test_label_map_matches_separate_rasterization():
+    polygons = [
+        [[(2, 1), (30, 3), (25, 20), (4, 15)]],
+        [[(40, 5), (60, 5), (50, 30)]],
+    ]
+    labels = rasterize_label_map(70, 40, polygons)
+    for label, polygon in enumerate(polygons, start=1):
+        mask = rasterize_polygon(polygon)
+        expected = np.zeros((40, 70), dtype=bool)
+        expected[mask.top:mask.bottom, mask.left:mask.right] = \
+            mask.plane != 0
+        assert np.array_equal(labels == label, expected)
@@ -0,0 +1,75 @@
+import numpy as np
+import cv2
+from mstudio.background_image_tools.sauvola_binarize_region import \
+    sauvola_binarize_lightness, compute_sauvola_threshold, \
+    SAUVOLA_K, SAUVOLA_R
+
+
+def make_page(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Unevenly lit paper with lines of ink, as a lightness plane"""
+    rng = np.random.default_rng(seed)
+    lighting = np.linspace(150, 240, width)[None, :]
+    page = rng.normal(lighting, 10, (height, width))
+    for y in range(10, height - 10, 8):
+        page[y:y + 2, 5:width - 5] -= 120
+    return page.clip(0, 255).astype(np.uint8)
+
+
+def naive_sauvola_threshold(
+        lightness: np.ndarray,
+        radius: int,
+        k: float,
+) -> np.ndarray:
+    """The threshold of each pixel from its window clipped by the borders"""
+    height, width = lightness.shape
+    plane = lightness.astype(np.float64)
+    threshold = np.empty((height, width))
+    for y in range(height):
+        for x in range(width):
+            window = plane[
+                max(y - radius, 0):y + radius + 1,
+                max(x - radius, 0):x + radius + 1,
+            ]
+            mean, std = window.mean(), window.std()
+            threshold[y, x] = mean * (1 + k * (std / SAUVOLA_R - 1))
+    return threshold
+
+
+def test_threshold_matches_naive_computation():
+    page = make_page(40, 30)
+    radius = 5
+    integrals = cv2.integral2(page, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    threshold = compute_sauvola_threshold(
+        integrals, (slice(0, 30), slice(0, 40)), radius, SAUVOLA_K
+    )
+    expected = naive_sauvola_threshold(page, radius, SAUVOLA_K)
+    assert np.allclose(threshold, expected)
+
+
+def test_threshold_of_a_part_matches_the_whole():
+    page = make_page(40, 30)
+    integrals = cv2.integral2(page, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    whole = compute_sauvola_threshold(
+        integrals, (slice(0, 30), slice(0, 40)), 5, SAUVOLA_K
+    )
+    part = compute_sauvola_threshold(
+        integrals, (slice(7, 19), slice(3, 35)), 5, SAUVOLA_K
+    )
+    assert np.array_equal(part, whole[7:19, 3:35])
+
+
+def test_tiled_sauvola_matches_untiled():
+    page = make_page(300, 200)
+    untiled = sauvola_binarize_lightness(page, tile_size=1000, window=15)
+    tiled = sauvola_binarize_lightness(page, tile_size=41, window=15)
+    assert np.array_equal(tiled, untiled)
+
+
+def test_sauvola_finds_ink_under_uneven_lighting():
+    page = make_page(300, 200)
+    binarized = sauvola_binarize_lightness(page, window=15)
+    ink = np.zeros_like(page, dtype=bool)
+    for y in range(10, 190, 8):
+        ink[y:y + 2, 5:295] = True
+    assert (binarized[ink] == 255).mean() > 0.99
+    assert (binarized[~ink] == 0).mean() > 0.95
@@ -0,0 +1,72 @@
+import numpy as np
+import cv2
+from mstudio.mask import Mask
+from mstudio.mask_manipulation.compute_cut_lines import compute_cut_lines
+from mstudio.mask_manipulation.separate_lines import separate_lines
+
+
+def make_stafflines(
+        left: int,
+        top: int,
+        width: int,
+        height: int,
+        skew: int,
+) -> Mask:
+    """Five skewed stafflines of two pixels"""
+    plane = np.zeros((height, width), dtype=np.uint8)
+    for i in range(5):
+        y = 10 + i * 12
+        cv2.line(plane, (0, y), (width - 1, y + skew), 1, 2)
+    return Mask(left, top, plane)
+
+
+def paste(masks: list[Mask], like: Mask) -> np.ndarray:
+    """How many of the masks cover each pixel of the given mask"""
+    coverage = np.zeros(like.plane.shape, dtype=np.int32)
+    for mask in masks:
+        part = mask.crop(like.left, like.top, like.width, like.height)
+        assert part.count() == mask.count() # no pixels outside
+        coverage += part.plane
+    return coverage
+
+
+def test_lines_partition_the_mask():
+    for skew in (0, 8, 30):
+        mask = make_stafflines(100, 200, 300, 100, skew)
+        cut_lines = compute_cut_lines(mask, adaptive=True, subpixel=True)
+        lines = separate_lines(mask, cut_lines)
+
+        assert len(lines) == 5
+        assert np.array_equal(paste(lines, mask), mask.plane)
+
+
+def test_lines_are_clamped_to_content():
+    mask = make_stafflines(100, 200, 300, 100, 8)
+    lines = separate_lines(mask, compute_cut_lines(mask))
+    for line in lines:
+        assert line.clamp_to_content().plane.shape == line.plane.shape
+
+
+def test_pixels_on_a_cut_belong_to_the_lower_line():
+    plane = np.zeros((10, 4), dtype=np.uint8)
+    plane[2, :] = 1
+    plane[5, :] = 1 # exactly on the cut
+    plane[8, :] = 1
+    mask = Mask(0, 0, plane)
+
+    upper, lower = separate_lines(mask, [[(0, 5), (4, 5)]])
+
+    assert (upper.top, upper.height) == (2, 1)
+    assert (lower.top, lower.height) == (5, 4)
+    assert lower.plane[:, 0].tolist() == [1, 0, 0, 1]
+
+
+def test_empty_bands_are_left_out():
+    plane = np.zeros((30, 10), dtype=np.uint8)
+    plane[3, :] = 1
+    plane[25, :] = 1
+    mask = Mask(0, 0, plane)
+
+    lines = separate_lines(mask, [[(0, 10), (10, 10)], [(0, 20), (10, 20)]])
+
+    assert [line.top for line in lines] == [3, 25]
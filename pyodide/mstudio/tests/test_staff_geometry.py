@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from mung.node import Node
+from mstudio.mask import Mask
+from mstudio.mask_manipulation.column_runs import compute_column_runs
+from mstudio.mask_manipulation.staff_geometry import StaffLookup, \
+    get_line_centers, get_staff_geometry, compute_staff_geometry
+
+
+def naive_column_runs(plane: np.ndarray) -> list[list[tuple[int, int]]]:
+    """(start, end) of the runs of set pixels in each column"""
+    columns = []
+    for column in plane.T:
+        runs, start = [], None
+        for y, value in enumerate(column.tolist() + [0]):
+            if value and start is None:
+                start = y
+            if not value and start is not None:
+                runs.append((start, y))
+                start = None
+        columns.append(runs)
+    return columns
+
+
+def make_line(id_: int, left: int, y: int, width: int) -> Node:
+    """A horizontal staffline, two pixels thick"""
+    return Node(
+        id_=id_, class_name="staffLine",
+        top=y, left=left, width=width, height=2,
+        mask=np.ones((2, width), dtype=np.uint8),
+    )
+
+
+def make_staff(first_id: int, top: int) -> list[Node]:
+    return [make_line(first_id + i, 10, top + 10 * i, 100) for i in range(5)]
+
+
+def test_column_runs_match_naive_computation():
+    rng = np.random.default_rng(0)
+    plane = (rng.random((20, 30)) < 0.4).view(np.uint8)
+    runs = compute_column_runs(plane)
+    for x, expected in enumerate(naive_column_runs(plane)):
+        a, b = runs.column_offsets[x], runs.column_offsets[x + 1]
+        assert list(zip(runs.starts[a:b], runs.ends[a:b])) == expected
+        assert runs.run_counts[x] == len(expected)
+
+
+def test_line_centers_skip_columns_crossed_more_than_once():
+    plane = np.zeros((10, 5), dtype=np.uint8)
+    plane[4:6, :] = 1
+    plane[8, 2] = 1 # a touching symbol
+    xs, ys = get_line_centers(Mask(100, 50, plane))
+    assert xs.tolist() == [100, 101, 103, 104]
+    assert ys.tolist() == [55, 55, 55, 55]
+
+
+def test_geometry_interpolates_over_gaps():
+    top = Mask(0, 0, np.ones((1, 20), dtype=np.uint8))
+    plane = np.ones((1, 20), dtype=np.uint8)
+    plane[0, 5:15] = 0 # a gap in the bottom line
+    bottom = Mask(0, 40, plane)
+    geometry = compute_staff_geometry([bottom, top])
+
+    assert geometry.left == 0
+    assert geometry.tops.tolist() == [0] * 20
+    assert np.allclose(geometry.bottoms, 40)
+
+
+def test_geometry_needs_two_lines():
+    line = Mask(0, 0, np.ones((1, 20), dtype=np.uint8))
+    empty = Mask(0, 10, np.zeros((1, 20), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        compute_staff_geometry([line, empty])
+
+
+def test_geometry_is_cached_by_lines():
+    staff = make_staff(0, 100)
+    geometry = get_staff_geometry(staff)
+    assert get_staff_geometry(list(reversed(staff))) is geometry
+
+    moved = staff[:4] + [make_line(4, 10, 145, 100)]
+    assert get_staff_geometry(moved) is not geometry
+
+
+def test_lookup_finds_the_closest_staff():
+    upper = get_staff_geometry(make_staff(0, 100))
+    lower = get_staff_geometry(make_staff(5, 300))
+    lookup = StaffLookup([lower, upper])
+
+    assert lookup.get_staff_index(0) == 1
+    assert lookup.get_staff_index(130) == 1
+    assert lookup.get_staff_index(215) == 1
+    assert lookup.get_staff_index(230) == 0
+    assert lookup.get_staff_index(1000) == 0
@@ -0,0 +1,72 @@
+import numpy as np
+import cv2
+import pytest
+from mstudio.background_image_tools.tiling import iterate_tiles, \
+    otsu_threshold_from_histogram
+from mstudio.background_image_tools.otsu_binarize_region \
+    import otsu_binarize_lightness
+from mstudio.background_image_tools.detect_stafflines \
+    import detect_stafflines_in_lightness
+
+
+def make_page(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Noisy paper with a few lines and blots of ink, as a lightness plane"""
+    rng = np.random.default_rng(seed)
+    page = rng.normal(220, 12, (height, width)).clip(0, 255).astype(np.uint8)
+    for y in range(20, height - 20, 9):
+        cv2.line(page, (10, y), (width - 10, y + 3), 30, 1)
+    for _ in range(20):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        cv2.circle(page, (int(x), int(y)), 4, 40, -1)
+    return page
+
+
+@pytest.mark.parametrize("width,height,tile_size,margin", [
+    (100, 80, 32, 5),
+    (64, 64, 64, 10),
+    (10, 300, 7, 0),
+])
+def test_tiles_cover_each_pixel_once(width, height, tile_size, margin):
+    coverage = np.zeros((height, width), dtype=np.int32)
+    for tile in iterate_tiles(width, height, tile_size, margin):
+        coverage[tile.inner] += 1
+
+        # the inner part lies in the outer part, at the same place
+        outer = np.arange(width * height).reshape(height, width)[tile.outer]
+        inner = np.arange(width * height).reshape(height, width)[tile.inner]
+        assert np.array_equal(outer[tile.inner_in_outer], inner)
+
+        # margins are clipped only by the region borders
+        rows, columns = tile.outer
+        assert rows.start == max(tile.inner[0].start - margin, 0)
+        assert rows.stop == min(tile.inner[0].stop + margin, height)
+        assert columns.start == max(tile.inner[1].start - margin, 0)
+        assert columns.stop == min(tile.inner[1].stop + margin, width)
+    assert (coverage == 1).all()
+
+
+def test_otsu_threshold_matches_opencv():
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        plane = np.concatenate([
+            rng.normal(60, 20, 500), rng.normal(190, 30, 1500)
+        ]).clip(0, 255).astype(np.uint8).reshape(40, 50)
+        expected, _ = cv2.threshold(
+            plane, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+        )
+        histogram = np.bincount(plane.ravel(), minlength=256)
+        assert otsu_threshold_from_histogram(histogram) == int(expected)
+
+
+def test_tiled_otsu_matches_untiled():
+    page = make_page(300, 200)
+    untiled = otsu_binarize_lightness(page, tile_size=1000)
+    tiled = otsu_binarize_lightness(page, tile_size=37)
+    assert np.array_equal(tiled, untiled)
+
+
+def test_tiled_staffline_detection_matches_untiled():
+    page = make_page(400, 300)
+    untiled = detect_stafflines_in_lightness(page, tile_size=1000)
+    tiled = detect_stafflines_in_lightness(page, tile_size=64)
+    assert np.array_equal(tiled, untiled)
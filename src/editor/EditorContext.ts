@@ -229,6 +229,7 @@ export function useConstructContextServices(
         editorStateStore,
         pythonRuntime,
         classVisibilityStore,
+        backgroundImageStore,
       ),
     [],
   );
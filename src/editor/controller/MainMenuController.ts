@@ -11,6 +11,9 @@ import { Node } from "../../mung/Node";
 import { ClassVisibilityStore } from "../model/ClassVisibilityStore";
 import { EditorStateStore } from "../model/EditorStateStore";
 import { ZoomController } from "./ZoomController";
+import { BackgroundImageStore } from "../model/BackgroundImageStore";
+import { GraphDiff } from "../../../pyodide/marshalling";
+import { StaffPipelineResult } from "../../../pyodide/BackgroundImageToolsApi";
 
 /**
  * Implements the logic and keyboard shortcuts behind actions from
@@ -28,6 +31,30 @@ export class MainMenuController implements IController {
   private readonly editorStateStore: EditorStateStore;
   private readonly pythonRuntime: PythonRuntime;
   private readonly classVisibilityStore: ClassVisibilityStore;
+  private readonly backgroundImageStore: BackgroundImageStore;
+
+  /**
+   * Whether the python staff index (used for snapping) already holds
+   * the document, so that it can be updated with just the changes
+   */
+  private isStaffIndexSynced = false;
+
+  /**
+   * Nodes that changed in any way since the last snapping
+   * and must be sent to the python staff index
+   */
+  private readonly staffIndexUpdatedIds = new Set<number>();
+
+  /**
+   * Nodes removed since the last snapping
+   */
+  private readonly staffIndexRemovedIds = new Set<number>();
+
+  /**
+   * Nodes inserted or modified (not just linked) since the last snapping,
+   * these are the ones that need to be snapped again
+   */
+  private readonly snapPendingIds = new Set<number>();
 
   constructor(
     jotaiStore: JotaiStore,
@@ -38,6 +65,7 @@ export class MainMenuController implements IController {
     editorStateStore: EditorStateStore,
     pythonRuntime: PythonRuntime,
     classVisibilityStore: ClassVisibilityStore,
+    backgroundImageStore: BackgroundImageStore,
   ) {
     this.jotaiStore = jotaiStore;
     this.notationGraphStore = notationGraphStore;
@@ -47,6 +75,23 @@ export class MainMenuController implements IController {
     this.editorStateStore = editorStateStore;
     this.pythonRuntime = pythonRuntime;
     this.classVisibilityStore = classVisibilityStore;
+    this.backgroundImageStore = backgroundImageStore;
+
+    // track changes for incremental snapping
+    notationGraphStore.onNodeInserted.subscribe((node) => {
+      this.staffIndexRemovedIds.delete(node.id);
+      this.staffIndexUpdatedIds.add(node.id);
+      this.snapPendingIds.add(node.id);
+    });
+    notationGraphStore.onNodeUpdatedOrLinked.subscribe((meta) => {
+      this.staffIndexUpdatedIds.add(meta.nodeId);
+      if (!meta.isLinkUpdate) this.snapPendingIds.add(meta.nodeId);
+    });
+    notationGraphStore.onNodeRemoved.subscribe((node) => {
+      this.staffIndexUpdatedIds.delete(node.id);
+      this.snapPendingIds.delete(node.id);
+      this.staffIndexRemovedIds.add(node.id);
+    });
   }
 
   public readonly isEnabledAtom = atom(true);
@@ -116,7 +161,8 @@ export class MainMenuController implements IController {
 
   public canGenerateGraphFromStafflinesAtom = atom((get) => {
     const nodes = get(this.selectionStore.selectedNodesAtom);
-    if (nodes.length !== 5) {
+    // one or more whole staves of 5 lines each
+    if (nodes.length === 0 || nodes.length % 5 !== 0) {
       return false;
     }
     for (const node of nodes) {
@@ -127,6 +173,20 @@ export class MainMenuController implements IController {
     return true;
   });
 
+  public canGenerateStavesFromImageAtom = atom((get) =>
+    get(this.backgroundImageStore.isReadyAtom),
+  );
+
+  public canRegenerateStaffspacesAtom = atom((get) => {
+    const nodes = get(this.selectionStore.selectedNodesAtom);
+    return nodes.length > 0 && nodes.every((n) => n.className === "staff");
+  });
+
+  public canCleanUpMasksAtom = atom((get) => {
+    const nodes = get(this.selectionStore.selectedNodesAtom);
+    return nodes.length > 0;
+  });
+
   ////////////////////////////
   // Action implementations //
   ////////////////////////////
@@ -199,38 +259,51 @@ export class MainMenuController implements IController {
         syntaxOutlinks: [],
       }));
 
-    // create the staff object
-    console.log("Generating the staff...");
-    const proposedStaff = await api.generateStaffFromStafflines(staffLines);
-    const staff: Node = {
-      id: this.notationGraphStore.getFreeId(),
-      className: "staff",
-      top: proposedStaff.top,
-      left: proposedStaff.left,
-      width: proposedStaff.width,
-      height: proposedStaff.height,
-      syntaxInlinks: [],
-      syntaxOutlinks: [],
-      precedenceInlinks: [],
-      precedenceOutlinks: [],
-      decodedMask: proposedStaff.decodedMask,
-      textTranscription: null,
-      data: {},
-      polygon: null,
-    };
-    this.notationGraphStore.insertNode(staff);
+    // create the staff objects
+    console.log("Generating the staves...");
+    const proposedStaves = await api.generateStavesFromStafflines(staffLines);
+    const staves: Node[] = [];
+    for (const { staff: proposedStaff, stafflineIds } of proposedStaves) {
+      const staff: Node = {
+        id: this.notationGraphStore.getFreeId(),
+        className: "staff",
+        top: proposedStaff.top,
+        left: proposedStaff.left,
+        width: proposedStaff.width,
+        height: proposedStaff.height,
+        syntaxInlinks: [],
+        syntaxOutlinks: [],
+        precedenceInlinks: [],
+        precedenceOutlinks: [],
+        decodedMask: proposedStaff.decodedMask,
+        textTranscription: null,
+        data: {},
+        polygon: null,
+      };
+      staves.push(staff);
+      this.notationGraphStore.insertNode(staff);
 
-    // add syntax links from the new staff to all stafflines
-    for (const line of staffLines) {
-      this.notationGraphStore.insertLink(staff.id, line.id, LinkType.Syntax);
+      // add syntax links from the new staff to its stafflines
+      for (const lineId of stafflineIds) {
+        this.notationGraphStore.insertLink(staff.id, lineId, LinkType.Syntax);
+      }
     }
 
-    // create the staffspace objects and link them from the staff
+    // create the staffspace objects and link them from their staff,
+    // which is found by the staff geometry in python
     console.log("Generating staff spaces...");
-    const proposedStaffspaces = await api.generateStaffspaces(
-      [...staffLines.map((s) => s.id), staff.id].map((id) =>
+    const staffspacesDiff = await api.regenerateStaffspaces(
+      [...staffLines.map((s) => s.id), ...staves.map((s) => s.id)].map((id) =>
         this.notationGraphStore.getNode(id),
       ),
+      staves.map((s) => s.id),
+    );
+    const proposedStaffspaces = staffspacesDiff.addedNodes;
+    const staffIdOfStaffspace = new Map<number, number>(
+      staffspacesDiff.addedLinks.map(([staffId, spaceId]) => [
+        spaceId,
+        staffId,
+      ]),
     );
     const staffSpaces: Node[] = [];
     for (const proposedStaffspace of proposedStaffspaces) {
@@ -253,7 +326,7 @@ export class MainMenuController implements IController {
       staffSpaces.push(staffSpace);
       this.notationGraphStore.insertNode(staffSpace);
       this.notationGraphStore.insertLink(
-        staff.id,
+        staffIdOfStaffspace.get(proposedStaffspace.id)!,
         staffSpace.id,
         LinkType.Syntax,
       );
@@ -265,46 +338,242 @@ export class MainMenuController implements IController {
 
     // select the new nodes
     this.selectionStore.changeSelection([
-      staff.id,
+      ...staves.map((n) => n.id),
       ...staffSpaces.map((n) => n.id),
     ]);
 
     console.log("DONE!");
   }
 
-  public async snapNodesToStaves(): Promise<void> {
+  public async regenerateStaffspaces(): Promise<void> {
+    if (!this.jotaiStore.get(this.canRegenerateStaffspacesAtom)) return;
+
     const api = this.pythonRuntime.maskManipulation;
 
-    // process the entire graph and get the processed copy
-    console.log("Running object snapping...");
-    const snappedGraph = await api.snapNodesToStaves(
-      this.notationGraphStore.nodes,
+    // the selected staves with their stafflines and staffspaces
+    const staves = this.jotaiStore.get(this.selectionStore.selectedNodesAtom);
+    const nodes = [
+      ...staves,
+      ...staves
+        .flatMap((staff) => staff.syntaxOutlinks)
+        .map((id) => this.notationGraphStore.getNode(id)),
+    ];
+
+    console.log("Regenerating staff spaces...");
+    let diff: GraphDiff;
+    try {
+      diff = await api.regenerateStaffspaces(
+        nodes,
+        staves.map((s) => s.id),
+      );
+    } catch (e) {
+      console.error(e);
+      alert(`Staff spaces could not be regenerated: ${(e as Error).message}`);
+      return;
+    }
+
+    // drop the replaced staffspaces
+    for (const nodeId of diff.removedNodeIds) {
+      this.notationGraphStore.removeNodeWithLinks(nodeId);
+    }
+
+    // insert the new ones under free IDs and link them from their staves
+    const ids = new Map<number, number>();
+    for (const proposedNode of diff.addedNodes) {
+      const node: Node = {
+        ...proposedNode,
+        id: this.notationGraphStore.getFreeId(),
+        syntaxInlinks: [],
+        syntaxOutlinks: [],
+        precedenceInlinks: [],
+        precedenceOutlinks: [],
+      };
+      ids.set(proposedNode.id, node.id);
+      this.notationGraphStore.insertNode(node);
+    }
+    for (const [fromId, toId] of diff.addedLinks) {
+      this.notationGraphStore.insertLink(
+        ids.get(fromId) ?? fromId,
+        ids.get(toId) ?? toId,
+        LinkType.Syntax,
+      );
+    }
+
+    this.classVisibilityStore.setClassVisibility("staffSpace", true);
+
+    // links from other nodes to the removed staffspaces are gone,
+    // snapping the staves again links those nodes to the new ones
+    await this.snapNodesToStaves();
+  }
+
+  public async cleanUpSelectedMasks(): Promise<void> {
+    if (!this.jotaiStore.get(this.canCleanUpMasksAtom)) return;
+
+    const api = this.pythonRuntime.maskManipulation;
+
+    // all the selected masks are processed in one go
+    console.log("Cleaning up masks...");
+    const diff = await api.applyMorphology(
+      this.jotaiStore.get(this.selectionStore.selectedNodesAtom),
+      [{ name: "fillHoles" }, { name: "removeSpecks", size: 4 }],
     );
 
-    console.log(snappedGraph);
+    for (const change of diff.changedNodes) {
+      this.notationGraphStore.updateNode({
+        ...this.notationGraphStore.getNode(change.id),
+        ...change,
+      });
+    }
+    console.log(`Updated ${diff.changedNodes.length} masks.`);
+  }
 
-    // extract all staves, stafflines, and staff spaces
-    const interestingInNodeClasses = ["staff", "staffLine", "staffSpace"];
-    const interestingInNodes = snappedGraph.filter((n) =>
-      interestingInNodeClasses.includes(n.className),
+  public async generateStavesFromImage(): Promise<void> {
+    if (!this.jotaiStore.get(this.canGenerateStavesFromImageAtom)) return;
+
+    const api = this.pythonRuntime.backgroundImageToolsApi;
+
+    // the whole page, or just the area of the selected nodes
+    const selectedNodes = this.jotaiStore.get(
+      this.selectionStore.selectedNodesAtom,
     );
+    let rect = new DOMRect(
+      0,
+      0,
+      this.backgroundImageStore.getWidth(),
+      this.backgroundImageStore.getHeight(),
+    );
+    if (selectedNodes.length > 0) {
+      const left = Math.min(...selectedNodes.map((n) => n.left));
+      const top = Math.min(...selectedNodes.map((n) => n.top));
+      const right = Math.max(...selectedNodes.map((n) => n.left + n.width));
+      const bottom = Math.max(...selectedNodes.map((n) => n.top + n.height));
+      rect = new DOMRect(left, top, right - left, bottom - top);
+    }
 
-    // reconstruct created links in our document
-    for (const inNode of interestingInNodes) {
-      for (const inlink of inNode.syntaxInlinks) {
-        const hasLink = this.notationGraphStore.hasLink(
-          inlink,
-          inNode.id,
-          LinkType.Syntax,
+    // run the whole staff pipeline in python
+    console.log("Generating staves from the image...");
+    let result: StaffPipelineResult;
+    try {
+      result = await api.runStaffPipelineInImageRect(
+        this.backgroundImageStore,
+        rect,
+      );
+    } catch (e) {
+      console.error(e);
+      alert(`Staves could not be generated: ${(e as Error).message}`);
+      return;
+    }
+    console.log("Staff pipeline timings [ms]:", result.timings);
+
+    // insert the nodes under free IDs
+    const ids = new Map<number, number>();
+    for (const proposedNode of result.nodes) {
+      const node: Node = {
+        ...proposedNode,
+        id: this.notationGraphStore.getFreeId(),
+        syntaxInlinks: [],
+        syntaxOutlinks: [],
+        precedenceInlinks: [],
+        precedenceOutlinks: [],
+      };
+      ids.set(proposedNode.id, node.id);
+      this.notationGraphStore.insertNode(node);
+    }
+    for (const [fromId, toId] of result.links) {
+      this.notationGraphStore.insertLink(
+        ids.get(fromId)!,
+        ids.get(toId)!,
+        LinkType.Syntax,
+      );
+    }
+
+    // make sure the new objects are visible
+    this.classVisibilityStore.setClassVisibility("staffLine", true);
+    this.classVisibilityStore.setClassVisibility("staff", true);
+    this.classVisibilityStore.setClassVisibility("staffSpace", true);
+
+    // select the new staves
+    this.selectionStore.changeSelection(
+      result.nodes
+        .filter((n) => n.className === "staff")
+        .map((n) => ids.get(n.id)!),
+    );
+  }
+
+  public async snapNodesToStaves(): Promise<void> {
+    const api = this.pythonRuntime.maskManipulation;
+
+    // the first time, the entire graph is sent and processed,
+    // afterwards only the changes are sent and only changed nodes snapped
+    const reset = !this.isStaffIndexSynced;
+    const updatedNodes = reset
+      ? this.notationGraphStore.nodes
+      : [...this.staffIndexUpdatedIds].map((id) =>
+          this.notationGraphStore.getNode(id),
         );
-        if (!hasLink) {
-          this.notationGraphStore.insertLink(
-            inlink,
-            inNode.id,
-            LinkType.Syntax,
-          );
+    const removedNodeIds = [...this.staffIndexRemovedIds];
+    const changedNodeIds = [...this.snapPendingIds];
+    this.staffIndexUpdatedIds.clear();
+    this.staffIndexRemovedIds.clear();
+    this.snapPendingIds.clear();
+
+    // get back only the changes
+    console.log("Running object snapping...");
+    let diff: GraphDiff;
+    try {
+      diff = await api.snapChangedNodesToStaves(
+        updatedNodes,
+        removedNodeIds,
+        changedNodeIds,
+        reset,
+      );
+      this.isStaffIndexSynced = true;
+    } catch (e) {
+      this.isStaffIndexSynced = false;
+      throw e;
+    }
+
+    console.log(diff);
+
+    // only links towards staves, stafflines, and staff spaces are of interest
+    const interestingInNodeClasses = ["staff", "staffLine", "staffSpace"];
+    const isInteresting = (fromId: number, toId: number) =>
+      this.notationGraphStore.hasNode(fromId) &&
+      this.notationGraphStore.hasNode(toId) &&
+      interestingInNodeClasses.includes(
+        this.notationGraphStore.getNode(toId).className,
+      );
+
+    // the python index already holds the diff, nodes of links that are
+    // not applied must be sent again to bring it back to the document
+    const resend = (fromId: number, toId: number) => {
+      for (const id of [fromId, toId]) {
+        if (this.notationGraphStore.hasNode(id)) {
+          this.staffIndexUpdatedIds.add(id);
         }
       }
+    };
+
+    // reconstruct created links in our document
+    for (const [fromId, toId] of diff.addedLinks) {
+      if (!isInteresting(fromId, toId)) {
+        resend(fromId, toId);
+        continue;
+      }
+      if (!this.notationGraphStore.hasLink(fromId, toId, LinkType.Syntax)) {
+        this.notationGraphStore.insertLink(fromId, toId, LinkType.Syntax);
+      }
+    }
+
+    // and remove links that were removed
+    for (const [fromId, toId] of diff.removedLinks) {
+      if (!isInteresting(fromId, toId)) {
+        resend(fromId, toId);
+        continue;
+      }
+      if (this.notationGraphStore.hasLink(fromId, toId, LinkType.Syntax)) {
+        this.notationGraphStore.removeLink(fromId, toId, LinkType.Syntax);
+      }
     }
 
     console.log("DONE!");
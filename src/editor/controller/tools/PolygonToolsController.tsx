@@ -193,10 +193,11 @@ export class PolygonToolsController implements IController {
 
     // binarize polygon
     if (nodeTool === NodeTool.PolygonBinarize) {
-      const binarizedRegion =
-        await this.pythonRuntime.backgroundImageToolsApi.otsuBinarizeRegion(
-          this.backgroundImageStore.getImageData(bbox),
-        );
+      const api = this.pythonRuntime.backgroundImageToolsApi;
+      const binarizedRegion = await api.otsuBinarizeImageRect(
+        this.backgroundImageStore,
+        bbox,
+      );
       const bitmap = await createImageBitmap(binarizedRegion);
       this.nodeEditingController.paintOverTheMask(bbox, (ctx) => {
         ctx.save();
@@ -209,18 +210,25 @@ export class PolygonToolsController implements IController {
 
     // detect stafflines
     if (nodeTool === NodeTool.StafflinesTool) {
+      const api = this.pythonRuntime.backgroundImageToolsApi;
+      const paintRegion = (bitmap: ImageBitmap) => {
+        this.nodeEditingController.paintOverTheMask(bbox, (ctx) => {
+          ctx.save();
+          ctx.clip(path, "nonzero");
+          ctx.globalCompositeOperation = "copy";
+          // the preview is smaller, stretch it without smoothing
+          ctx.imageSmoothingEnabled = false;
+          ctx.drawImage(bitmap, bbox.x, bbox.y, bbox.width, bbox.height);
+          ctx.restore();
+        });
+      };
       const binarizedRegion =
-        await this.pythonRuntime.backgroundImageToolsApi.detectStafflines(
-          this.backgroundImageStore.getImageData(bbox),
+        await api.detectStafflinesProgressivelyInImageRect(
+          this.backgroundImageStore,
+          bbox,
+          async (preview) => paintRegion(await createImageBitmap(preview)),
         );
-      const bitmap = await createImageBitmap(binarizedRegion);
-      this.nodeEditingController.paintOverTheMask(bbox, (ctx) => {
-        ctx.save();
-        ctx.clip(path, "nonzero");
-        ctx.globalCompositeOperation = "copy";
-        ctx.drawImage(bitmap, bbox.x, bbox.y);
-        ctx.restore();
-      });
+      paintRegion(await createImageBitmap(binarizedRegion));
     }
 
     if (nodeTool === NodeTool.SegmentationTool) {
@@ -122,8 +122,11 @@ export class StafflinesToolController implements IController {
       return;
     }
 
-    const cutLines =
-      await this.pythonRuntime.maskManipulation.computeCutLines(mask);
+    // follow the curvature of the lines at full resolution
+    const cutLines = await this.pythonRuntime.maskManipulation.computeCutLines(
+      mask,
+      { adaptive: true, subpixel: true },
+    );
 
     this.jotaiStore.set(this.cutLinesAtom, cutLines);
   }
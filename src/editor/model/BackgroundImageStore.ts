@@ -70,6 +70,17 @@ export class BackgroundImageStore {
     return this.ctx.getImageData(rect.x, rect.y, rect.width, rect.height);
   }
 
+  /**
+   * Returns pixels of the whole image. A new copy is made on each call,
+   * the background image tools read it only to register the image
+   * in the python runtime, keyed by this store.
+   */
+  public getFullImageData(): ImageData {
+    return this.getImageData(
+      new DOMRect(0, 0, this.getWidth(), this.getHeight()),
+    );
+  }
+
   public getWidth(): number {
     return this.jotaiStore.get(this.widthAtom);
   }
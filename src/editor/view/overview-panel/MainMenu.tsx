@@ -84,6 +84,13 @@ export function MainMenu(props: MainMenuProps) {
   const canGenerateGraphFromStafflines = useAtomValue(
     controller.canGenerateGraphFromStafflinesAtom,
   );
+  const canCleanUpMasks = useAtomValue(controller.canCleanUpMasksAtom);
+  const canGenerateStavesFromImage = useAtomValue(
+    controller.canGenerateStavesFromImageAtom,
+  );
+  const canRegenerateStaffspaces = useAtomValue(
+    controller.canRegenerateStaffspacesAtom,
+  );
 
   ////////////////////////////
   // Action implementations //
@@ -133,6 +140,13 @@ export function MainMenu(props: MainMenuProps) {
           Zoom to selected node {renderShortcut("F")}
         </MyMenuItem>
 
+        <MyMenuItem
+          disabled={!canCleanUpMasks}
+          onClick={() => controller.cleanUpSelectedMasks()}
+        >
+          Clean up masks of selected nodes
+        </MyMenuItem>
+
         <MyListDivider />
         <MyCategoryTitle>Links</MyCategoryTitle>
 
@@ -165,6 +179,20 @@ export function MainMenu(props: MainMenuProps) {
           Generate graph from stafflines {renderShortcut("Shift + S")}
         </MyMenuItem>
 
+        <MyMenuItem
+          disabled={!canRegenerateStaffspaces}
+          onClick={() => controller.regenerateStaffspaces()}
+        >
+          Regenerate staffspaces of selected staves
+        </MyMenuItem>
+
+        <MyMenuItem
+          disabled={!canGenerateStavesFromImage}
+          onClick={() => controller.generateStavesFromImage()}
+        >
+          Generate staves from the image
+        </MyMenuItem>
+
         <MyMenuItem
           disabled={false}
           onClick={() => controller.snapNodesToStaves()}